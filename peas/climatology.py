@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from .conditions import Condition
+
+# Columns needed for the climatology, see `peas.tables.load_columns`
+REPORT_COLUMNS = (
+    ('ambient_temp_C', 'f4'),
+    ('sky_temp_C', 'f4'),
+    ('sky_condition_code', 'i1'),
+    ('rain_condition_code', 'i1'),
+    ('wind_speed_KPH', 'f4'),
+    ('safe', bool),
+)
+
+
+def night_intervals(ephemeris, evening='ea', morning='ma'):
+    """ Start and end of each night from an ephemeris table
+
+    A night runs from the `evening` twilight to the first `morning` twilight
+    after it, by default astronomical twilight to astronomical twilight.
+
+    Args:
+        ephemeris (dict):   Rows of `peas.ephemeris.Ephemeris.rows`.
+        evening (str):      Event starting the night.
+        morning (str):      Event ending the night.
+
+    Returns:
+        tuple: Sorted `(starts, ends)` arrays of `datetime64[us]`.
+    """
+    starts = np.unique(ephemeris[evening][~np.isnat(ephemeris[evening])])
+    mornings = np.unique(ephemeris[morning][~np.isnat(ephemeris[morning])])
+
+    index = np.searchsorted(mornings, starts)
+    valid = index < len(mornings)
+
+    return starts[valid], mornings[index[valid]]
+
+
+def assign_nights(dates, starts, ends):
+    """ Index of the night each of `dates` falls in, -1 during the day """
+    dates = np.asarray(dates, dtype='<M8[us]')
+
+    index = np.searchsorted(starts, dates, side='right') - 1
+    inside = (index >= 0) & (dates < ends[np.maximum(index, 0)])
+
+    return np.where(inside, index, -1)
+
+
+def to_frame(arrays, starts=None, ends=None):
+    """ `DataFrame` of the report columns with derived fields
+
+    Adds `clear`, `wet` (wet or rain), `cloudiness` (sky minus ambient),
+    `hour` (UT), `month` and, given the night intervals, `night_index`
+    (from `assign_nights`, -1 during the day) and `night` (the UT date the
+    night starts, `NaT` during the day). Where the evening twilight drifts
+    across 0h UT two nights can start on the same UT date, so `night` is
+    only a label: group by `night_index`.
+    """
+    frame = pd.DataFrame({name: np.asarray(values) for name, values in arrays.items()})
+    frame['date'] = pd.to_datetime(frame['date'])
+
+    sky = frame['sky_condition_code'].values
+    rain = frame['rain_condition_code'].values
+
+    frame['clear'] = (sky == Condition.CLEAR).astype(float)
+    frame['wet'] = np.isin(rain, [Condition.WET, Condition.RAIN]).astype(float)
+    frame.loc[sky == Condition.UNKNOWN, 'clear'] = np.nan
+    frame.loc[rain == Condition.UNKNOWN, 'wet'] = np.nan
+    frame['safe'] = frame['safe'].astype(float)
+    frame['cloudiness'] = frame['sky_temp_C'] - frame['ambient_temp_C']
+    frame['hour'] = frame['date'].dt.hour
+    frame['month'] = frame['date'].dt.month
+
+    if starts is not None:
+        index = assign_nights(frame['date'].values, starts, ends)
+        frame['night_index'] = index
+        nights = np.where(index >= 0, starts[np.maximum(index, 0)].astype('M8[D]'), np.datetime64('NaT'))
+        frame['night'] = pd.to_datetime(nights)
+
+    return frame
+
+
+def night_summary(frame, starts, ends):
+    """ One row per night: samples, hours of darkness and safe, clear, wet fractions, wind
+
+    Rows are indexed by `night_index`, with the `night` label, `start` and
+    `end` of each night as columns.
+    """
+    night = frame[frame['night_index'] >= 0]
+    summary = night.groupby('night_index').agg(
+        samples=('date', 'size'),
+        safe_fraction=('safe', 'mean'),
+        clear_fraction=('clear', 'mean'),
+        wet_fraction=('wet', 'mean'),
+        cloudiness_median=('cloudiness', 'median'),
+        wind_mean=('wind_speed_KPH', 'mean'),
+        wind_max=('wind_speed_KPH', 'max'),
+    )
+
+    index = summary.index.values
+    summary.insert(0, 'night', pd.to_datetime(starts[index].astype('M8[D]')))
+    summary.insert(1, 'start', pd.to_datetime(starts[index]))
+    summary.insert(2, 'end', pd.to_datetime(ends[index]))
+    summary.insert(4, 'dark_hours', (ends[index] - starts[index]) / np.timedelta64(1, 'h'))
+
+    return summary
+
+
+def hourly_fractions(frame, column, night_only=False):
+    """ Mean of `column` (e.g. 'clear') for each month and UT hour, months as rows
+
+    Every month (1 to 12) and hour (0 to 23) is there, NaN without data.
+    """
+    if night_only:
+        frame = frame.dropna(subset=['night'])
+
+    table = frame.pivot_table(index='month', columns='hour', values=column, aggfunc='mean')
+    return table.reindex(index=range(1, 13), columns=range(24))
+
+
+def wind_by_month(frame, night_only=True):
+    """ Wind speed statistics for each month """
+    if night_only:
+        frame = frame.dropna(subset=['night'])
+
+    wind = frame.groupby('month')['wind_speed_KPH']
+    stats = wind.describe(percentiles=[0.5, 0.9, 0.99])
+
+    return stats[['count', 'mean', '50%', '90%', '99%', 'max']]
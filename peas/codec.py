@@ -0,0 +1,530 @@
+import json
+import struct
+
+import numpy as np
+
+# File layout:
+#
+#   <block> <block> ... <index json> <footer>
+#
+# Each block holds up to `block_size` rows: one delta-of-delta encoded
+# timestamp stream followed by one XOR encoded stream per column. Columns that
+# are exact decimals are scaled to integers first (see `decimal_digits`). The index
+# records, per block, its byte range, first/last time and per-column min/max
+# so readers can skip blocks that fall outside a time range or value filter.
+# The footer is the index offset and length plus `MAGIC`.
+MAGIC = b'PEASGRL1'
+FOOTER = struct.Struct('<QQ8s')
+
+TIME_UNITS = {
+    's': 1000000,
+    'ms': 1000,
+    'us': 1,
+}
+
+# Delta-of-delta buckets: (prefix, prefix bits, value bits)
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b11110, 5, 20),
+)
+
+
+class BitWriter(object):
+
+    """ Append bit fields to a byte buffer (most significant bit first) """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self.buffer.append((self._acc >> self._nbits) & 0xff)
+        self._acc &= (1 << self._nbits) - 1
+
+    def getvalue(self):
+        if self._nbits:
+            return bytes(self.buffer) + bytes([(self._acc << (8 - self._nbits)) & 0xff])
+        return bytes(self.buffer)
+
+
+def _unpack(data):
+    """ Bits of `data` (padded so fields can be read past its end), and the padded bytes """
+    padded = np.frombuffer(bytes(data) + bytes(16), dtype=np.uint8)
+    return np.unpackbits(padded), padded
+
+
+def _read_fields(padded, starts, widths):
+    """ Unsigned fields of `widths` (1 to 64) bits at the bit offsets `starts`
+
+    Reads the 64 bits from each offset as a big-endian integer (nine bytes
+    cover them at any bit alignment) and keeps the top `widths` bits.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    first = starts >> 3
+    window = np.zeros(len(starts), dtype=np.uint64)
+    for i in range(8):
+        window = (window << np.uint64(8)) | padded[first + i].astype(np.uint64)
+
+    align = (starts & 7).astype(np.uint64)
+    window = (window << align) | (padded[first + 8].astype(np.uint64) >> (np.uint64(8) - align))
+
+    return window >> (np.uint64(64) - np.asarray(widths, dtype=np.uint64))
+
+
+def encode_times(times):
+    """ Delta-of-delta encode integer timestamps
+
+    Near-regular sampling makes most deltas-of-deltas zero, costing one bit.
+
+    Args:
+        times (array): int64 timestamps, any unit.
+
+    Returns:
+        bytes
+    """
+    times = np.asarray(times, dtype=np.int64)
+    writer = BitWriter()
+    if len(times) == 0:
+        return writer.getvalue()
+
+    writer.write(int(times[0]), 64)
+    if len(times) == 1:
+        return writer.getvalue()
+
+    deltas = np.diff(times)
+    writer.write(int(deltas[0]), 64)
+
+    for dod in np.diff(deltas).tolist():
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+
+        for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+            half = 1 << (value_bits - 1)
+            if -half <= dod < half:
+                writer.write(prefix, prefix_bits)
+                writer.write(dod + half, value_bits)
+                break
+        else:
+            writer.write(0b11111, 5)
+            writer.write(dod, 64)
+
+    return writer.getvalue()
+
+
+def _time_code_lengths(bits):
+    """ Length of the delta-of-delta code that would start at each bit """
+    # Leading ones (up to 5) select the bucket
+    ones = np.zeros(len(bits) - 4, dtype=np.int64)
+    run = np.ones(len(ones), dtype=np.uint8)
+    for i in range(5):
+        run &= bits[i:i + len(ones)]
+        ones += run
+
+    lengths = np.array([1] + [prefix_bits + value_bits for _, prefix_bits, value_bits in _DOD_BUCKETS] + [5 + 64])
+    return lengths[ones]
+
+
+def decode_times(data, count):
+    """ Decode `count` timestamps written by `encode_times`
+
+    Code lengths only depend on their own prefix, so they are computed for
+    every bit at once; the codes are then walked in Python and their values
+    read together.
+    """
+    times = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return times
+
+    bits, padded = _unpack(data)
+    head = _read_fields(padded, [0, 64], [64, 64]).view(np.int64)
+    times[0] = head[0]
+    if count == 1:
+        return times
+
+    lengths = _time_code_lengths(bits)
+    step = lengths.tolist()
+    starts = list()
+    pos = 128
+    for _ in range(count - 2):
+        starts.append(pos)
+        pos += step[pos]
+
+    starts = np.array(starts, dtype=np.int64)
+    code_lengths = lengths[starts]
+
+    dods = np.zeros(len(starts), dtype=np.int64)
+    for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+        found = code_lengths == prefix_bits + value_bits
+        values = _read_fields(padded, starts[found] + prefix_bits, np.full(found.sum(), value_bits))
+        dods[found] = values.astype(np.int64) - (1 << (value_bits - 1))
+
+    found = code_lengths == 5 + 64
+    dods[found] = _read_fields(padded, starts[found] + 5, np.full(found.sum(), 64)).view(np.int64)
+
+    deltas = head[1] + np.cumsum(dods)
+    times[1:] = head[0] + np.cumsum(np.concatenate([head[1:], deltas]))
+
+    return times
+
+
+def encode_floats(values):
+    """ XOR encode a float series
+
+    Each value is XORed with the previous one; unchanged values cost one bit
+    and slowly varying values only store their few meaningful bits.
+
+    Args:
+        values (array): Floats (float32 input is widened losslessly).
+
+    Returns:
+        bytes
+    """
+    bits = np.asarray(values, dtype='<f8').view('<u8')
+    writer = BitWriter()
+    if len(bits) == 0:
+        return writer.getvalue()
+
+    writer.write(int(bits[0]), 64)
+
+    xors = np.bitwise_xor(bits[1:], bits[:-1]).tolist()
+    prev_leading = -1
+    prev_trailing = 0
+
+    for xor in xors:
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+
+        if prev_leading >= 0 and leading >= prev_leading and trailing >= prev_trailing:
+            # Fits in the previous meaningful window
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            # A 64 bit window is stored as 0
+            writer.write(meaningful & 0x3f, 6)
+            writer.write(xor >> trailing, meaningful)
+            prev_leading = leading
+            prev_trailing = trailing
+
+    return writer.getvalue()
+
+
+def decode_floats(data, count):
+    """ Decode `count` floats written by `encode_floats`
+
+    The length of a code depends on the window set by the last `0b11` code,
+    so the control bits are walked in Python, but the XORed bits are read
+    and accumulated together.
+    """
+    out = np.empty(count, dtype='<u8')
+    if count == 0:
+        return out.view('<f8')
+
+    bits, padded = _unpack(data)
+    b = bits.tolist()
+
+    changed = list()
+    starts = list()
+    widths = list()
+    shifts = list()
+
+    pos = 64
+    width, trailing = 64, 0
+    for i in range(1, count):
+        if not b[pos]:
+            pos += 1
+            continue
+
+        if b[pos + 1]:
+            # 5 bits of leading zeros then 6 bits of width, 0 for 64
+            fields = 0
+            for bit in b[pos + 2:pos + 13]:
+                fields = fields << 1 | bit
+            leading = fields >> 6
+            width = (fields & 0x3f) or 64
+            trailing = 64 - leading - width
+            pos += 13
+        else:
+            pos += 2
+
+        changed.append(i)
+        starts.append(pos)
+        widths.append(width)
+        shifts.append(trailing)
+        pos += width
+
+    xors = np.zeros(count, dtype=np.uint64)
+    xors[0] = _read_fields(padded, [0], [64])[0]
+    if changed:
+        xors[changed] = _read_fields(padded, starts, widths) << np.array(shifts, dtype=np.uint64)
+
+    out[:] = np.bitwise_xor.accumulate(xors)
+    return out.view('<f8')
+
+
+def decimal_digits(values, max_digits=6):
+    """ Smallest number of decimals that represents every value exactly
+
+    Sensor readings are usually rounded to a few decimals. Scaling them to
+    integers before XOR encoding leaves long runs of trailing zero bits, which
+    compresses far better than the binary expansion of a decimal fraction.
+
+    Returns:
+        int: The number of digits, or None if the values are not decimals
+            with at most `max_digits` digits (or are all non-finite).
+    """
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return None
+
+    for digits in range(max_digits + 1):
+        scale = 10. ** digits
+        scaled = np.round(finite * scale)
+        if np.abs(scaled).max() < 2 ** 52 and np.array_equal(scaled / scale, finite):
+            return digits
+
+    return None
+
+
+def _stats(values):
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return None, None
+
+    return float(finite.min()), float(finite.max())
+
+
+class BlockWriter(object):
+
+    """ Write timestamped float columns as compressed blocks
+
+    Args:
+        path (str):         Output file.
+        columns (list):     Column names, fixed for the file.
+        block_size (int):   Rows per block.
+        time_unit (str):    Resolution the timestamps are stored at, one of
+            `TIME_UNITS`. Sensor times only need milliseconds.
+    """
+
+    def __init__(self, path, columns, block_size=1024, time_unit='ms'):
+        assert time_unit in TIME_UNITS, "Unknown time unit: {}".format(time_unit)
+
+        self.path = path
+        self.columns = list(columns)
+        self.block_size = block_size
+        self.time_unit = time_unit
+
+        self.blocks = list()
+        self._file = open(path, 'wb')
+        self._pending_times = list()
+        self._pending = {name: list() for name in self.columns}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, dates, data):
+        """ Add rows
+
+        Args:
+            dates (array):  `datetime64` values, sorted.
+            data (dict):    Column name to array of the same length.
+        """
+        times = np.asarray(dates, dtype='M8[us]').astype(np.int64) // TIME_UNITS[self.time_unit]
+        self._pending_times.append(times)
+        for name in self.columns:
+            self._pending[name].append(np.asarray(data.get(name, np.full(len(times), np.nan)), dtype='<f8'))
+
+        times = np.concatenate(self._pending_times)
+        columns = {name: np.concatenate(values) for name, values in self._pending.items()}
+
+        while len(times) >= self.block_size:
+            self._write_block(times[:self.block_size], {n: v[:self.block_size] for n, v in columns.items()})
+            times = times[self.block_size:]
+            columns = {n: v[self.block_size:] for n, v in columns.items()}
+
+        self._pending_times = [times]
+        self._pending = {name: [values] for name, values in columns.items()}
+
+    def _write_block(self, times, columns):
+        offset = self._file.tell()
+        block = {
+            'offset': offset,
+            'count': len(times),
+            't_first': int(times[0]),
+            't_last': int(times[-1]),
+            'streams': dict(),
+            'min': dict(),
+            'max': dict(),
+        }
+
+        block['digits'] = dict()
+
+        streams = [('date', encode_times(times))]
+        for name in self.columns:
+            values = columns[name]
+            digits = decimal_digits(values)
+            if digits is not None:
+                values = np.round(values * 10. ** digits)
+            block['digits'][name] = digits
+
+            streams.append((name, encode_floats(values)))
+            block['min'][name], block['max'][name] = _stats(columns[name])
+
+        for name, data in streams:
+            block['streams'][name] = [self._file.tell() - offset, len(data)]
+            self._file.write(data)
+
+        block['length'] = self._file.tell() - offset
+        self.blocks.append(block)
+
+    def close(self):
+        if self._file is None:
+            return
+
+        times = np.concatenate(self._pending_times) if self._pending_times else np.empty(0)
+        if len(times) > 0:
+            self._write_block(times, {n: np.concatenate(v) for n, v in self._pending.items()})
+
+        index = json.dumps({
+            'columns': self.columns,
+            'time_unit': self.time_unit,
+            'blocks': self.blocks,
+        }).encode('utf-8')
+
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        self._file.close()
+        self._file = None
+
+
+class BlockReader(object):
+
+    """ Read files written by `BlockWriter`
+
+    Only the blocks overlapping the requested time range (and matching an
+    optional value filter) are read from disk and decoded, and only the
+    requested column streams within them.
+
+    Args:
+        path (str): File to read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            f.seek(-FOOTER.size, 2)
+            index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            assert magic == MAGIC, "Not a PEAS compressed column file: {}".format(path)
+
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode('utf-8'))
+
+        self.columns = index['columns']
+        self.time_unit = index['time_unit']
+        self.blocks = index['blocks']
+
+    def __len__(self):
+        return sum(b['count'] for b in self.blocks)
+
+    def _to_unit(self, date):
+        return int(np.datetime64(date, 'us').astype(np.int64)) // TIME_UNITS[self.time_unit]
+
+    def select_blocks(self, start=None, end=None, where=None):
+        """ Blocks overlapping `[start, end]`
+
+        Args:
+            start (datetime):   Inclusive start.
+            end (datetime):     Inclusive end.
+            where (dict):       Column name to `(low, high)`; blocks whose
+                min/max for that column cannot overlap the range are skipped.
+        """
+        t_start = None if start is None else self._to_unit(start)
+        t_end = None if end is None else self._to_unit(end)
+
+        selected = list()
+        for block in self.blocks:
+            if t_start is not None and block['t_last'] < t_start:
+                continue
+            if t_end is not None and block['t_first'] > t_end:
+                continue
+
+            skip = False
+            for name, (low, high) in (where or dict()).items():
+                b_min, b_max = block['min'].get(name), block['max'].get(name)
+                if b_min is None or (high is not None and b_min > high) or (low is not None and b_max < low):
+                    skip = True
+                    break
+
+            if not skip:
+                selected.append(block)
+
+        return selected
+
+    def read(self, start=None, end=None, columns=None, where=None):
+        """ Decode rows in `[start, end]`
+
+        Returns:
+            dict: `date` (`datetime64[us]`) and the requested float columns.
+        """
+        if columns is None:
+            columns = self.columns
+
+        chunks = list()
+        with open(self.path, 'rb') as f:
+            for block in self.select_blocks(start=start, end=end, where=where):
+                f.seek(block['offset'])
+                raw = f.read(block['length'])
+
+                def stream(name):
+                    offset, length = block['streams'][name]
+                    return raw[offset:offset + length]
+
+                times = decode_times(stream('date'), block['count'])
+                chunk = {'date': times}
+                for name in columns:
+                    values = decode_floats(stream(name), block['count'])
+                    digits = block['digits'].get(name)
+                    if digits is not None:
+                        values = values / 10. ** digits
+                    chunk[name] = values
+                chunks.append(chunk)
+
+        names = ['date'] + list(columns)
+        if len(chunks) == 0:
+            data = {name: np.empty(0, dtype='<f8') for name in names}
+            data['date'] = np.empty(0, dtype='M8[us]')
+            return data
+
+        data = {name: np.concatenate([c[name] for c in chunks]) for name in names}
+        data['date'] = (data['date'] * TIME_UNITS[self.time_unit]).astype('M8[us]')
+
+        mask = np.ones(len(data['date']), dtype=bool)
+        if start is not None:
+            mask &= data['date'] >= np.datetime64(start, 'us')
+        if end is not None:
+            mask &= data['date'] <= np.datetime64(end, 'us')
+
+        if not mask.all():
+            data = {name: values[mask] for name, values in data.items()}
+
+        return data
@@ -0,0 +1,87 @@
+from enum import IntEnum
+
+import numpy as np
+
+
+class Condition(IntEnum):
+
+    """ Weather conditions reported by `AAGCloudSensor`
+
+    The codes are stored alongside the condition strings (as
+    `<name>_code`, e.g. `sky_condition_code`) so masks can be built with a
+    single array comparison.
+    """
+
+    UNKNOWN = 0
+
+    CLEAR = 1
+    CLOUDY = 2
+    VERY_CLOUDY = 3
+
+    CALM = 4
+    WINDY = 5
+    VERY_WINDY = 6
+    GUSTY = 7
+    VERY_GUSTY = 8
+
+    DRY = 9
+    WET = 10
+    RAIN = 11
+
+    @property
+    def label(self):
+        """ The string used by the sensor, e.g. 'Very Cloudy' """
+        return self.name.replace('_', ' ').title()
+
+
+# Condition string columns of a weather record
+CONDITION_FIELDS = ('sky_condition', 'wind_condition', 'gust_condition', 'rain_condition')
+
+_CODES = {c.label: c.value for c in Condition}
+_LABELS = np.array([Condition(i).label for i in range(len(Condition))])
+
+
+def code_field(field):
+    return '{}_code'.format(field)
+
+
+def to_code(label):
+    """ Code of a condition string, `UNKNOWN` for anything unrecognised """
+    if isinstance(label, bytes):
+        label = label.decode()
+    try:
+        return _CODES.get(label.strip(), Condition.UNKNOWN.value)
+    except AttributeError:
+        return Condition.UNKNOWN.value
+
+
+def to_codes(labels):
+    """ Codes of an array of condition strings, as `int8` """
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return np.zeros(0, dtype='i1')
+
+    unique, inverse = np.unique(labels, return_inverse=True)
+    return np.array([to_code(label) for label in unique], dtype='i1')[inverse.reshape(-1)]
+
+
+def to_labels(codes):
+    """ Condition strings of an array of codes """
+    codes = np.asarray(codes, dtype=int)
+    return _LABELS[np.where((codes >= 0) & (codes < len(_LABELS)), codes, 0)]
+
+
+def label(code):
+    try:
+        return Condition(int(code)).label
+    except ValueError:
+        return Condition.UNKNOWN.label
+
+
+def add_codes(record):
+    """ Add the `<name>_code` fields for the condition strings of `record` """
+    for field in CONDITION_FIELDS:
+        if field in record:
+            record[code_field(field)] = to_code(record[field])
+
+    return record
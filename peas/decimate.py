@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def to_seconds(times):
+    """ Seconds since the epoch of datetimes, `datetime64` or a `DatetimeIndex` """
+    values = np.asarray(times)
+    if values.dtype.kind != 'M':
+        values = values.astype('M8[us]')
+
+    return values.astype('M8[us]').astype(np.int64) / 1e6
+
+
+def minmax_indices(x, y, bucket):
+    """ Indices that keep the shape of `y` at one point per `bucket`
+
+    The samples are grouped into buckets of `bucket` (same units as `x`,
+    usually the data range of one pixel). For each bucket the first, last,
+    minimum and maximum samples are kept, so peaks (gusts) and dips (rain)
+    survive however long the range is. NaN samples are never picked as the
+    minimum or maximum.
+
+    Args:
+        x (numpy.ndarray):  Sorted sample positions, e.g. seconds.
+        y (numpy.ndarray):  Values.
+        bucket (float):     Bucket size.
+
+    Returns:
+        numpy.ndarray: Sorted indices into `x` and `y`.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) == 0 or bucket <= 0:
+        return np.arange(len(x))
+
+    buckets = np.floor((x - x[0]) / bucket).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    if len(starts) * 4 >= len(x):
+        return np.arange(len(x))
+
+    ends = np.r_[starts[1:], len(x)] - 1
+
+    # Position of the min and max within each bucket, via sorting by value
+    valid = ~np.isnan(y)
+    order = np.lexsort((np.where(valid, y, np.inf), buckets))
+    lowest = order[starts]
+    order = np.lexsort((np.where(valid, -y, np.inf), buckets))
+    highest = order[starts]
+
+    return np.unique(np.concatenate([starts, ends, lowest, highest]))
+
+
+def decimate(x, y, bucket):
+    """ `x` and `y` reduced with `minmax_indices` """
+    index = minmax_indices(x, y, bucket)
+    return np.asarray(x)[index], np.asarray(y)[index]
+
+
+def time_smooth(x, y, window):
+    """ Centred moving average over `window` (same units as `x`)
+
+    Unlike a moving average over a fixed number of samples this follows the
+    time between samples, so gaps and changes of cadence don't distort it.
+    NaN values are ignored.
+
+    Args:
+        x (numpy.ndarray):  Sorted sample positions, e.g. seconds.
+        y (numpy.ndarray):  Values.
+        window (float):     Width of the averaging window.
+
+    Returns:
+        numpy.ndarray: Smoothed values, same length as `y`.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    valid = ~np.isnan(y)
+    total = np.r_[0., np.cumsum(np.where(valid, y, 0.))]
+    count = np.r_[0, np.cumsum(valid)]
+
+    first = np.searchsorted(x, x - window / 2., side='left')
+    last = np.searchsorted(x, x + window / 2., side='right')
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total[last] - total[first]) / (count[last] - count[first])
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+# Sun events in the table, named as in the weather plot, with the `Observer`
+# method giving the next one after a time
+EVENTS = (
+    ('sunset', 'sun_set_time'),
+    ('ec', 'twilight_evening_civil'),
+    ('en', 'twilight_evening_nautical'),
+    ('ea', 'twilight_evening_astronomical'),
+    ('ma', 'twilight_morning_astronomical'),
+    ('mn', 'twilight_morning_nautical'),
+    ('mc', 'twilight_morning_civil'),
+    ('sunrise', 'sun_rise_time'),
+)
+
+SITE_KEYS = ('latitude', 'longitude', 'elevation', 'timezone')
+
+
+def site_key(location):
+    """ Short hash of the location config, changes whenever the site does """
+    text = '|'.join('{}'.format(location.get(key, '')) for key in SITE_KEYS)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def get_observer(location):
+    from astroplan import Observer
+    from astropy.coordinates import EarthLocation
+
+    earth_location = EarthLocation(
+        lat=location['latitude'],
+        lon=location['longitude'],
+        height=location['elevation'],
+    )
+
+    return Observer(location=earth_location, name='PANOPTES', timezone=location['timezone'])
+
+
+def compute_year(location, year):
+    """ Next sun events after 00:00 UT of every day of `year`
+
+    Each event is computed for all the days at once.
+
+    Returns:
+        dict: `date` (the days) and one `datetime64[us]` array per event,
+            `NaT` where the event doesn't happen.
+    """
+    from astropy.time import Time
+
+    obs = get_observer(location)
+
+    days = np.arange(np.datetime64('{}-01-01'.format(year)), np.datetime64('{}-01-01'.format(year + 1)))
+    times = Time(days.astype('M8[s]').astype(str), scale='utc')
+
+    table = {'date': days.astype('M8[us]')}
+    for name, method in EVENTS:
+        result = getattr(obs, method)(times, which='next')
+        values = np.ma.filled(np.ma.masked_invalid(np.ma.asarray(result.jd)), np.nan)
+
+        dates = np.full(len(days), np.datetime64('NaT'), dtype='M8[us]')
+        good = ~np.isnan(values)
+        if good.any():
+            dates[good] = Time(values[good], format='jd', scale='utc').datetime64.astype('M8[us]')
+        table[name] = dates
+
+    return table
+
+
+class Ephemeris(object):
+
+    """ Sun and twilight times for a site, one row per UT day
+
+    Rows are computed a year at a time (see `compute_year`) and kept in
+    `<directory>/ephemeris_<site>_<year>.npz`, where `<site>` is a hash of
+    the location config. Moving the site changes the hash, so the table is
+    only recomputed then.
+
+    Args:
+        location (dict):    `latitude`, `longitude`, `elevation`, `timezone`.
+        directory (str):    Where the yearly tables are kept.
+    """
+
+    def __init__(self, location, directory):
+        self.location = location
+        self.directory = directory
+        self.site = site_key(location)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._years = dict()
+        self._lock = threading.Lock()
+
+    def _path(self, year):
+        return os.path.join(self.directory, 'ephemeris_{}_{}.npz'.format(self.site, year))
+
+    def year(self, year):
+        """ Table of `year`, computed and saved the first time """
+        with self._lock:
+            if year not in self._years:
+                path = self._path(year)
+                try:
+                    with np.load(path, allow_pickle=False) as npz:
+                        table = {name: npz[name] for name in npz.files}
+                except (IOError, ValueError):
+                    table = compute_year(self.location, year)
+                    # A temp file of our own, other processes may be saving the same year
+                    fd, tmp = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+                    with os.fdopen(fd, 'wb') as f:
+                        np.savez(f, **table)
+                    os.replace(tmp, path)
+
+                self._years[year] = table
+
+        return self._years[year]
+
+    def rows(self, start, end):
+        """ Table rows of the days from `start` to `end` (inclusive)
+
+        Returns:
+            dict: `date` and one array per event, see `compute_year`.
+        """
+        tables = [self.year(year) for year in range(start.year, end.year + 1)]
+        table = {name: np.concatenate([t[name] for t in tables]) for name in tables[0]}
+
+        first = np.datetime64(dt(start.year, start.month, start.day), 'us')
+        keep = (table['date'] >= first) & (table['date'] <= np.datetime64(end, 'us'))
+
+        return {name: values[keep] for name, values in table.items()}
+
+    def _row(self, day):
+        table = self.year(day.year)
+        index = (day - dt(day.year, 1, 1)).days
+
+        return {name: table[name][index] for name, _ in EVENTS}
+
+    def events(self, time):
+        """ The next of each event after `time` (UTC)
+
+        Same as calling the `Observer` methods with `which='next'`, read from
+        the table rows of the day of `time` and the day after.
+
+        Returns:
+            dict: Event name to `datetime` (None if it doesn't happen).
+        """
+        day = dt(time.year, time.month, time.day)
+        today = self._row(day)
+        tomorrow = self._row(day + tdelta(days=1))
+
+        start = np.datetime64(time, 'us')
+        events = dict()
+        for name, _ in EVENTS:
+            value = today[name]
+            if np.isnat(value) or value < start:
+                value = tomorrow[name]
+            events[name] = None if np.isnat(value) else value.astype(object)
+
+        return events
+
+
+_ephemerides = dict()
+_ephemerides_lock = threading.Lock()
+
+
+def get_ephemeris(config, location=None, directory=None):
+    """ Return the process-wide `Ephemeris` for the configured site
+
+    Args:
+        config (dict):      PEAS config, for the data directory.
+        location (dict):    Site, default `config['location']`.
+        directory (str):    Default `<directories.data>/ephemeris`.
+    """
+    if location is None:
+        location = config['location']
+    if directory is None:
+        data_dir = config.get('directories', dict()).get('data', '/var/panoptes/data')
+        directory = os.path.join(data_dir, 'ephemeris')
+
+    key = (site_key(location), directory)
+    with _ephemerides_lock:
+        if key not in _ephemerides:
+            _ephemerides[key] = Ephemeris(location, directory)
+
+    return _ephemerides[key]
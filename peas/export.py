@@ -0,0 +1,309 @@
+import base64
+import binascii
+import collections
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+from dateutil.parser import parse as date_parser
+
+
+def _object_hook(obj):
+    """ Undo the mongo extended JSON used in exports """
+    if '$date' in obj:
+        value = obj['$date']
+        if isinstance(value, dict):
+            value = value.get('$numberLong', 0)
+        if isinstance(value, str):
+            return dt.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        return dt.utcfromtimestamp(int(value) / 1000.)
+    if '$oid' in obj:
+        return obj['$oid']
+    return obj
+
+
+def read_export(fn, limit=None):
+    """ Read the documents of a mongo export file
+
+    Handles plain or gzipped files holding either a JSON array or one
+    document per line.
+
+    Args:
+        fn (str):       Export file, e.g. `weather_20170314.json.gz`.
+        limit (int):    Max number of documents to return.
+
+    Returns:
+        list: The documents, with dates as `datetime`.
+    """
+    opener = gzip.open if fn.endswith('.gz') else open
+
+    with opener(fn, 'rt') as f:
+        text = f.read().strip()
+
+    if text.startswith('['):
+        docs = json.loads(text, object_hook=_object_hook)
+    else:
+        docs = [json.loads(line, object_hook=_object_hook) for line in text.splitlines() if line.strip()]
+
+    if limit is not None:
+        docs = docs[:limit]
+
+    return docs
+
+
+def _default(obj):
+    """ Mongo extended JSON for the values `json` can't write """
+    if isinstance(obj, dt):
+        return {'$date': obj.isoformat()}
+    if type(obj).__name__ == 'ObjectId':
+        return {'$oid': str(obj)}
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+
+    return str(obj)
+
+
+def _md5(fn):
+    digest = hashlib.md5()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest
+
+
+def _compress_chunk(fn, data):
+    """ Gzip `data` into `fn` and return the md5 of the file
+
+    Run in a worker process. The gzip header has no timestamp or name so the
+    same documents always give the same bytes (and checksum).
+    """
+    tmp = fn + '.tmp'
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as f:
+            f.write(data)
+    os.replace(tmp, fn)
+
+    return _md5(fn).hexdigest()
+
+
+class LocalBackend(object):
+
+    """ Export destination in a local directory
+
+    Args:
+        root (str): Directory the chunks are copied to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def matches(self, name, md5):
+        """ True if `name` already exists with the given md5 (hex) """
+        fn = os.path.join(self.root, name)
+        return os.path.exists(fn) and _md5(fn).hexdigest() == md5
+
+    def upload(self, fn, name):
+        dest = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(fn, dest + '.tmp')
+        os.replace(dest + '.tmp', dest)
+
+        return dest
+
+
+class StorageBackend(object):
+
+    """ Export destination in the unit's google storage bucket
+
+    Args:
+        unit_id (str):  PANOPTES unit id, e.g. PAN001.
+        bucket (str):   Bucket name.
+    """
+
+    def __init__(self, unit_id, bucket='unit_sensors'):
+        from pocs.utils.google.storage import PanStorage
+        self.storage = PanStorage(unit_id=unit_id, bucket=bucket)
+        self.unit_id = unit_id
+
+    def matches(self, name, md5):
+        blob = self.storage.bucket.get_blob('{}/{}'.format(self.unit_id, name))
+        if blob is None or blob.md5_hash is None:
+            return False
+
+        return binascii.hexlify(base64.b64decode(blob.md5_hash)).decode() == md5
+
+    def upload(self, fn, name):
+        return self.storage.upload(fn, remote_path='{}/{}'.format(self.unit_id, name))
+
+
+class Exporter(object):
+
+    """ Incremental, resumable export of mongo collections
+
+    For each collection the documents after the high-water mark (the date of
+    the last exported document) are streamed in `date` order and cut into
+    chunks of `chunk_size` documents. Each chunk is written as gzipped JSON
+    lines (readable with `read_export`) by a pool of worker processes and
+    handed to the backend, unless a chunk with the same checksum is already
+    there. The mark only moves once a chunk is uploaded and is saved to the
+    progress file, so an interrupted export picks up where it left off and
+    re-creates (and skips) the same chunk names.
+
+    Collections are exported concurrently, one thread each.
+
+    Args:
+        db (PanMongo):          Database holding the collections.
+        backend:                `LocalBackend` or `StorageBackend`.
+        directory (str):        Working directory for chunks and progress.
+        chunk_size (int):       Documents per chunk.
+        processes (int):        Compression processes, default one per CPU.
+        lag (float):            Seconds behind now to stop at, leaving time
+            for spooled records (see `peas.spool`) to reach mongo.
+        logger:                 Optional logger.
+    """
+
+    def __init__(self, db, backend, directory, chunk_size=10000, processes=None, lag=300., logger=None):
+        self.db = db
+        self.backend = backend
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.processes = processes or os.cpu_count() or 1
+        self.lag = lag
+        self.logger = logger
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.progress_fn = os.path.join(self.directory, 'progress.json')
+        self._lock = threading.Lock()
+        self.progress = self._load_progress()
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_fn, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def _save_progress(self, collection, mark):
+        with self._lock:
+            self.progress[collection] = mark
+            tmp = self.progress_fn + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.progress, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.progress_fn)
+
+    def _log(self, msg):
+        if self.logger is not None:
+            self.logger.info(msg)
+
+    def _chunks(self, collection, mark, end):
+        """ Yield `(docs, mark)` chunks after `mark`, with the mark after each """
+        start = date_parser(mark['date']) if mark.get('date') else dt(1970, 1, 1)
+        seen = set(mark.get('seen', list()))
+
+        cursor = getattr(self.db, collection).find(
+            {'date': {'$gte': start, '$lte': end}}).sort([('date', 1), ('_id', 1)])
+
+        last_date = start
+        docs = list()
+        for doc in cursor:
+            # Documents at the mark's date that were already exported
+            if doc['date'] == start and str(doc['_id']) in seen:
+                continue
+
+            if doc['date'] != last_date:
+                last_date = doc['date']
+                seen = set()
+            seen.add(str(doc['_id']))
+            docs.append(doc)
+
+            if len(docs) == self.chunk_size:
+                yield docs, {'date': last_date.isoformat(), 'seen': sorted(seen)}
+                docs = list()
+
+        if len(docs) > 0:
+            yield docs, {'date': last_date.isoformat(), 'seen': sorted(seen)}
+
+    def export_collection(self, collection, pool, end):
+        """ Export the new documents of one collection
+
+        Returns:
+            dict: 'chunks', 'uploaded', 'skipped' and 'documents' counts.
+        """
+        mark = dict(self.progress.get(collection, dict()))
+        counts = {'chunks': 0, 'uploaded': 0, 'skipped': 0, 'documents': 0}
+
+        chunk_dir = os.path.join(self.directory, collection)
+        os.makedirs(chunk_dir, exist_ok=True)
+
+        pending = collections.deque()
+
+        def finish():
+            name, fn, future, new_mark, num_docs = pending.popleft()
+            md5 = future.result()
+            if self.backend.matches(name, md5):
+                counts['skipped'] += 1
+            else:
+                self.backend.upload(fn, name)
+                counts['uploaded'] += 1
+            os.remove(fn)
+
+            counts['chunks'] += 1
+            counts['documents'] += num_docs
+            self._save_progress(collection, new_mark)
+
+        seq = mark.get('chunks', 0)
+        total = mark.get('documents', 0)
+        for docs, new_mark in self._chunks(collection, mark, end):
+            name = '{0}/{0}_{1:06d}.json.gz'.format(collection, seq)
+            fn = os.path.join(self.directory, name)
+            data = ''.join(json.dumps(doc, default=_default, sort_keys=True) + '\n' for doc in docs).encode()
+
+            seq += 1
+            total += len(docs)
+            new_mark['chunks'] = seq
+            new_mark['documents'] = total
+
+            pending.append((name, fn, pool.submit(_compress_chunk, fn, data), new_mark, len(docs)))
+
+            # Bound the chunks held in memory; upload in order so the
+            # mark never passes a chunk that isn't in the backend
+            while len(pending) > 2 * self.processes:
+                finish()
+
+        while pending:
+            finish()
+
+        self._log("Exported {}: {documents} documents in {chunks} chunks "
+                  "({uploaded} uploaded, {skipped} already there)".format(collection, **counts))
+
+        return counts
+
+    def export(self, collection_names, end=None):
+        """ Export all `collection_names` concurrently
+
+        Args:
+            collection_names (list):    Collections to export.
+            end (datetime):             Last date to export (UTC), default
+                now minus `lag`.
+
+        Returns:
+            dict: Counts per collection, see `export_collection`.
+        """
+        if end is None:
+            end = dt.utcnow() - tdelta(seconds=self.lag)
+
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            with ThreadPoolExecutor(max_workers=len(collection_names)) as threads:
+                futures = {name: threads.submit(self.export_collection, name, pool, end)
+                           for name in collection_names}
+
+                return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,138 @@
+import json
+import os
+
+import numpy as np
+
+PERCENTILES = (1, 5, 50, 95, 99)
+
+
+def load_small(fn, size=(160, 120)):
+    """ Grey levels of the JPEG `fn` at about `size`, as a `uint8` array
+
+    The image is decoded in draft mode, so the JPEG decoder only produces a
+    greyscale image scaled down by up to 8 (to no less than `size`) and the
+    full image is never built.
+    """
+    from PIL import Image
+
+    with Image.open(fn) as img:
+        img.draft('L', size)
+        return np.asarray(img.convert('L'), dtype=np.uint8)
+
+
+def image_stats(pixels, saturated_level=250, dark_level=5):
+    """ Percentiles, mean and clipped fractions of 8-bit `pixels`
+
+    Everything comes from one 256-bin histogram, so this costs a single
+    pass over the pixels.
+
+    Returns:
+        dict: `p1`, `p5`, `p50`, `p95`, `p99`, `mean`, `saturated` and
+            `dark` (fractions of pixels at or beyond the levels) and `pixels`.
+    """
+    hist = np.bincount(np.asarray(pixels, dtype=np.uint8).ravel(), minlength=256)
+    total = hist.sum()
+    if total == 0:
+        return None
+
+    cumulative = np.cumsum(hist)
+    levels = np.searchsorted(cumulative, np.array(PERCENTILES) / 100. * total)
+
+    stats = {'p{}'.format(p): int(level) for p, level in zip(PERCENTILES, levels)}
+    stats['mean'] = float(np.dot(hist, np.arange(256)) / total)
+    stats['saturated'] = float(hist[saturated_level:].sum() / total)
+    stats['dark'] = float(hist[:dark_level + 1].sum() / total)
+    stats['pixels'] = int(total)
+
+    return stats
+
+
+def sidecar_file(fn):
+    """ `<image>.json`, where the stats of an image are kept """
+    return '{}.json'.format(os.path.splitext(fn)[0])
+
+
+def write_sidecar(fn, record):
+    """ Write `record` next to the image `fn` (atomically) """
+    out_file = sidecar_file(fn)
+    tmp = '{}.tmp'.format(out_file)
+    with open(tmp, 'w') as f:
+        json.dump(record, f, sort_keys=True)
+    os.replace(tmp, out_file)
+
+    return out_file
+
+
+def read_sidecar(fn):
+    with open(sidecar_file(fn)) as f:
+        return json.load(f)
+
+
+def parse_percent(value):
+    """ 50 from '50%' (as used by fswebcam) or 50 """
+    return int(str(value).strip().rstrip('%'))
+
+
+class ExposureController(object):
+
+    """ Adjust webcam gain and brightness to keep the images well exposed
+
+    After each capture `update` compares the median level of the image
+    with `target` and changes the settings for the next capture: gain
+    first and, once the gain is at its limit, brightness. Changes are
+    proportional to the error but at most `step` percent per capture, and
+    nothing changes within `tolerance`. An image with more than
+    `max_saturated` of its pixels saturated is always taken as too bright.
+
+    Args:
+        brightness (int):       Initial brightness, percent.
+        gain (int):             Initial gain, percent.
+        target (int):           Wanted median grey level (0-255).
+        tolerance (int):        Median levels within this of `target` are fine.
+        max_saturated (float):  Max fraction of saturated pixels.
+        step (int):             Max change per capture, percent.
+        limits (tuple):         Min and max settings, percent.
+    """
+
+    def __init__(self, brightness=50, gain=50, target=110, tolerance=10, max_saturated=0.01, step=10,
+                 limits=(0, 100)):
+        self.brightness = parse_percent(brightness)
+        self.gain = parse_percent(gain)
+
+        self.target = target
+        self.tolerance = tolerance
+        self.max_saturated = max_saturated
+        self.step = step
+        self.limits = limits
+
+    @property
+    def settings(self):
+        return {'brightness': self.brightness, 'gain': self.gain}
+
+    def _clip(self, value):
+        return int(min(max(value, self.limits[0]), self.limits[1]))
+
+    def update(self, stats):
+        """ New settings from the `image_stats` of the last capture
+
+        Returns:
+            dict: `brightness` and `gain` (percent) for the next capture.
+        """
+        if stats is None:
+            return self.settings
+
+        error = self.target - stats['p50']
+        if stats['saturated'] > self.max_saturated:
+            error = min(error, -self.tolerance - 1)
+
+        if abs(error) <= self.tolerance:
+            return self.settings
+
+        change = int(round(error / 255. * 100))
+        change = max(min(change, self.step), -self.step)
+
+        gain = self._clip(self.gain + change)
+        self.brightness = self._clip(self.brightness + change - (gain - self.gain))
+        self.gain = gain
+
+        return self.settings
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+KEEP = 'keep'
+REDUCE = 'reduce'
+DROP = 'drop'
+
+
+def signature(pixels, size=(32, 24)):
+    """ Tiny `float32` thumbnail of grey levels, by block averages
+
+    Args:
+        pixels (numpy.ndarray): Grey levels, e.g. from `peas.exposure.load_small`.
+        size (tuple):           Signature `(width, height)`.
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    height, width = pixels.shape[:2]
+
+    rows, cols = min(size[1], height), min(size[0], width)
+    by, bx = height // rows, width // cols
+
+    blocks = pixels[:rows * by, :cols * bx].reshape(rows, by, cols, bx)
+    return blocks.mean(axis=(1, 3))
+
+
+def difference(a, b):
+    """ Mean absolute difference of two signatures, in grey levels
+
+    The mean level of each is removed first, so a change of exposure alone
+    (e.g. from `peas.exposure.ExposureController`) doesn't count.
+    """
+    if a is None or b is None or a.shape != b.shape:
+        return np.inf
+
+    return float(np.abs((a - a.mean()) - (b - b.mean())).mean())
+
+
+def reduce_quality(fn, quality):
+    """ Re-encode the JPEG `fn` in place at `quality` """
+    from PIL import Image
+
+    tmp = '{}.tmp'.format(fn)
+    with Image.open(fn) as img:
+        img.save(tmp, 'JPEG', quality=quality)
+    os.replace(tmp, fn)
+
+
+class FrameGate(object):
+
+    """ Decide whether a frame is worth storing
+
+    Each frame's `signature` is compared with that of the last frame kept
+    at full quality. Frames changing less than `threshold` (mean grey
+    levels) are dropped, or kept at a lower JPEG quality if `mode` is
+    'reduce'. A frame is always kept once `max_interval` seconds have
+    passed since the last kept one, so slow changes still show up.
+
+    Args:
+        threshold (float):      Min difference to keep a frame.
+        mode (str):             'drop' or 'reduce' for the frames under `threshold`.
+        quality (int):          JPEG quality of reduced frames.
+        max_interval (float):   Keep a frame at least this often (seconds).
+    """
+
+    def __init__(self, threshold=2.0, mode=DROP, quality=60, max_interval=600.):
+        assert mode in (DROP, REDUCE), "Gating mode must be '{}' or '{}'".format(DROP, REDUCE)
+
+        self.threshold = threshold
+        self.mode = mode
+        self.quality = quality
+        self.max_interval = max_interval
+
+        self.counts = {KEEP: 0, REDUCE: 0, DROP: 0}
+
+        self._last = None
+        self._last_time = None
+
+    def check(self, pixels, time):
+        """ Decision for a frame, see the class
+
+        Args:
+            pixels (numpy.ndarray): Grey levels of the frame.
+            time (float):           Capture time, seconds (e.g. `time.time()`).
+
+        Returns:
+            tuple: The decision ('keep', 'reduce' or 'drop') and the
+                difference with the last kept frame.
+        """
+        current = signature(pixels)
+        change = difference(current, self._last)
+
+        if change >= self.threshold or self._last_time is None or time - self._last_time >= self.max_interval:
+            decision = KEEP
+            self._last = current
+            self._last_time = time
+        else:
+            decision = self.mode
+
+        self.counts[decision] += 1
+
+        return decision, change
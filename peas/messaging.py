@@ -0,0 +1,382 @@
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+
+from collections import defaultdict
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+# Payloads that start with this marker are MessagePack, everything else is
+# the JSON text sent by `PanMessaging.send_message`. A JSON document can never
+# start with a NUL byte so subscribers can detect the encoding per message.
+MSGPACK_MARKER = b'\x00mp'
+
+# MessagePack extension type used for (naive, UTC) datetimes
+DATETIME_EXT = 1
+
+ENCODINGS = ('json', 'msgpack')
+
+_EPOCH = dt(1970, 1, 1)
+
+
+def channel_encoding(config, channel):
+    """ Look up the encoding to use for `channel`
+
+    Reads the `messaging.encoding` section of the config, e.g.::
+
+        messaging:
+            encoding:
+                weather: msgpack
+                environment: msgpack
+
+    Channels that are not listed use 'json' so existing text subscribers
+    keep working.
+
+    Args:
+        config (dict):  The loaded PEAS config.
+        channel (str):  Name of the channel.
+
+    Returns:
+        str: One of `ENCODINGS`.
+    """
+    try:
+        encoding = config['messaging']['encoding'].get(channel, 'json')
+    except (KeyError, TypeError, AttributeError):
+        encoding = 'json'
+
+    assert encoding in ENCODINGS, "Unknown message encoding: {}".format(encoding)
+
+    return encoding
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:  # pragma: no cover
+        raise ImportError("The 'msgpack' encoding requires the msgpack package")
+
+    return msgpack
+
+
+def _default(obj):
+    """ Convert values msgpack doesn't know about """
+    msgpack = _msgpack()
+
+    if isinstance(obj, dt):
+        if obj.tzinfo is not None:
+            obj = obj.replace(tzinfo=None) - obj.utcoffset()
+        delta = obj - _EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        return msgpack.ExtType(DATETIME_EXT, micros.to_bytes(8, 'big', signed=True))
+
+    # astropy Quantity
+    if hasattr(obj, 'unit') and hasattr(obj, 'value'):
+        return obj.value
+
+    # numpy scalars and arrays
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+
+    return str(obj)
+
+
+def _ext_hook(code, data):
+    if code == DATETIME_EXT:
+        return _EPOCH + tdelta(microseconds=int.from_bytes(data, 'big', signed=True))
+
+    return _msgpack().ExtType(code, data)
+
+
+def _json_default(obj):
+    if isinstance(obj, dt):
+        return obj.isoformat()
+
+    if hasattr(obj, 'unit') and hasattr(obj, 'value'):
+        return obj.value
+
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+
+    return str(obj)
+
+
+def encode(msg, encoding='msgpack', float32=True):
+    """ Encode a message body
+
+    Args:
+        msg (dict):         Message to encode.
+        encoding (str):     One of `ENCODINGS`.
+        float32 (bool):     For msgpack, pack floats as single precision. The
+            sensor readings carry far fewer significant digits than float32
+            holds so this is on by default. Datetimes are never affected.
+
+    Returns:
+        bytes: The encoded body, prefixed with `MSGPACK_MARKER` for msgpack.
+    """
+    if encoding == 'msgpack':
+        body = _msgpack().packb(msg, default=_default, use_bin_type=True, use_single_float=float32)
+        return MSGPACK_MARKER + body
+
+    return json.dumps(msg, default=_json_default, skipkeys=True).encode('utf-8')
+
+
+def decode(body):
+    """ Decode a message body, detecting the encoding
+
+    Args:
+        body (bytes): Body as produced by `encode` or `PanMessaging`.
+
+    Returns:
+        dict: The decoded message.
+    """
+    if body.startswith(MSGPACK_MARKER):
+        return _msgpack().unpackb(body[len(MSGPACK_MARKER):], ext_hook=_ext_hook, raw=False)
+
+    return json.loads(body.decode('utf-8'))
+
+
+def encode_frame(channel, msg, encoding='msgpack', float32=True):
+    """ Build a full `<channel> <body>` frame ready to be put on the socket
+
+    The channel stays a plain text prefix so zmq topic filtering on the
+    subscriber side works the same for every encoding.
+    """
+    return channel.encode('utf-8') + b' ' + encode(msg, encoding=encoding, float32=float32)
+
+
+def decode_frame(frame):
+    """ Split a frame into `(channel, msg)`, detecting the body encoding """
+    if isinstance(frame, str):
+        frame = frame.encode('utf-8')
+
+    channel, body = frame.split(b' ', 1)
+
+    return channel.decode('utf-8'), decode(body)
+
+
+def publish(publisher, channel, msg, encoding='json'):
+    """ Send `msg` on `channel` with the given encoding
+
+    The 'json' encoding goes through `PanMessaging.send_message` unchanged,
+    other encodings are written directly to the publisher's socket.
+
+    Args:
+        publisher (PanMessaging):   Publisher from `PanMessaging.create_publisher`.
+        channel (str):              Channel to publish on.
+        msg (dict):                 Message to send.
+        encoding (str):             One of `ENCODINGS`.
+    """
+    if encoding == 'json':
+        publisher.send_message(channel, msg)
+    else:
+        publisher.socket.send(encode_frame(channel, msg, encoding=encoding))
+
+
+def receive(subscriber, flags=0):
+    """ Receive the next message from a subscriber, whatever its encoding
+
+    Args:
+        subscriber (PanMessaging):  Subscriber from `PanMessaging.create_subscriber`.
+        flags (int):                Flags passed to the zmq `recv`.
+
+    Returns:
+        tuple: `(channel, msg)`
+    """
+    return decode_frame(subscriber.socket.recv(flags=flags))
+
+
+class PublisherService(object):
+
+    """ A single publisher shared by every sensor in the process
+
+    Messages are put on a bounded queue and sent from a background thread
+    that owns the zmq socket, so a capture never waits on the network. The
+    sender takes whatever is queued (up to `drain_size`) on each wakeup and
+    publishes it back to back, still one zmq message per message so
+    subscribers are unchanged. Per-channel statistics are kept in `stats`.
+
+    If the publisher can't be created the thread logs it, counts it in
+    `connect_errors` and retries with a backoff; meanwhile messages queue up
+    (and are dropped once the queue is full).
+
+    Use `get_publisher` rather than creating this directly.
+
+    Args:
+        port (int):         Port passed to `PanMessaging.create_publisher`.
+        drain_size (int):   Max number of messages sent per wakeup.
+        max_queue (int):    Max queued messages, newer ones are dropped
+            (and counted) when full.
+        connect (callable): Returns the publisher for a port, for testing.
+    """
+
+    def __init__(self, port=6510, drain_size=50, max_queue=1000, connect=None):
+        self.logger = logging.getLogger('peas-messaging')
+
+        self.port = port
+        self.drain_size = drain_size
+        self.connect = _create_publisher if connect is None else connect
+        self.retry_delay = 1.
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = defaultdict(lambda: {
+            'queued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'errors': 0,
+            'wakeups': 0,
+            'last_sent': None,
+            'max_wait': 0.,
+        })
+        self.connect_errors = 0
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if not self.is_running:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='peas-publisher', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """ Send anything still queued and stop the sender thread """
+        if self.is_running:
+            self._stopping.set()
+            self.queue.put(None)
+            self._thread.join(timeout)
+        self._thread = None
+
+    def send_message(self, channel, msg, encoding='json'):
+        """ Queue a copy of `msg` for `channel`, never blocks
+
+        Returns:
+            bool: False if the queue was full and the message was dropped.
+        """
+        self.start()
+
+        try:
+            # A copy, the caller may change `msg` before it is sent
+            self.queue.put_nowait((channel, copy.deepcopy(msg), encoding, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.stats[channel]['dropped'] += 1
+            return False
+
+        with self._lock:
+            self.stats[channel]['queued'] += 1
+
+        return True
+
+    def get_stats(self):
+        """ Return a copy of the per-channel statistics """
+        with self._lock:
+            return {channel: dict(values) for channel, values in self.stats.items()}
+
+    def _connect(self):
+        """ The publisher, retried with a backoff until created or stopping """
+        backoff = self.retry_delay
+        while not self._stopping.is_set():
+            try:
+                return self.connect(self.port)
+            except Exception as e:
+                with self._lock:
+                    self.connect_errors += 1
+                self.logger.warning("Can't create publisher on port {}, retrying in {:.0f}s: {}".format(
+                    self.port, backoff, e))
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 60.)
+
+        return None
+
+    def _drop_queued(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                with self._lock:
+                    self.stats[item[0]]['dropped'] += 1
+
+    def _run(self):
+        # zmq sockets are not thread safe so the socket lives in this thread
+        publisher = self._connect()
+        if publisher is None:
+            self.logger.warning("Stopped without a publisher, dropping {} queued messages".format(
+                self.queue.qsize()))
+            self._drop_queued()
+            return
+
+        running = True
+        while running:
+            items = [self.queue.get()]
+            while len(items) < self.drain_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            channels = set()
+            for item in items:
+                if item is None:
+                    running = False
+                    continue
+
+                channel, msg, encoding, queued_at = item
+                channels.add(channel)
+                try:
+                    publish(publisher, channel, msg, encoding=encoding)
+                except Exception:
+                    with self._lock:
+                        self.stats[channel]['errors'] += 1
+                else:
+                    wait = time.monotonic() - queued_at
+                    with self._lock:
+                        channel_stats = self.stats[channel]
+                        channel_stats['sent'] += 1
+                        channel_stats['last_sent'] = time.time()
+                        channel_stats['max_wait'] = max(channel_stats['max_wait'], wait)
+
+            with self._lock:
+                for channel in channels:
+                    self.stats[channel]['wakeups'] += 1
+
+
+def _create_publisher(port):
+    from pocs.utils.messaging import PanMessaging
+    return PanMessaging.create_publisher(port)
+
+
+_publisher_service = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher(config=None):
+    """ Return the process-wide `PublisherService`, creating it if needed
+
+    Args:
+        config (dict): PEAS config; `messaging.publisher_port` (default 6510)
+            and `messaging.max_queue` are used on first call only.
+    """
+    global _publisher_service
+
+    with _publisher_lock:
+        if _publisher_service is None:
+            try:
+                cfg = config.get('messaging', dict()) or dict()
+            except AttributeError:
+                cfg = dict()
+
+            _publisher_service = PublisherService(port=cfg.get('publisher_port', 6510),
+                                                  max_queue=cfg.get('max_queue', 1000))
+
+    return _publisher_service
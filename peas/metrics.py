@@ -0,0 +1,295 @@
+import logging
+import threading
+import time
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# A weather reading with none of these had every serial query fail
+WEATHER_FIELDS = ('sky_temp_C', 'ambient_temp_C', 'rain_frequency', 'wind_speed_KPH')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                   for k, v in sorted(labels.items())))
+
+
+def _value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
+
+
+def has_reading(sensor, result):
+    """ False for a capture that returned without data
+
+    A stalled Arduino (no lines, only bad JSON or an unplugged reader) gives
+    an empty dict rather than an error, and the weather sensor still gives
+    its name and safety decision when every serial query failed.
+    """
+    if not result:
+        return False
+
+    if sensor == 'weather':
+        return any(field in result for field in WEATHER_FIELDS)
+
+    return True
+
+
+class Metrics(object):
+
+    """ Capture counts, errors and latencies of the sensors
+
+    `measure` (or `record`) is called around each capture. Durations of the
+    last `window` captures of each sensor are kept for the quantiles.
+    Other values (queue depths, webcam counts...) are read when rendering
+    from the functions given to `add_gauge`.
+
+    `render` gives everything in the Prometheus text format, served by
+    `MetricsServer`.
+
+    Args:
+        window (int):   Captures per sensor kept for the latency quantiles.
+    """
+
+    def __init__(self, window=500):
+        self.logger = logging.getLogger('peas-metrics')
+        self.window = window
+        self.started = time.time()
+
+        self._sensors = dict()
+        self._gauges = list()
+        self._lock = threading.Lock()
+
+    def _sensor(self, sensor):
+        if sensor not in self._sensors:
+            self._sensors[sensor] = {
+                'captures': 0,
+                'errors': 0,
+                'last_success': None,
+                'last_error': None,
+                'durations': deque(maxlen=self.window),
+                'total_duration': 0.,
+            }
+        return self._sensors[sensor]
+
+    def record(self, sensor, duration, error=None):
+        """ Count a capture of `sensor` that took `duration` seconds """
+        with self._lock:
+            values = self._sensor(sensor)
+            values['captures'] += 1
+            values['durations'].append(duration)
+            values['total_duration'] += duration
+
+            if error is None:
+                values['last_success'] = time.time()
+            else:
+                values['errors'] += 1
+                values['last_error'] = '{}'.format(error)
+
+    def measure(self, sensor, func, *args, check=None, **kwargs):
+        """ Call `func`, recording its duration and any exception (re-raised)
+
+        With `check` (e.g. `has_reading`), a result for which `check(sensor,
+        result)` is False also counts as an error, raised as a `ValueError`.
+        """
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+            if check is not None and not check(sensor, result):
+                raise ValueError("No data from {}".format(sensor))
+        except Exception as e:
+            self.record(sensor, time.monotonic() - start, error=e)
+            raise
+
+        self.record(sensor, time.monotonic() - start)
+        return result
+
+    def add_gauge(self, name, help_text, func, kind='gauge'):
+        """ Export the value(s) returned by `func` when rendering
+
+        Args:
+            name (str):         Metric name, e.g. 'peas_queue_depth'.
+            help_text (str):    Description.
+            func (callable):    Returns a number, or a list of `(labels, value)`
+                with `labels` a dict, e.g. `[({'queue': 'spool'}, 3)]`.
+            kind (str):         'gauge' or 'counter'.
+        """
+        with self._lock:
+            self._gauges.append((name, help_text, func, kind))
+
+    def snapshot(self):
+        """ Copy of the per-sensor values, with the latency quantiles """
+        with self._lock:
+            sensors = {name: dict(values, durations=list(values['durations']))
+                       for name, values in self._sensors.items()}
+
+        for values in sensors.values():
+            durations = values.pop('durations')
+            if len(durations) > 0:
+                quantiles = np.quantile(durations, QUANTILES)
+            else:
+                quantiles = [None] * len(QUANTILES)
+            values['quantiles'] = dict(zip(QUANTILES, quantiles))
+
+        return sensors
+
+    def health(self, max_age, now=None):
+        """ Whether every sensor captured successfully recently
+
+        Args:
+            max_age (dict):     Sensor name to the max seconds since its
+                last successful capture (or since the start, before one).
+            now (float):        Unix time, default now.
+
+        Returns:
+            tuple: True if healthy, and a dict of the problems by sensor.
+        """
+        if now is None:
+            now = time.time()
+
+        sensors = self.snapshot()
+        problems = dict()
+        for sensor, age in max_age.items():
+            last = sensors.get(sensor, dict()).get('last_success') or self.started
+            if now - last > age:
+                problems[sensor] = "No capture for {:.0f} s (last error: {})".format(
+                    now - last, sensors.get(sensor, dict()).get('last_error'))
+
+        return len(problems) == 0, problems
+
+    def render(self):
+        """ All the metrics in the Prometheus text format """
+        sensors = self.snapshot()
+        lines = list()
+
+        def family(name, help_text, kind, samples):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, _labels(labels), _value(value)))
+
+        family('peas_captures_total', 'Captures per sensor.', 'counter',
+               [('', {'sensor': s}, v['captures']) for s, v in sorted(sensors.items())])
+        family('peas_capture_errors_total', 'Failed captures per sensor.', 'counter',
+               [('', {'sensor': s}, v['errors']) for s, v in sorted(sensors.items())])
+        family('peas_last_success_timestamp_seconds', 'Unix time of the last successful capture.', 'gauge',
+               [('', {'sensor': s}, v['last_success']) for s, v in sorted(sensors.items())])
+
+        samples = list()
+        for s, v in sorted(sensors.items()):
+            for q, value in v['quantiles'].items():
+                samples.append(('', {'sensor': s, 'quantile': q}, value))
+            samples.append(('_sum', {'sensor': s}, v['total_duration']))
+            samples.append(('_count', {'sensor': s}, v['captures']))
+        family('peas_capture_duration_seconds', 'Capture latency, over the last {} captures.'.format(self.window),
+               'summary', samples)
+
+        family('peas_uptime_seconds', 'Seconds since the metrics started.', 'gauge',
+               [('', None, time.time() - self.started)])
+
+        with self._lock:
+            gauges = list(self._gauges)
+
+        for name, help_text, func, kind in gauges:
+            try:
+                values = func()
+            except Exception as e:
+                self.logger.warning("Can't read metric {}: {}".format(name, e))
+                continue
+
+            if not isinstance(values, (list, tuple)):
+                values = [(None, values)]
+            family(name, help_text, kind, [('', labels, value) for labels, value in values])
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+
+    """ Serve `Metrics` over HTTP from a background thread
+
+    `GET /metrics` returns `Metrics.render` and `GET /health` returns 200,
+    or 503 with the problems if a sensor is stalled (see `Metrics.health`).
+
+    Args:
+        metrics (Metrics):  What to serve.
+        host (str):         Address to listen on, local only by default.
+        port (int):         Port to listen on, 0 for any free one.
+        max_age (dict):     Sensor name to max seconds without a capture,
+            for `/health`.
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=9110, max_age=None):
+        self.metrics = metrics
+        self.max_age = max_age or dict()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    code, body = 200, server.metrics.render()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/health':
+                    healthy, problems = server.metrics.health(server.max_age)
+                    code = 200 if healthy else 503
+                    body = 'ok\n' if healthy else ''.join('{}: {}\n'.format(k, v) for k, v in sorted(problems.items()))
+                    content_type = 'text/plain; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+
+                data = body.encode()
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the log
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='peas-metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """ Return the process-wide `Metrics`, creating it if needed """
+    global _metrics
+
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+
+    return _metrics
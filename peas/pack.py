@@ -0,0 +1,215 @@
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+from datetime import datetime as dt
+from glob import glob
+
+from .exposure import sidecar_file
+
+# One row per frame: capture time and where its bytes are in the pack
+INDEX_DTYPE = np.dtype([('time', 'M8[s]'), ('offset', '<u8'), ('size', '<u4')])
+
+
+def frame_time(fn):
+    """ Capture time of an image named `<port>_<YYYYMMDDTHHMMSS>.jpeg` """
+    stamp = os.path.splitext(os.path.basename(fn))[0].rsplit('_', 1)[-1]
+    return np.datetime64(dt.strptime(stamp, '%Y%m%dT%H%M%S'), 's')
+
+
+def pack_file(directory, port):
+    """ Pack of the frames of `port` in the day `directory` """
+    return os.path.join(directory, '{}.pack'.format(port))
+
+
+class FramePack(object):
+
+    """ The frames of one camera and day in a single append-only file
+
+    The JPEGs are written back to back to `<port>.pack` and
+    `<port>.index.npy` holds the capture time, offset and size of each
+    (see `INDEX_DTYPE`), so a frame is read with one seek and the pack is
+    never unpacked. The stats of the frames (`<image>.json`, see
+    `peas.exposure`) go to `<port>.stats.jsonl`, one line per frame.
+
+    Frames are appended first, then the index replaced and only then their
+    stats appended, so after a crash the pack is cut back to the end of the
+    last indexed frame and those frames packed again. `append` holds an exclusive `flock` on the
+    pack throughout, so several processes can pack the same day.
+
+    Args:
+        path (str): The pack, `<webcam_dir>/<YYYYMMDD>/<port>.pack`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        base = os.path.splitext(path)[0]
+        self.index_file = '{}.index.npy'.format(base)
+        self.stats_file = '{}.stats.jsonl'.format(base)
+
+        self._index = None
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        """ The index, re-read whenever it was replaced """
+        try:
+            mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+
+        if mtime != self._index_mtime:
+            self._index = np.load(self.index_file, allow_pickle=False)
+            self._index_mtime = mtime
+
+        return self._index
+
+    @property
+    def times(self):
+        return self.index['time']
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, frames, remove=False):
+        """ Add the images `frames` after the packed ones
+
+        Frames already packed (same time) are skipped, and frames older than
+        the last packed one are left alone.
+
+        Args:
+            frames (list):  JPEG file names, `<port>_<YYYYMMDDTHHMMSS>.jpeg`.
+            remove (bool):  Delete the images (and their stats) once indexed.
+
+        Returns:
+            int: Number of frames added.
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._lock, os.fdopen(fd, 'r+b') as pack:
+            # Other processes (e.g. scripts/pack_webcams.py) may pack the same
+            # day, so the index is only read once the pack is locked
+            fcntl.flock(pack.fileno(), fcntl.LOCK_EX)
+
+            index = self.index
+            end = int(index['offset'][-1] + index['size'][-1]) if len(index) else 0
+            last = index['time'][-1] if len(index) else None
+
+            frames = sorted(frames, key=frame_time)
+            times = np.array([frame_time(fn) for fn in frames], dtype='M8[s]')
+
+            packed = [fn for fn, done in zip(frames, np.isin(times, index['time'])) if done]
+            new = [fn for fn, time in zip(frames, times) if last is None or time > last]
+
+            # Drop anything written after the last index update
+            pack.truncate(end)
+            pack.seek(end)
+
+            rows = list()
+            stats = list()
+            for fn in new:
+                with open(fn, 'rb') as image:
+                    data = image.read()
+
+                time = frame_time(fn)
+                pack.write(data)
+                rows.append((time, end, len(data)))
+                end += len(data)
+
+                try:
+                    with open(sidecar_file(fn)) as sidecar:
+                        record = json.load(sidecar)
+                    record['time'] = str(time)
+                    stats.append(record)
+                except (IOError, ValueError):
+                    pass
+
+            pack.flush()
+            os.fsync(pack.fileno())
+
+            if len(rows) == 0:
+                return 0
+
+            index = np.concatenate([index, np.array(rows, dtype=INDEX_DTYPE)])
+            tmp = '{}.tmp.npy'.format(os.path.splitext(self.index_file)[0])
+            np.save(tmp, index)
+            os.replace(tmp, self.index_file)
+
+            # Only once indexed, so frames packed again after a crash don't
+            # repeat their stats
+            if len(stats) > 0:
+                with open(self.stats_file, 'a') as f:
+                    for record in stats:
+                        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+            if remove:
+                for fn in packed + new:
+                    for name in [fn, sidecar_file(fn)]:
+                        try:
+                            os.remove(name)
+                        except FileNotFoundError:
+                            pass
+
+            return len(rows)
+
+    def read(self, i):
+        """ Bytes of frame `i` """
+        row = self.index[i]
+        with open(self.path, 'rb') as f:
+            f.seek(int(row['offset']))
+            return f.read(int(row['size']))
+
+    def find(self, time):
+        """ Index of the last frame at or before `time`, -1 if there is none """
+        return int(np.searchsorted(self.times, np.datetime64(time, 's'), side='right')) - 1
+
+    def frame_at(self, time):
+        """ `(time, bytes)` of the last frame at or before `time`, or None """
+        i = self.find(time)
+        if i < 0:
+            return None
+
+        return self.times[i], self.read(i)
+
+    def iter_frames(self, first=0, last=None):
+        """ Bytes of frames `first` to `last` (excluded), read in one pass """
+        index = self.index[first:last]
+        with open(self.path, 'rb') as f:
+            for row in index:
+                f.seek(int(row['offset']))
+                yield f.read(int(row['size']))
+
+    def read_stats(self):
+        """ Stats records of the packed frames, with their `time` """
+        try:
+            with open(self.stats_file) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return list()
+
+
+def find_frame(webcam_dir, port, time):
+    """ The last image of `port` at or before `time` (UT) on that day
+
+    Looks in the day's pack and in the images not packed yet.
+
+    Returns:
+        tuple: `(time, bytes)` with the `datetime64` of the image, or None.
+    """
+    directory = os.path.join(webcam_dir, '{:%Y%m%d}'.format(time))
+    time = np.datetime64(time, 's')
+
+    found = FramePack(pack_file(directory, port)).frame_at(time)
+
+    images = sorted(glob(os.path.join(directory, '{}_*.jpeg'.format(port))))
+    times = np.array([frame_time(fn) for fn in images], dtype='M8[s]')
+    i = int(np.searchsorted(times, time, side='right')) - 1
+    if i >= 0 and (found is None or times[i] > found[0]):
+        with open(images[i], 'rb') as f:
+            found = times[i], f.read()
+
+    return found
@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+
+# Preview name and max (width, height), the image aspect is kept
+PREVIEW_SIZES = (
+    ('tn', (240, 180)),
+    ('small', (480, 360)),
+    ('medium', (800, 600)),
+)
+
+
+def replace_symlink(target, link):
+    """ Point `link` at `target` without a moment where `link` is missing """
+    tmp = '{}.tmp'.format(link)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+
+
+def make_previews(fn, directory, name, sizes=PREVIEW_SIZES, quality=85):
+    """ Write the previews of the JPEG `fn`
+
+    The image is decoded once, in draft mode: the JPEG decoder scales it
+    down by a power of two to just above the largest preview while
+    decoding, which is much faster than decoding the full size. Each
+    preview is then resized from that and written atomically to
+    `<directory>/<preview>_<name>.jpeg`.
+
+    Args:
+        fn (str):           JPEG image.
+        directory (str):    Where the previews are written.
+        name (str):         Name of the previews, e.g. the camera port.
+        sizes (tuple):      `(preview, (width, height))` pairs.
+        quality (int):      JPEG quality of the previews.
+
+    Returns:
+        dict: Preview name to file name.
+    """
+    from PIL import Image
+
+    largest = (max(size[0] for _, size in sizes), max(size[1] for _, size in sizes))
+
+    with Image.open(fn) as img:
+        img.draft('RGB', largest)
+        img = img.convert('RGB')
+
+    previews = dict()
+    for preview, size in sorted(sizes, key=lambda s: s[1], reverse=True):
+        # Each preview from the one before, they only get smaller
+        img.thumbnail(size, Image.LANCZOS)
+
+        out_file = os.path.join(directory, '{}_{}.jpeg'.format(preview, name))
+        tmp = '{}.tmp'.format(out_file)
+        img.save(tmp, 'JPEG', quality=quality)
+        os.replace(tmp, out_file)
+
+        previews[preview] = out_file
+
+    return previews
+
+
+class PreviewService(object):
+
+    """ Makes the previews of the latest webcam images in the background
+
+    `submit` never blocks the capture: the image is handed to a thread, and
+    if a camera captures again before its previous image was done only the
+    newest is kept.
+
+    Use `get_preview_service` rather than creating this directly.
+
+    Args:
+        sizes (tuple):  `(preview, (width, height))` pairs, see `make_previews`.
+        quality (int):  JPEG quality of the previews.
+    """
+
+    def __init__(self, sizes=PREVIEW_SIZES, quality=85):
+        self.logger = logging.getLogger('peas-preview')
+
+        self.sizes = sizes
+        self.quality = quality
+
+        self.stats = {'submitted': 0, 'made': 0, 'skipped': 0, 'errors': 0}
+
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if not self.is_running:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name='peas-preview', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """ Finish the pending previews and stop the thread """
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, fn, directory, name):
+        """ Queue the previews of `fn`, replacing any pending image of `name` """
+        self.start()
+
+        with self._lock:
+            if name in self._pending:
+                self.stats['skipped'] += 1
+            self._pending[name] = (fn, directory)
+            self.stats['submitted'] += 1
+            self._wakeup.notify()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def pending(self):
+        """ Number of cameras whose latest image is waiting for its previews """
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running and len(self._pending) == 0:
+                    self._wakeup.wait()
+
+                if len(self._pending) == 0:
+                    return
+
+                name, (fn, directory) = self._pending.popitem()
+
+            try:
+                make_previews(fn, directory, name, sizes=self.sizes, quality=self.quality)
+            except Exception as e:
+                self.logger.warning("Can't make previews of {}: {}".format(fn, e))
+                with self._lock:
+                    self.stats['errors'] += 1
+            else:
+                with self._lock:
+                    self.stats['made'] += 1
+
+
+_preview_service = None
+_preview_lock = threading.Lock()
+
+
+def get_preview_service(config=None):
+    """ Return the process-wide `PreviewService`, creating it if needed
+
+    Args:
+        config (dict): PEAS config; `webcam_previews.sizes` (preview name to
+            `[width, height]`) and `webcam_previews.quality` are used on
+            first call only.
+    """
+    global _preview_service
+
+    with _preview_lock:
+        if _preview_service is None:
+            try:
+                cfg = config.get('webcam_previews', dict()) or dict()
+            except AttributeError:
+                cfg = dict()
+
+            sizes = PREVIEW_SIZES
+            if 'sizes' in cfg:
+                sizes = tuple((preview, tuple(size)) for preview, size in cfg['sizes'].items())
+
+            _preview_service = PreviewService(sizes=sizes, quality=cfg.get('quality', 85))
+
+    return _preview_service
@@ -0,0 +1,255 @@
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+import numpy as np
+
+from .rollup import INTERVALS
+
+# Resolution tiers from finest to coarsest. Each tier lives in the store under
+# `<record_type><suffix>`.
+TIERS = (
+    ('', 0),
+    ('_1m', INTERVALS['1m']),
+    ('_1h', INTERVALS['1h']),
+)
+
+# Default age (days) after which a tier is compacted into the next one
+DEFAULT_AGES = {
+    'raw': 7,
+    '1m': 90,
+}
+
+
+def _bucket_index(dates, interval):
+    """ Group boundaries of sorted `dates` into `interval` second buckets
+
+    Returns:
+        tuple: `(starts, offsets)`, the bucket start times and the index of
+            the first row of each bucket (as used by `np.ufunc.reduceat`).
+    """
+    seconds = dates.astype('M8[s]').astype(np.int64)
+    buckets = seconds // interval
+    offsets = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    starts = (buckets[offsets] * interval).astype('M8[s]').astype('M8[us]')
+
+    return starts, offsets
+
+
+def _last_valid(values, valid, offsets):
+    positions = np.where(valid, np.arange(len(values)), -1)
+    last = np.maximum.reduceat(positions, offsets)
+    return np.where(last >= 0, values[np.maximum(last, 0)], np.nan)
+
+
+def rollup_raw(data, interval):
+    """ Roll raw columns up into `interval` second buckets
+
+    Vectorised equivalent of `peas.rollup.Rollup` over a whole partition.
+    Numeric and boolean columns become `<name>_min/_mean/_max/_count/_last`;
+    other columns are dropped.
+
+    Args:
+        data (dict):    Column name to array, including a sorted `date`.
+        interval (int): Bucket size in seconds.
+
+    Returns:
+        dict: Rolled up columns.
+    """
+    starts, offsets = _bucket_index(data['date'], interval)
+    out = {'date': starts, 'interval': np.full(len(starts), interval, dtype='<f8')}
+
+    for name, values in data.items():
+        if name in ('date', 'interval') or values.dtype.kind not in 'biuf':
+            continue
+
+        values = np.asarray(values, dtype='<f8')
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid.astype('<f8'), offsets)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out['{}_min'.format(name)] = np.where(
+                count > 0, np.minimum.reduceat(np.where(valid, values, np.inf), offsets), np.nan)
+            out['{}_mean'.format(name)] = np.add.reduceat(np.where(valid, values, 0.), offsets) / count
+            out['{}_max'.format(name)] = np.where(
+                count > 0, np.maximum.reduceat(np.where(valid, values, -np.inf), offsets), np.nan)
+        out['{}_count'.format(name)] = count
+        out['{}_last'.format(name)] = _last_valid(values, valid, offsets)
+
+    return out
+
+
+def rollup_buckets(data, interval):
+    """ Combine finer rollup buckets into coarser `interval` second buckets
+
+    Minimum and maximum are kept exactly, means are weighted by count.
+    """
+    starts, offsets = _bucket_index(data['date'], interval)
+    out = {'date': starts, 'interval': np.full(len(starts), interval, dtype='<f8')}
+
+    for name in data.keys():
+        if not name.endswith('_mean'):
+            continue
+        field = name[:-len('_mean')]
+
+        count = np.nan_to_num(np.asarray(data['{}_count'.format(field)], dtype='<f8'))
+        mean = np.asarray(data[name], dtype='<f8')
+        valid = count > 0
+        total = np.add.reduceat(count, offsets)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out['{}_min'.format(field)] = np.where(total > 0, np.minimum.reduceat(
+                np.where(valid, data['{}_min'.format(field)], np.inf), offsets), np.nan)
+            out['{}_mean'.format(field)] = np.add.reduceat(np.where(valid, mean * count, 0.), offsets) / total
+            out['{}_max'.format(field)] = np.where(total > 0, np.maximum.reduceat(
+                np.where(valid, data['{}_max'.format(field)], -np.inf), offsets), np.nan)
+        out['{}_count'.format(field)] = total
+        out['{}_last'.format(field)] = _last_valid(
+            np.asarray(data['{}_last'.format(field)], dtype='<f8'), valid, offsets)
+
+    return out
+
+
+def _day_end(day):
+    return dt.strptime(day, '%Y%m%d') + tdelta(days=1)
+
+
+def compact(store, record_type, ages=None, now=None, logger=None):
+    """ Move old data of `record_type` down to coarser tiers
+
+    Raw day partitions older than `ages['raw']` days are rolled up into the
+    1-minute tier and removed. 1-minute partitions older than `ages['1m']`
+    days are rolled up into the 1-hour tier and removed. The coarser
+    partition for a day is always rebuilt from the finer one so buckets
+    written at ingest (see `peas.rollup`) are replaced by complete ones.
+
+    Args:
+        store (ColumnStore):    Store holding the data.
+        record_type (str):      Base record type, e.g. 'weather'.
+        ages (dict):            Days to keep 'raw' and '1m', default `DEFAULT_AGES`.
+        now (datetime):         Reference time (UTC), default now.
+
+    Returns:
+        list: `(record_type, day)` of the partitions that were compacted.
+    """
+    if ages is None:
+        ages = DEFAULT_AGES
+    if now is None:
+        now = dt.utcnow()
+
+    compacted = list()
+
+    steps = [
+        (TIERS[0], TIERS[1], ages.get('raw', DEFAULT_AGES['raw']), rollup_raw),
+        (TIERS[1], TIERS[2], ages.get('1m', DEFAULT_AGES['1m']), rollup_buckets),
+    ]
+
+    for (src_suffix, _), (dst_suffix, interval), max_age, rollup in steps:
+        src_type = record_type + src_suffix
+        dst_type = record_type + dst_suffix
+        cutoff = now - tdelta(days=max_age)
+
+        for day in store.days(src_type):
+            if _day_end(day) > cutoff:
+                continue
+
+            data = store.read_day(src_type, day)
+            if len(data['date']) > 0:
+                store.write_day(dst_type, day, rollup(data, interval))
+            store.remove_day(src_type, day)
+
+            if logger is not None:
+                logger.debug("Compacted {} {} into {}".format(src_type, day, dst_type))
+
+            compacted.append((src_type, day))
+
+    return compacted
+
+
+def _tier_fields(store, tier_type, day, suffix):
+    schema = store.columns(tier_type, day)
+    if suffix == '':
+        return [name for name, dtype in schema.items()
+                if name != 'date' and np.dtype(dtype).kind in 'biuf']
+
+    return [name[:-len('_mean')] for name in schema if name.endswith('_mean')]
+
+
+def query(store, record_type, start, end, resolution=0, columns=None):
+    """ Read `record_type` from the coarsest tier that meets `resolution`
+
+    For each day in the range the coarsest tier whose bucket size is no
+    larger than `resolution` seconds is used. If the day only exists in a
+    coarser tier (it has been compacted) that tier is used instead.
+
+    Results have the same shape whatever tier a day came from: for every
+    field `<name>` there is `<name>` (the value, or bucket mean),
+    `<name>_min` and `<name>_max` (equal to the value for raw rows), plus
+    `date` and `interval` (0 for raw rows).
+
+    Args:
+        store (ColumnStore):    Store holding the data.
+        record_type (str):      Base record type, e.g. 'weather'.
+        start (datetime):       Inclusive start (UTC).
+        end (datetime):         Inclusive end (UTC).
+        resolution (int):       Coarsest acceptable spacing in seconds.
+        columns (list):         Fields to return, default all numeric fields
+            of the first day found.
+
+    Returns:
+        dict: Column name to array.
+    """
+    # Finest first; the preferred tier for a day is the last acceptable one
+    acceptable = [t for t in TIERS if t[1] <= resolution]
+    fallback = [t for t in TIERS if t[1] > resolution]
+
+    available = {suffix: set(store.days(record_type + suffix, start=start, end=end)) for suffix, _ in TIERS}
+    all_days = sorted(set.union(*available.values()))
+
+    chunks = list()
+    for day in all_days:
+        for suffix, interval in acceptable[::-1] + fallback:
+            if day in available[suffix]:
+                break
+
+        tier_type = record_type + suffix
+        if columns is None:
+            columns = _tier_fields(store, tier_type, day, suffix)
+
+        day_start = max(start, dt.strptime(day, '%Y%m%d'))
+        day_end = min(end, _day_end(day) - tdelta(microseconds=1))
+
+        if suffix == '':
+            data = store.read(tier_type, start=day_start, end=day_end, columns=columns)
+            if len(data) == 0:
+                continue
+            chunk = {'date': np.asarray(data['date']), 'interval': np.zeros(len(data['date']))}
+            for name in columns:
+                values = np.asarray(data[name], dtype='<f8')
+                chunk[name] = chunk['{}_min'.format(name)] = chunk['{}_max'.format(name)] = values
+        else:
+            wanted = ['{}_{}'.format(name, stat) for name in columns for stat in ('mean', 'min', 'max')]
+            data = store.read(tier_type, start=day_start, end=day_end, columns=wanted)
+            if len(data) == 0:
+                continue
+            chunk = {'date': np.asarray(data['date']), 'interval': np.full(len(data['date']), float(interval))}
+            for name in columns:
+                chunk[name] = np.asarray(data['{}_mean'.format(name)], dtype='<f8')
+                chunk['{}_min'.format(name)] = np.asarray(data['{}_min'.format(name)], dtype='<f8')
+                chunk['{}_max'.format(name)] = np.asarray(data['{}_max'.format(name)], dtype='<f8')
+
+        chunks.append(chunk)
+
+    if len(chunks) == 0:
+        return dict()
+
+    return {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0].keys()}
+
+
+def retention_ages(config):
+    """ Read the `store.retention` ages (days) from the config """
+    try:
+        ages = dict(DEFAULT_AGES)
+        ages.update(config['store']['retention'] or dict())
+        return ages
+    except (KeyError, TypeError):
+        return dict(DEFAULT_AGES)
@@ -0,0 +1,143 @@
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from .store import as_utc
+from .store import flatten
+
+# Bucket sizes in seconds, keyed by the suffix used for their record type
+INTERVALS = {
+    '1m': 60,
+    '1h': 60 * 60,
+}
+
+STATS = ('min', 'mean', 'max', 'count', 'last')
+
+_EPOCH = dt(1970, 1, 1)
+
+
+def bucket_start(date, interval):
+    """ Start of the `interval` second bucket holding `date` """
+    seconds = (date - _EPOCH).total_seconds()
+    return _EPOCH + tdelta(seconds=int(seconds // interval) * interval)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+
+class Rollup(object):
+
+    """ Streaming min/mean/max/count/last of every numeric field over time buckets
+
+    Only the running statistics of the current bucket are kept, so memory is
+    constant per field. When a value arrives for a later bucket the current
+    one is closed and returned as a flat record::
+
+        {'date': <bucket start>, 'interval': 60,
+         'humidity_min': ..., 'humidity_mean': ..., 'humidity_max': ...,
+         'humidity_count': ..., 'humidity_last': ..., ...}
+
+    Nested records are flattened (see `peas.store.flatten`). Booleans count
+    as 0/1, other non-numeric values are ignored.
+
+    Args:
+        interval (int): Bucket size in seconds.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.start = None
+        self.fields = dict()
+
+    def add(self, record, date=None):
+        """ Add a record
+
+        Args:
+            record (dict):      Raw reading.
+            date (datetime):    Time of the reading, defaults to `record['date']`.
+
+        Returns:
+            list: Buckets closed by this record (empty or one record).
+        """
+        if date is None:
+            date = record['date']
+        start = bucket_start(as_utc(date), self.interval)
+
+        closed = list()
+        if self.start is not None and start != self.start:
+            closed.append(self.close())
+
+        if self.start is None:
+            self.start = start
+
+        for name, value in flatten(record).items():
+            if not _is_number(value) or value != value:
+                continue
+            # Booleans (e.g. `safe`) roll up to the fraction of True
+            value = float(value)
+
+            stats = self.fields.get(name)
+            if stats is None:
+                self.fields[name] = [value, value, value, 1, value]
+            else:
+                if value < stats[0]:
+                    stats[0] = value
+                if value > stats[1]:
+                    stats[1] = value
+                stats[2] += value
+                stats[3] += 1
+                stats[4] = value
+
+        return closed
+
+    def close(self):
+        """ Close the current bucket and return it (None if empty) """
+        if self.start is None:
+            return None
+
+        bucket = {'date': self.start, 'interval': self.interval}
+        for name, (min_value, max_value, total, count, last) in sorted(self.fields.items()):
+            bucket['{}_min'.format(name)] = min_value
+            bucket['{}_mean'.format(name)] = total / count
+            bucket['{}_max'.format(name)] = max_value
+            bucket['{}_count'.format(name)] = count
+            bucket['{}_last'.format(name)] = last
+
+        self.start = None
+        self.fields = dict()
+
+        return bucket
+
+
+class RollupAggregator(object):
+
+    """ Keep 1-minute and 1-hour rollups of a stream of records
+
+    Closed buckets are passed to `emit(record_type, bucket)` where the record
+    type is `<record_type>_<suffix>`, e.g. `environment_telemetry_board_1m`.
+
+    Args:
+        emit (callable):    Called with each closed bucket.
+        intervals (dict):   Suffix to bucket size in seconds, default `INTERVALS`.
+    """
+
+    def __init__(self, emit, intervals=None):
+        self.emit = emit
+        self.intervals = INTERVALS if intervals is None else intervals
+        self.rollups = dict()
+
+    def add(self, record_type, record, date=None):
+        for suffix, interval in self.intervals.items():
+            key = (record_type, suffix)
+            if key not in self.rollups:
+                self.rollups[key] = Rollup(interval)
+
+            for bucket in self.rollups[key].add(record, date=date):
+                self.emit('{}_{}'.format(record_type, suffix), bucket)
+
+    def flush(self):
+        """ Close and emit all open buckets, e.g. on shutdown """
+        for (record_type, suffix), rollup in self.rollups.items():
+            bucket = rollup.close()
+            if bucket is not None:
+                self.emit('{}_{}'.format(record_type, suffix), bucket)
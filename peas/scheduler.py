@@ -0,0 +1,212 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job(object):
+
+    """ A function run every `interval` seconds by a `Scheduler`
+
+    Args:
+        name (str):             Name of the job, e.g. the sensor.
+        func (callable):        Called without arguments.
+        interval (float):       Seconds between runs, or a callable returning
+            them (read again after every run, so it can change).
+    """
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='peas-{}'.format(name))
+        self.future = None
+        self.next_run = None
+
+        self.stats = {
+            'runs': 0,
+            'errors': 0,
+            'overruns': 0,
+            'missed': 0,
+            'last_duration': None,
+            'max_duration': 0.,
+            'max_lateness': 0.,
+        }
+
+    def get_interval(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        return max(float(interval), 0.001)
+
+    @property
+    def is_running(self):
+        return self.future is not None and not self.future.done()
+
+
+class Scheduler(object):
+
+    """ Run jobs periodically from a single thread
+
+    The next run of each job is kept in a heap of deadlines on the
+    monotonic clock, and the thread sleeps until the earliest one. Runs are
+    due at `start + n * interval`, so the period doesn't drift by the time
+    the job takes. Each job runs in its own single worker thread, so a slow
+    job (e.g. the webcams) never delays another (e.g. the weather).
+
+    A job still running when its next run is due has overrun: that run is
+    skipped (and counted in `overruns`) instead of piling up. Deadlines
+    that had already passed when the scheduler got to them (e.g. after the
+    machine was suspended) are skipped and counted in `missed`.
+
+    Args:
+        clock (callable):   Monotonic clock, in seconds.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.logger = logging.getLogger('peas-scheduler')
+        self.clock = clock
+
+        self._jobs = dict()
+        self._heap = list()
+        self._counter = itertools.count()
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def jobs(self):
+        with self._lock:
+            return sorted(self._jobs)
+
+    def start(self):
+        with self._lock:
+            if not self.is_running:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name='peas-scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self, wait=True, timeout=None):
+        """ Cancel all the jobs and stop the thread
+
+        Args:
+            wait (bool):        Wait for the runs in progress to finish.
+            timeout (float):    Max seconds to wait for the scheduler thread.
+        """
+        with self._lock:
+            self._running = False
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+            self._heap = list()
+            self._wakeup.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+        for job in jobs:
+            job.executor.shutdown(wait=wait)
+
+    def add(self, name, func, interval, delay=0.):
+        """ Run `func` every `interval` seconds, the first time after `delay`
+
+        A job with the same name is replaced.
+
+        Returns:
+            Job: The new job.
+        """
+        self.remove(name)
+
+        job = Job(name, func, interval)
+        with self._lock:
+            job.next_run = self.clock() + delay
+            self._jobs[name] = job
+            heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+            self._wakeup.notify()
+
+        return job
+
+    def remove(self, name, wait=False):
+        """ Cancel the job `name`, a run in progress is left to finish
+
+        Returns:
+            bool: True if there was such a job.
+        """
+        with self._lock:
+            job = self._jobs.pop(name, None)
+            # Its heap entry is skipped when due
+            self._wakeup.notify()
+
+        if job is None:
+            return False
+
+        job.executor.shutdown(wait=wait)
+        return True
+
+    def get_stats(self):
+        """ Copy of the statistics of each job (durations and lateness in seconds) """
+        with self._lock:
+            return {name: dict(job.stats) for name, job in self._jobs.items()}
+
+    def _execute(self, job):
+        start = self.clock()
+        try:
+            job.func()
+        except Exception as e:
+            self.logger.warning("Job {} failed: {}".format(job.name, e))
+            with self._lock:
+                job.stats['errors'] += 1
+
+        duration = self.clock() - start
+        with self._lock:
+            job.stats['runs'] += 1
+            job.stats['last_duration'] = duration
+            job.stats['max_duration'] = max(job.stats['max_duration'], duration)
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                if len(self._heap) == 0:
+                    self._wakeup.wait()
+                    continue
+
+                due, _, job = self._heap[0]
+                now = self.clock()
+                if due > now:
+                    self._wakeup.wait(due - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                if self._jobs.get(job.name) is not job:
+                    # Removed or replaced
+                    continue
+
+                job.stats['max_lateness'] = max(job.stats['max_lateness'], now - due)
+
+                if job.is_running:
+                    job.stats['overruns'] += 1
+                    self.logger.warning("Job {} still running, skipping this run".format(job.name))
+                else:
+                    try:
+                        job.future = job.executor.submit(self._execute, job)
+                    except RuntimeError:
+                        # Executor shut down by `remove` meanwhile
+                        continue
+
+                # Next deadline on the original grid, skipping any already past
+                interval = job.get_interval()
+                job.next_run = due + interval
+                if job.next_run < now:
+                    missed = int((now - job.next_run) // interval) + 1
+                    job.stats['missed'] += missed
+                    job.next_run += missed * interval
+
+                heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
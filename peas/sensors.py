@@ -1,12 +1,15 @@
 import os
 import yaml
 
-from pocs.utils.database import PanMongo
 from pocs.utils.logger import get_root_logger
-from pocs.utils.messaging import PanMessaging
 from pocs.utils.rs232 import SerialData
 
 from . import load_config
+from .messaging import channel_encoding
+from .messaging import get_publisher
+from .rollup import RollupAggregator
+from .spool import get_spool
+from .store import get_store
 
 
 class ArduinoSerialMonitor(object):
@@ -27,8 +30,9 @@ class ArduinoSerialMonitor(object):
         assert type(self.config['environment']) is dict, \
             self.logger.warning("Environment config variable not set correctly. No sensors listed")
 
-        self.db = None
+        self.spool = None
         self.messaging = None
+        self.rollups = None
 
         # Store each serial reader
         self.serial_readers = dict()
@@ -99,19 +103,32 @@ class ArduinoSerialMonitor(object):
             reader = reader_info['reader']
             reader.stop()
 
+        if self.rollups is not None:
+            self.rollups.flush()
+
     def send_message(self, msg, channel='environment'):
         if self.messaging is None:
-            self.messaging = PanMessaging.create_publisher(6510)
+            self.messaging = get_publisher(self.config)
+
+        self.messaging.send_message(channel, msg, encoding=channel_encoding(self.config, channel))
 
-        self.messaging.send_message(channel, msg)
+    def _store_rollup(self, record_type, bucket):
+        get_store(self.config).append(record_type, bucket)
 
-    def capture(self, use_mongo=True, send_message=True):
+    def capture(self, use_mongo=True, send_message=True, use_store=False, use_rollup=False):
         """
         Helper function to return serial sensor info.
 
         Reads each of the connected sensors. If a value is received, attempts
         to parse the value as json.
 
+        If `use_store` is True each reading is also appended to the local
+        column store (see `peas.store`) as record type `environment_<sensor_name>`.
+
+        If `use_rollup` is True each reading is also added to the 1-minute and
+        1-hour rollups (see `peas.rollup`); closed buckets are appended to the
+        column store as `environment_<sensor_name>_1m` and `..._1h`.
+
         Returns:
             sensor_data (dict):     Dictionary of sensors keyed by sensor name.
         """
@@ -138,6 +155,14 @@ class ArduinoSerialMonitor(object):
 
                 sensor_data[sensor_name] = data
 
+                if use_store:
+                    get_store(self.config).append('environment_{}'.format(sensor_name), data)
+
+                if use_rollup:
+                    if self.rollups is None:
+                        self.rollups = RollupAggregator(self._store_rollup)
+                    self.rollups.add('environment_{}'.format(sensor_name), data)
+
                 if send_message:
                     self.send_message({'data': data}, channel='environment')
             except yaml.parser.ParserError:
@@ -149,12 +174,12 @@ class ArduinoSerialMonitor(object):
             except Exception as e:
                 self.logger.warning("Bad JSON: {0}".format(sensor_value))
 
-            if use_mongo and len(sensor_data) > 0:
-                if self.db is None:
-                    self.db = PanMongo()
-                    self.logger.info('Connected to PanMongo')
-                self.db.insert_current('environment', sensor_data)
-        else:
+        if len(sensor_data) == 0:
             self.logger.debug("No sensor data received")
+        elif use_mongo:
+            # Written to mongo in the background, see `peas.spool`
+            if self.spool is None:
+                self.spool = get_spool(self.config)
+            self.spool.append('environment', sensor_data)
 
         return sensor_data
@@ -0,0 +1,346 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from datetime import datetime as dt
+from glob import glob
+
+SEGMENT_SUFFIX = '.seg'
+MARKER_SUFFIX = '.committed'
+COUNTER_FILE = 'next_segment'
+
+
+def _default(obj):
+    if isinstance(obj, dt):
+        return {'$date': obj.isoformat()}
+
+    # astropy Quantity
+    if hasattr(obj, 'unit') and hasattr(obj, 'value'):
+        return obj.value
+
+    # numpy scalars and arrays
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+
+    return str(obj)
+
+
+def _object_hook(obj):
+    if len(obj) == 1 and '$date' in obj:
+        # Also reads the `+00:00` suffix of aware datetimes
+        return dt.fromisoformat(obj['$date'])
+
+    return obj
+
+
+def _get_mongodb():
+    from pocs.utils.database import PanMongo
+    return PanMongo()
+
+
+class Spool(object):
+
+    """ Write-ahead spool between the sensors and mongo
+
+    `append` writes the record as one JSON line to the current segment file
+    and returns; nothing waits on the database. Segment files are fsynced in
+    batches (every `fsync_every` records or `fsync_interval` seconds) and
+    rotated when they get too big or too old.
+
+    A background replayer bulk-inserts the records of closed segments into
+    mongo, as the same `{'type', 'data', 'date'}` documents as
+    `PanMongo.insert_current`, and updates the `current` collection. Each
+    document gets a deterministic `_id` (`<segment>-<line>`) and progress
+    is recorded in a `.committed` marker after every batch, so a crash or
+    outage in the middle of a replay never duplicates or loses a record.
+    Segment numbers are never reused, even once the segments are replayed
+    and removed: the next one is kept in a `next_segment` file.
+    While mongo is unavailable the replayer backs off and the segments
+    simply accumulate on disk.
+
+    Args:
+        directory (str):            Where segment files are kept.
+        fsync_every (int):          Records between fsyncs.
+        fsync_interval (float):     Max seconds between fsyncs.
+        max_segment_bytes (int):    Rotate the segment above this size.
+        max_segment_age (float):    Rotate the segment after this many
+            seconds, bounding how long records wait before being replayed.
+        batch_size (int):           Documents per `insert_many`.
+        connect (callable):         Returns a `PanMongo`, for testing.
+    """
+
+    def __init__(self, directory, fsync_every=10, fsync_interval=5., max_segment_bytes=4 * 1024 * 1024,
+                 max_segment_age=10., batch_size=500, connect=None):
+        self.logger = logging.getLogger('peas-spool')
+
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.batch_size = batch_size
+        self.connect = _get_mongodb if connect is None else connect
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.db = None
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        self._segment_opened = None
+        self._lines = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._replayer = None
+
+        self.stats = {
+            'appended': 0,
+            'replayed': 0,
+            'duplicates': 0,
+            'errors': 0,
+            'last_replay': None,
+        }
+
+        # Continue numbering after the previous run, so `_id`s are never reused
+        existing = self.segments(include_active=True)
+        self._next_segment = max(self._read_counter(),
+                                 int(os.path.basename(existing[-1]).split('.')[0]) + 1 if existing else 0)
+
+    def segments(self, include_active=False):
+        """ Segment files waiting to be replayed, oldest first """
+        segments = sorted(glob(os.path.join(self.directory, '*' + SEGMENT_SUFFIX)))
+        if not include_active and self._segment is not None:
+            segments = [s for s in segments if s != self._segment]
+
+        return segments
+
+    def _read_counter(self):
+        try:
+            with open(os.path.join(self.directory, COUNTER_FILE), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def _write_counter(self, value):
+        counter = os.path.join(self.directory, COUNTER_FILE)
+        with open(counter + '.tmp', 'w') as f:
+            f.write(str(value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(counter + '.tmp', counter)
+
+    def _open_segment(self):
+        self._segment = os.path.join(self.directory, '{:012d}{}'.format(self._next_segment, SEGMENT_SUFFIX))
+        self._next_segment += 1
+        # Before any record goes to the segment, so its number is never used again
+        self._write_counter(self._next_segment)
+        self._file = open(self._segment, 'a')
+        self._segment_opened = time.monotonic()
+        self._lines = 0
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        self._file = None
+        self._segment = None
+
+    def append(self, collection, data):
+        """ Spool a record for `collection`, never waits on mongo
+
+        Args:
+            collection (str):   Mongo collection, e.g. 'weather'.
+            data (dict):        The record, stored as the document `data`.
+        """
+        line = json.dumps({'type': collection, 'data': data, 'date': dt.utcnow()}, default=_default)
+
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+
+            self._file.write(line + '\n')
+            self._lines += 1
+            self._unsynced += 1
+            self.stats['appended'] += 1
+
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync > self.fsync_interval:
+                self._sync()
+
+            if self._file.tell() > self.max_segment_bytes:
+                self._close_segment()
+                self._wakeup.set()
+
+        self.start()
+
+    def rotate(self, force=False):
+        """ Close the current segment if it is old enough (or `force`) """
+        with self._lock:
+            if self._file is None:
+                return
+            if force or time.monotonic() - self._segment_opened > self.max_segment_age:
+                self._close_segment()
+
+    def start(self):
+        if self._replayer is None or not self._replayer.is_alive():
+            with self._lock:
+                if self._replayer is None or not self._replayer.is_alive():
+                    self._stop.clear()
+                    self._replayer = threading.Thread(target=self._run, name='peas-spool', daemon=True)
+                    self._replayer.start()
+
+    def stop(self, timeout=10):
+        """ Close the current segment, try a last replay and stop the replayer """
+        self.rotate(force=True)
+        self._stop.set()
+        self._wakeup.set()
+        if self._replayer is not None:
+            self._replayer.join(timeout)
+        self._replayer = None
+
+    def _read_segment(self, segment):
+        records = list()
+        with open(segment, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line, object_hook=_object_hook))
+                except ValueError:
+                    # Partially written last line from a crash
+                    self.logger.warning("Skipping bad spool line in {}".format(segment))
+                    records.append(None)
+
+        return records
+
+    def _committed(self, segment):
+        try:
+            with open(segment + MARKER_SUFFIX, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def _mark(self, segment, count):
+        tmp = segment + MARKER_SUFFIX + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(count))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, segment + MARKER_SUFFIX)
+
+    def _insert(self, collection, docs):
+        try:
+            getattr(self.db, collection).insert_many(docs, ordered=False)
+        except Exception as err:
+            # A `BulkWriteError` made only of duplicate keys means the records
+            # were already inserted before a crash
+            errors = (getattr(err, 'details', None) or dict()).get('writeErrors', [])
+            if len(errors) == 0 or any(e.get('code') != 11000 for e in errors):
+                raise
+            self.stats['duplicates'] += len(errors)
+
+    def replay_segment(self, segment):
+        """ Insert the not yet committed records of `segment`, then remove it """
+        name = os.path.basename(segment).split('.')[0]
+        records = self._read_segment(segment)
+        committed = self._committed(segment)
+
+        while committed < len(records):
+            batch = records[committed:committed + self.batch_size]
+
+            by_collection = dict()
+            latest = dict()
+            for i, record in enumerate(batch):
+                if record is None:
+                    continue
+                record['_id'] = '{}-{}'.format(name, committed + i)
+                by_collection.setdefault(record['type'], list()).append(record)
+                latest[record['type']] = record
+
+            for collection, docs in by_collection.items():
+                self._insert(collection, docs)
+
+            for collection, record in latest.items():
+                current = dict(record)
+                del current['_id']
+                self.db.current.replace_one({'type': collection}, current, True)
+
+            committed += len(batch)
+            self._mark(segment, committed)
+            self.stats['replayed'] += len(batch)
+
+        os.remove(segment)
+        if os.path.exists(segment + MARKER_SUFFIX):
+            os.remove(segment + MARKER_SUFFIX)
+
+        self.stats['last_replay'] = time.time()
+
+    def replay(self):
+        """ Replay every closed segment, oldest first """
+        if self.db is None:
+            self.db = self.connect()
+
+        for segment in self.segments():
+            self.replay_segment(segment)
+
+    def _run(self):
+        backoff = 1.
+        while True:
+            stopping = self._stop.is_set()
+
+            self.rotate()
+            try:
+                self.replay()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.logger.warning("Spool replay failed, retrying in {:.0f}s: {}".format(backoff, e))
+                self.db = None
+                wait = backoff
+                backoff = min(backoff * 2, 300.)
+            else:
+                backoff = 1.
+                wait = self.max_segment_age
+
+            if stopping:
+                break
+
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+
+_spools = dict()
+_spools_lock = threading.Lock()
+
+
+def get_spool(config, directory=None):
+    """ Return the process-wide `Spool`
+
+    Settings come from the `spool` section of the config; the directory
+    defaults to `<directories.data>/spool`.
+    """
+    cfg = config.get('spool', dict()) or dict()
+
+    if directory is None:
+        directory = cfg.get('directory', None)
+    if directory is None:
+        data_dir = config.get('directories', dict()).get('data', '/var/panoptes/data')
+        directory = os.path.join(data_dir, 'spool')
+
+    with _spools_lock:
+        if directory not in _spools:
+            _spools[directory] = Spool(directory,
+                                       fsync_every=cfg.get('fsync_every', 10),
+                                       fsync_interval=cfg.get('fsync_interval', 5.),
+                                       max_segment_age=cfg.get('max_segment_age', 10.))
+
+    return _spools[directory]
@@ -0,0 +1,459 @@
+import json
+import os
+import threading
+
+from datetime import datetime as dt
+from dateutil.parser import parse as date_parser
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+SCHEMA_FILE = 'schema.json'
+
+# Known record types get fixed, compact column types. Columns not listed here
+# (and record types without a schema) have their type inferred from the first
+# value seen, see `_infer_dtype`.
+SCHEMAS = {
+    'weather': {
+        'date': '<M8[us]',
+        'safe': '|b1',
+        'sky_temp_C': '<f4',
+        'ambient_temp_C': '<f4',
+        'internal_voltage_V': '<f4',
+        'ldr_resistance_Ohm': '<f4',
+        'rain_sensor_temp_C': '<f4',
+        'rain_frequency': '<f4',
+        'pwm_value': '<f4',
+        'wind_speed_KPH': '<f4',
+        'sky_condition': '|S12',
+        'wind_condition': '|S12',
+        'gust_condition': '|S12',
+        'rain_condition': '|S12',
+        'sky_condition_code': '|i1',
+        'wind_condition_code': '|i1',
+        'gust_condition_code': '|i1',
+        'rain_condition_code': '|i1',
+    },
+}
+
+
+def flatten(record, prefix=''):
+    """ Flatten nested dicts and lists into dotted column names
+
+    >>> flatten({'a': 1, 'b': {'c': 2}, 'd': [3, 4]})
+    {'a': 1, 'b.c': 2, 'd.0': 3, 'd.1': 4}
+    """
+    flat = dict()
+    for key, value in record.items():
+        name = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=name + '.'))
+        elif isinstance(value, (list, tuple)):
+            flat.update(flatten({str(i): v for i, v in enumerate(value)}, prefix=name + '.'))
+        else:
+            flat[name] = value
+
+    return flat
+
+
+def _infer_dtype(value):
+    if isinstance(value, dt):
+        return '<M8[us]'
+    if isinstance(value, (bool, np.bool_)):
+        return '|b1'
+    if isinstance(value, (int, float, np.number)):
+        return '<f8'
+    if hasattr(value, 'unit') and hasattr(value, 'value'):
+        return '<f8'
+
+    return '|S32'
+
+
+def _fill_value(dtype):
+    kind = np.dtype(dtype).kind
+    if kind == 'f':
+        return np.nan
+    if kind == 'M':
+        return np.datetime64('NaT')
+    if kind == 'b':
+        return False
+    if kind == 'S':
+        return b''
+    return 0
+
+
+def _coerce(value, dtype):
+    """ Convert a single value to a one-element array of `dtype` """
+    dtype = np.dtype(dtype)
+
+    if value is None:
+        value = _fill_value(dtype)
+    elif hasattr(value, 'unit') and hasattr(value, 'value'):
+        value = value.value
+
+    try:
+        if dtype.kind == 'S' and not isinstance(value, bytes):
+            value = str(value).encode('utf-8')[:dtype.itemsize]
+        elif dtype.kind == 'f' and isinstance(value, (str, bytes)):
+            value = float(value)
+        return np.array([value], dtype=dtype)
+    except (TypeError, ValueError):
+        return np.array([_fill_value(dtype)], dtype=dtype)
+
+
+def as_utc(date):
+    """ Return `date` (datetime or string) as a naive UTC datetime """
+    if isinstance(date, str):
+        date = date_parser(date)
+    if date.tzinfo is not None:
+        date = date.replace(tzinfo=None) - date.utcoffset()
+
+    return date
+
+
+def day_string(date):
+    return date.strftime('%Y%m%d')
+
+
+class _Partition(object):
+
+    """ Open column files for one record type and UTC day """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.files = dict()
+
+        os.makedirs(path, exist_ok=True)
+
+        self.columns = self._read_schema()
+        self.num_rows = self._count_rows()
+
+    def _read_schema(self):
+        schema_fn = os.path.join(self.path, SCHEMA_FILE)
+        if os.path.exists(schema_fn):
+            with open(schema_fn, 'r') as f:
+                return json.load(f)['columns']
+
+        return dict()
+
+    def _write_schema(self):
+        schema_fn = os.path.join(self.path, SCHEMA_FILE)
+        tmp_fn = schema_fn + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            json.dump({'version': SCHEMA_VERSION, 'columns': self.columns}, f, indent=1, sort_keys=True)
+        os.replace(tmp_fn, schema_fn)
+
+    def _count_rows(self):
+        counts = [_column_length(self.path, name, dtype) for name, dtype in self.columns.items()]
+        num_rows = min(counts) if counts else 0
+
+        # Drop any partially written row (e.g. after a crash)
+        for name, dtype in self.columns.items():
+            fn = _column_file(self.path, name)
+            size = num_rows * np.dtype(dtype).itemsize
+            if os.path.exists(fn) and os.path.getsize(fn) > size:
+                with open(fn, 'r+b') as f:
+                    f.truncate(size)
+
+        return num_rows
+
+    def _file(self, name):
+        if name not in self.files:
+            self.files[name] = open(_column_file(self.path, name), 'ab')
+
+        return self.files[name]
+
+    def _add_column(self, name, dtype):
+        self.columns[name] = dtype
+        # Backfill the rows written before this column appeared
+        self._file(name).write(np.full(self.num_rows, _fill_value(dtype), dtype=dtype).tobytes())
+        self._write_schema()
+
+    def append(self, row):
+        for name, value in row.items():
+            if name not in self.columns:
+                self._add_column(name, self.schema.get(name, _infer_dtype(value)))
+
+        # Write the date column last so a partial row is never counted
+        names = sorted(self.columns, key=lambda n: n == 'date')
+        for name in names:
+            self._file(name).write(_coerce(row.get(name), self.columns[name]).tobytes())
+
+        self.num_rows += 1
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = dict()
+
+
+def _column_file(path, name):
+    return os.path.join(path, '{}.bin'.format(name))
+
+
+def _column_length(path, name, dtype):
+    fn = _column_file(path, name)
+    if not os.path.exists(fn):
+        return 0
+
+    return os.path.getsize(fn) // np.dtype(dtype).itemsize
+
+
+class ColumnStore(object):
+
+    """ Append-only columnar store partitioned by record type and UTC day
+
+    Each partition is a directory `<root>/<record_type>/<YYYYMMDD>` holding a
+    `schema.json` and one raw binary file per column. Appends write one value
+    to each column file; reads memory-map the column files so no parsing is
+    involved and only the requested columns are touched.
+
+    Nested records are flattened into dotted column names (see `flatten`).
+
+    Args:
+        root (str):     Directory for the store, created if needed.
+        schemas (dict): Column types per record type, defaults to `SCHEMAS`.
+    """
+
+    def __init__(self, root, schemas=None):
+        self.root = root
+        self.schemas = SCHEMAS if schemas is None else schemas
+
+        self._partitions = dict()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def _partition_path(self, record_type, day):
+        return os.path.join(self.root, record_type, day)
+
+    def append(self, record_type, record, date=None, flush=True):
+        """ Append a record
+
+        Args:
+            record_type (str):  E.g. 'weather'.
+            record (dict):      Record to store, nested values are flattened.
+            date (datetime):    UTC time of the record, defaults to
+                `record['date']` or now.
+            flush (bool):       Flush the column files after writing.
+        """
+        row = flatten(record)
+        if date is None:
+            date = row.get('date') or dt.utcnow()
+        date = as_utc(date)
+        row['date'] = date
+
+        day = day_string(date)
+
+        with self._lock:
+            partition = self._partitions.get(record_type)
+            if partition is None or not partition.path.endswith(day):
+                if partition is not None:
+                    partition.close()
+                partition = _Partition(self._partition_path(record_type, day),
+                                       self.schemas.get(record_type, dict()))
+                self._partitions[record_type] = partition
+
+            partition.append(row)
+
+            if flush:
+                partition.flush()
+
+    def flush(self):
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.flush()
+
+    def close(self):
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.close()
+            self._partitions = dict()
+
+    def record_types(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def days(self, record_type, start=None, end=None):
+        """ List the day partitions (`YYYYMMDD`) for `record_type` within the range """
+        path = os.path.join(self.root, record_type)
+        if not os.path.exists(path):
+            return list()
+
+        days = sorted(d for d in os.listdir(path)
+                      if not d.startswith('.') and os.path.exists(os.path.join(path, d, SCHEMA_FILE)))
+
+        if start is not None:
+            days = [d for d in days if d >= day_string(start)]
+        if end is not None:
+            days = [d for d in days if d <= day_string(end)]
+
+        return days
+
+    def columns(self, record_type, day):
+        """ Return the `{name: dtype}` schema of a partition """
+        with open(os.path.join(self._partition_path(record_type, day), SCHEMA_FILE), 'r') as f:
+            return json.load(f)['columns']
+
+    def read_day(self, record_type, day, columns=None):
+        """ Memory-map the columns of one day partition
+
+        Returns:
+            dict: Column name to (read-only, memory mapped) array. Columns
+                missing from the partition are filled.
+        """
+        self.flush()
+
+        path = self._partition_path(record_type, day)
+        schema = self.columns(record_type, day)
+        num_rows = min(_column_length(path, name, dtype) for name, dtype in schema.items())
+
+        if columns is None:
+            columns = list(schema.keys())
+        elif 'date' not in columns:
+            columns = ['date'] + list(columns)
+
+        data = dict()
+        for name in columns:
+            if name not in schema:
+                dtype = self.schemas.get(record_type, dict()).get(name, '<f8')
+                data[name] = np.full(num_rows, _fill_value(dtype), dtype=dtype)
+            elif num_rows == 0:
+                data[name] = np.empty(0, dtype=schema[name])
+            else:
+                data[name] = np.memmap(_column_file(path, name), dtype=schema[name], mode='r', shape=(num_rows,))
+
+        return data
+
+    def read(self, record_type, start=None, end=None, columns=None):
+        """ Read columns for a time range
+
+        Only the partitions overlapping `[start, end]` and only the requested
+        columns are read. A single-day read returns memory mapped views.
+
+        Args:
+            record_type (str):  E.g. 'weather'.
+            start (datetime):   Inclusive start (UTC), default no limit.
+            end (datetime):     Inclusive end (UTC), default no limit.
+            columns (list):     Columns to read, default all. `date` is
+                always included.
+
+        Returns:
+            dict: Column name to array.
+        """
+        chunks = list()
+        for day in self.days(record_type, start=start, end=end):
+            data = self.read_day(record_type, day, columns=columns)
+
+            dates = data['date']
+            lo = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'us'), side='left')
+            hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 'us'), side='right')
+
+            if hi > lo:
+                chunks.append({name: values[lo:hi] for name, values in data.items()})
+
+        if len(chunks) == 0:
+            return dict()
+        if len(chunks) == 1:
+            return chunks[0]
+
+        names = set.union(*[set(c.keys()) for c in chunks])
+        return {name: np.concatenate([c[name] for c in chunks if name in c]) for name in names}
+
+    def read_frame(self, record_type, start=None, end=None, columns=None):
+        """ Same as `read` but returns a `pandas.DataFrame` indexed by date """
+        import pandas as pd
+
+        data = self.read(record_type, start=start, end=end, columns=columns)
+        if len(data) == 0:
+            return pd.DataFrame()
+
+        frame = pd.DataFrame({
+            name: values.astype('U') if values.dtype.kind == 'S' else values
+            for name, values in data.items()
+        })
+
+        return frame.set_index('date')
+
+    def write_day(self, record_type, day, data):
+        """ Write (or replace) a whole day partition from column arrays
+
+        The partition is written to a temporary directory and renamed into
+        place so readers never see a half written day.
+
+        Args:
+            record_type (str):  E.g. 'weather_1m'.
+            day (str):          Day as `YYYYMMDD`.
+            data (dict):        Column name to array, all the same length.
+        """
+        import shutil
+
+        path = self._partition_path(record_type, day)
+        tmp_path = os.path.join(self.root, record_type, '.{}.tmp'.format(day))
+        old_path = os.path.join(self.root, record_type, '.{}.old'.format(day))
+
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        columns = dict()
+        for name, values in data.items():
+            values = np.asarray(values)
+            if values.dtype.kind in 'OU':
+                values = values.astype('S32')
+            columns[name] = values.dtype.str
+            values.tofile(_column_file(tmp_path, name))
+
+        with open(os.path.join(tmp_path, SCHEMA_FILE), 'w') as f:
+            json.dump({'version': SCHEMA_VERSION, 'columns': columns}, f, indent=1, sort_keys=True)
+
+        with self._lock:
+            partition = self._partitions.get(record_type)
+            if partition is not None and partition.path.endswith(day):
+                partition.close()
+                del self._partitions[record_type]
+
+            if os.path.exists(path):
+                os.rename(path, old_path)
+            os.rename(tmp_path, path)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def remove_day(self, record_type, day):
+        """ Delete a day partition """
+        import shutil
+
+        with self._lock:
+            partition = self._partitions.get(record_type)
+            if partition is not None and partition.path.endswith(day):
+                partition.close()
+                del self._partitions[record_type]
+
+        shutil.rmtree(self._partition_path(record_type, day), ignore_errors=True)
+
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+def get_store(config, root=None):
+    """ Return the process-wide `ColumnStore` for the configured directory
+
+    The directory is `store.directory` from the config, falling back to
+    `<directories.data>/store`.
+    """
+    if root is None:
+        try:
+            root = config['store']['directory']
+        except (KeyError, TypeError):
+            data_dir = config.get('directories', dict()).get('data', '/var/panoptes/data')
+            root = os.path.join(data_dir, 'store')
+
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ColumnStore(root)
+
+    return _stores[root]
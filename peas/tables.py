@@ -0,0 +1,321 @@
+import os
+import threading
+
+import numpy as np
+
+from astropy.table import Table
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from .conditions import to_code
+
+# Bump when the cached columns change meaning, old cache files are ignored
+CACHE_VERSION = 2
+
+# Fields plotted by `scripts/plot_weather.py` and their column types. The
+# conditions are loaded as their integer codes, see `peas.conditions`.
+WEATHER_COLUMNS = (
+    ('ambient_temp_C', 'f4'),
+    ('sky_temp_C', 'f4'),
+    ('sky_condition_code', 'i1'),
+    ('wind_speed_KPH', 'f4'),
+    ('wind_condition_code', 'i1'),
+    ('gust_condition_code', 'i1'),
+    ('rain_frequency', 'f4'),
+    ('rain_condition_code', 'i1'),
+    ('safe', bool),
+    ('pwm_value', 'f4'),
+    ('rain_sensor_temp_C', 'f4'),
+)
+
+
+def _missing(dtype):
+    kind = np.dtype(dtype).kind
+    if kind == 'f':
+        return np.nan
+    if kind == 'b':
+        return False
+    if kind in 'US':
+        return ''
+    return 0
+
+
+def projection(columns=WEATHER_COLUMNS, field='data'):
+    """ Mongo projection returning only `date` and the wanted `field` keys """
+    proj = {'_id': 0, 'date': 1}
+    proj.update({'{}.{}'.format(field, name): 1 for name, _ in columns})
+
+    # Older records only have the condition strings
+    proj.update({'{}.{}'.format(field, name[:-len('_code')]): 1 for name, _ in columns if name.endswith('_code')})
+
+    return proj
+
+
+def columns_from_documents(documents, columns=WEATHER_COLUMNS, field='data'):
+    """ Build one array per column in a single pass over `documents`
+
+    Condition codes (`<name>_code`) missing from a document are taken from
+    its condition string.
+
+    Args:
+        documents (iterable):   Mongo documents (or a cursor) with a `date`
+            and the values under `field`.
+        columns (tuple):        `(name, dtype)` pairs.
+        field (str):            Key holding the values.
+
+    Returns:
+        dict: Column name to array, plus `date` as `datetime64[us]`.
+    """
+    missing = [_missing(dtype) for _, dtype in columns]
+    labels = [name[:-len('_code')] if name.endswith('_code') else None for name, _ in columns]
+    values = [list() for _ in columns]
+    dates = list()
+
+    for doc in documents:
+        dates.append(doc['date'])
+        data = doc.get(field, dict())
+        for i, (name, _) in enumerate(columns):
+            value = data.get(name, None)
+            if value is None and labels[i] is not None and labels[i] in data:
+                value = to_code(data[labels[i]])
+            values[i].append(missing[i] if value is None else value)
+
+    arrays = dict()
+    for (name, dtype), column, fill in zip(columns, values, missing):
+        try:
+            arrays[name] = np.array(column, dtype=dtype)
+        except (TypeError, ValueError):
+            # Occasional bad value, e.g. a string in a float column
+            arrays[name] = np.array([_convert(v, dtype, fill) for v in column], dtype=dtype)
+
+    arrays['date'] = np.array(dates, dtype='<M8[us]')
+
+    return arrays
+
+
+def _convert(value, dtype, fill):
+    try:
+        return np.array(value, dtype=dtype).item()
+    except (TypeError, ValueError):
+        return fill
+
+
+def load_weather(db, start, end, columns=WEATHER_COLUMNS):
+    """ Load weather between `start` and `end` as a columnar `Table`
+
+    Only the wanted fields are fetched from mongo and the table is built
+    from whole columns, sorted by date.
+
+    Args:
+        db (PanMongo):      Database with the `weather` collection.
+        start (datetime):   Exclusive start (UTC).
+        end (datetime):     Exclusive end (UTC).
+        columns (tuple):    `(name, dtype)` pairs, default `WEATHER_COLUMNS`.
+
+    Returns:
+        astropy.table.Table: One column per field plus `date`.
+    """
+    return table_from_columns(load_columns(db, start, end, columns), columns)
+
+
+def table_from_columns(arrays, columns=WEATHER_COLUMNS):
+    """ `Table` from `columns_from_documents` output, sorted by date """
+    order = np.argsort(arrays['date'], kind='mergesort')
+    names = [name for name, _ in columns] + ['date']
+
+    return Table([arrays[name][order] for name in names], names=names)
+
+
+def split_days(dates):
+    """ Rows of each UT day in sorted `dates`
+
+    Args:
+        dates (numpy.ndarray):  Sorted `datetime64` values.
+
+    Returns:
+        list: `(day, first, last)` with `day` as `YYYYMMDD` and the rows of
+            the day being `first:last`.
+    """
+    dates = np.asarray(dates, dtype='<M8[us]')
+    if len(dates) == 0:
+        return list()
+
+    days = dates.astype('M8[D]')
+    bounds = np.flatnonzero(np.r_[True, days[1:] != days[:-1], True])
+
+    return [(str(days[first]).replace('-', ''), int(first), int(last))
+            for first, last in zip(bounds[:-1], bounds[1:])]
+
+
+def share_columns(arrays, directory):
+    """ Write `arrays` as `.npy` files to be memory-mapped by other processes
+
+    Returns:
+        dict: Column name to file, for `open_columns`.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    paths = dict()
+    for name, values in arrays.items():
+        path = os.path.join(directory, '{}.npy'.format(name))
+        shared = np.lib.format.open_memmap(path, mode='w+', dtype=values.dtype, shape=values.shape)
+        shared[:] = values
+        shared.flush()
+        del shared
+        paths[name] = path
+
+    return paths
+
+
+def open_columns(paths, first=None, last=None):
+    """ Read-only memory maps of the `share_columns` files, rows `first:last` """
+    return {name: np.load(path, mmap_mode='r')[first:last] for name, path in paths.items()}
+
+
+def _day_start(day):
+    """ Start of a `YYYYMMDD` or `YYYYMMDDUT` day """
+    return dt.strptime(day[:8], '%Y%m%d')
+
+
+def day_range(day):
+    """ Exclusive `(start, end)` of `load_columns` and `load_weather` for all of a UT `day` """
+    start = _day_start(day)
+    return start - tdelta(microseconds=1), start + tdelta(days=1)
+
+
+class DayCache(object):
+
+    """ Cache of the weather columns of finished UT days
+
+    Once a day has been over for `settle` seconds it is taken as final and
+    its columns are kept as one `YYYYMMDD.npz` file; until then records may
+    still arrive late (spool replays, outage backlogs, imports), so the day
+    is loaded from mongo each time. Each file records `CACHE_VERSION` and the
+    column names and types; files that don't match are treated as missing.
+    Reading a file refreshes its modification time, and the least recently
+    used files are removed once the cache is larger than `max_bytes`.
+
+    Args:
+        directory (str):    Where the cache files are kept.
+        max_bytes (int):    Size limit of the cache.
+        columns (tuple):    `(name, dtype)` pairs, default `WEATHER_COLUMNS`.
+        settle (float):     Seconds after the end of a day before it is cached.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, columns=WEATHER_COLUMNS, settle=6 * 3600.):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.settle = settle
+        self.columns = columns
+        self.signature = np.array(['{}:{}'.format(name, np.dtype(dtype).str) for name, dtype in columns])
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, day):
+        return os.path.join(self.directory, '{}.npz'.format(day[:8]))
+
+    def get(self, day):
+        """ Cached columns of `day`, or None """
+        path = self._path(day)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if int(npz['__version__']) != CACHE_VERSION or \
+                        not np.array_equal(npz['__columns__'], self.signature):
+                    return None
+                arrays = {name: npz[name] for name in npz.files if not name.startswith('__')}
+        except (IOError, KeyError, ValueError):
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return arrays
+
+    def put(self, day, arrays):
+        """ Cache the columns of `day` then evict down to `max_bytes` """
+        path = self._path(day)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, __version__=np.array(CACHE_VERSION), __columns__=self.signature, **arrays)
+        os.replace(tmp, path)
+
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """ Remove least recently used files until under `max_bytes` """
+        files = list()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz') or '.tmp' in name:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+
+    def load_day(self, db, day, now=None):
+        """ Weather `Table` of a finished `day`, from the cache when possible """
+        arrays = self.get(day)
+        if arrays is None:
+            arrays = load_columns(db, *day_range(day), columns=self.columns)
+            # An empty day may just not have been exported to this db yet
+            if len(arrays['date']) > 0 and is_finished(day, now=now, lag=self.settle):
+                self.put(day, arrays)
+
+        return table_from_columns(arrays, self.columns)
+
+
+def load_columns(db, start, end, columns=WEATHER_COLUMNS):
+    """ Columns of `load_weather`, as a dict of arrays """
+    cursor = db.weather.find({'date': {'$gt': start, '$lt': end}}, projection(columns)).sort([('date', 1)])
+
+    return columns_from_documents(cursor, columns)
+
+
+def is_finished(day, now=None, lag=0.):
+    """ True if the UT `day` (`YYYYMMDD` or `YYYYMMDDUT`) is over, by at least `lag` seconds """
+    if now is None:
+        now = dt.utcnow()
+
+    return _day_start(day) + tdelta(days=1, seconds=lag) <= now
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_day_cache(config, directory=None):
+    """ Return the process-wide `DayCache`
+
+    Settings come from `weather.plot.cache`: `directory` (default
+    `<directories.data>/plot_cache`), `max_mb` (default 512) and
+    `settle_hours` (default 6).
+    """
+    try:
+        cfg = config['weather']['plot']['cache'] or dict()
+    except (KeyError, TypeError):
+        cfg = dict()
+
+    if directory is None:
+        directory = cfg.get('directory', None)
+    if directory is None:
+        data_dir = config.get('directories', dict()).get('data', '/var/panoptes/data')
+        directory = os.path.join(data_dir, 'plot_cache')
+
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = DayCache(directory, max_bytes=int(cfg.get('max_mb', 512) * 1024 * 1024),
+                                          settle=cfg.get('settle_hours', 6) * 3600.)
+
+    return _caches[directory]
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from peas import climatology
+from peas.conditions import Condition
+
+
+@pytest.fixture
+def ephemeris():
+    # Two nights, 20:00 to 04:00 UT
+    days = np.array(['2017-03-14', '2017-03-15', '2017-03-16'], dtype='M8[us]')
+    return {
+        'date': days,
+        'ea': days + np.timedelta64(20, 'h'),
+        'ma': days + np.timedelta64(4, 'h'),
+    }
+
+
+@pytest.fixture
+def arrays():
+    dates = np.arange(np.datetime64('2017-03-14T00:00'), np.datetime64('2017-03-17T00:00'),
+                      np.timedelta64(30, 'm')).astype('M8[us]')
+    n = len(dates)
+    hours = (dates - dates.astype('M8[D]')) / np.timedelta64(1, 'h')
+
+    sky = np.full(n, Condition.CLEAR, dtype='i1')
+    sky[hours >= 22] = Condition.CLOUDY
+    rain = np.full(n, Condition.DRY, dtype='i1')
+    rain[(hours >= 3) & (hours < 4)] = Condition.RAIN
+
+    return {
+        'date': dates,
+        'ambient_temp_C': np.full(n, 10., dtype='f4'),
+        'sky_temp_C': np.full(n, -20., dtype='f4'),
+        'sky_condition_code': sky,
+        'rain_condition_code': rain,
+        'wind_speed_KPH': np.arange(n, dtype='f4'),
+        'safe': sky == Condition.CLEAR,
+    }
+
+
+def test_night_intervals(ephemeris):
+    starts, ends = climatology.night_intervals(ephemeris)
+
+    # The last evening has no morning in the table
+    assert len(starts) == 2
+    assert starts[0] == np.datetime64('2017-03-14T20:00')
+    assert ends[0] == np.datetime64('2017-03-15T04:00')
+
+
+def test_assign_nights(ephemeris):
+    starts, ends = climatology.night_intervals(ephemeris)
+    dates = np.array(['2017-03-14T12:00', '2017-03-14T20:00', '2017-03-15T03:59', '2017-03-15T04:00',
+                      '2017-03-15T23:00'], dtype='M8[us]')
+
+    assert list(climatology.assign_nights(dates, starts, ends)) == [-1, 0, 0, -1, 1]
+
+
+def test_night_summary(ephemeris, arrays):
+    starts, ends = climatology.night_intervals(ephemeris)
+    frame = climatology.to_frame(arrays, starts, ends)
+    nights = climatology.night_summary(frame, starts, ends)
+
+    assert len(nights) == 2
+    night = nights.iloc[0]
+    # 16 samples from 20:00 to 04:00, cloudy 22:00 to 00:00, raining 03:00 to 03:30
+    assert night['samples'] == 16
+    assert night['dark_hours'] == 8
+    assert night['safe_fraction'] == pytest.approx(12 / 16)
+    assert night['clear_fraction'] == pytest.approx(12 / 16)
+    assert night['wet_fraction'] == pytest.approx(2 / 16)
+    assert night['cloudiness_median'] == -30
+
+
+def test_hourly_fractions(ephemeris, arrays):
+    starts, ends = climatology.night_intervals(ephemeris)
+    frame = climatology.to_frame(arrays, starts, ends)
+
+    clear = climatology.hourly_fractions(frame, 'clear')
+    assert list(clear.index) == list(range(1, 13))
+    assert list(clear.columns) == list(range(24))
+    assert clear.loc[3, 21] == 1
+    assert clear.loc[3, 22] == 0
+    assert clear.drop(index=3).isnull().all().all()
+
+    wet = climatology.hourly_fractions(frame, 'wet', night_only=True)
+    assert wet.loc[3, 3] == 1
+    assert wet[12].isnull().all()
+
+
+def test_unknown_codes_ignored(arrays):
+    arrays['sky_condition_code'][:10] = Condition.UNKNOWN
+    frame = climatology.to_frame(arrays)
+
+    assert frame['clear'].isnull().sum() == 10
+    assert 'night' not in frame
+
+
+def test_wind_by_month(ephemeris, arrays):
+    starts, ends = climatology.night_intervals(ephemeris)
+    frame = climatology.to_frame(arrays, starts, ends)
+    wind = climatology.wind_by_month(frame)
+
+    assert wind.loc[3, 'count'] == 32
+    assert list(wind.columns) == ['count', 'mean', '50%', '90%', '99%', 'max']
+
+
+def test_twilight_across_midnight(arrays):
+    # Evening twilight drifting earlier across 0h UT: two nights start on 2017-03-15 UT
+    days = np.array(['2017-03-14', '2017-03-15', '2017-03-16'], dtype='M8[us]')
+    ephemeris = {
+        'date': days,
+        'ea': days + np.array([24 * 60 + 1, 23 * 60 + 59, 23 * 60 + 58], dtype='m8[m]'),
+        'ma': days + np.timedelta64(10, 'h'),
+    }
+    starts, ends = climatology.night_intervals(ephemeris)
+    frame = climatology.to_frame(arrays, starts, ends)
+    nights = climatology.night_summary(frame, starts, ends)
+
+    assert len(nights) == 2
+    assert list(nights['night']) == [np.datetime64('2017-03-15')] * 2
+    assert list(nights['start']) == [np.datetime64('2017-03-15T00:01'), np.datetime64('2017-03-15T23:59')]
+    assert list(nights['dark_hours']) == pytest.approx([9 + 59 / 60, 10 + 1 / 60])
+    # 00:30 to 09:30, then 00:00 to 09:30
+    assert list(nights['samples']) == [19, 20]
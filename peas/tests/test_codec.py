@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from datetime import datetime as dt
+
+from peas import codec
+
+
+@pytest.fixture
+def series():
+    rng = np.random.RandomState(0)
+    times = np.arange(3000) * 30000 + rng.randint(0, 400, 3000)
+    values = np.round(15 + np.cumsum(rng.normal(0, 0.05, 3000)), 2)
+    values[10] = np.nan
+    return times.astype(np.int64), values
+
+
+def test_times_roundtrip(series):
+    times, _ = series
+    times = times.copy()
+    times[100] += 10 ** 12
+
+    assert np.array_equal(codec.decode_times(codec.encode_times(times), len(times)), times)
+
+
+def test_times_buckets():
+    # Deltas-of-deltas on either side of each bucket's range
+    for dod in (0, -64, 63, 64, -65, 255, 256, -2048, 2048, 2 ** 19 - 1, 2 ** 19, -2 ** 40):
+        times = np.array([-5, 10, 25 + dod, 40 + dod, 40 + dod], dtype=np.int64)
+        for count in range(len(times) + 1):
+            assert np.array_equal(codec.decode_times(codec.encode_times(times[:count]), count), times[:count])
+
+
+def test_floats_roundtrip(series):
+    _, values = series
+    for data in (values, np.random.RandomState(1).normal(size=500), np.zeros(3)):
+        decoded = codec.decode_floats(codec.encode_floats(data), len(data))
+        assert np.array_equal(decoded.view('<u8'), np.asarray(data, dtype='<f8').view('<u8'))
+
+
+def test_decimal_digits():
+    assert codec.decimal_digits(np.array([1.5, 2.25, np.nan])) == 2
+    assert codec.decimal_digits(np.array([2600., 2400.])) == 0
+    assert codec.decimal_digits(np.array([np.pi])) is None
+
+
+def test_block_file(tmpdir, series):
+    times, values = series
+    dates = (np.datetime64('2017-03-01', 'ms') + times.astype('m8[ms]')).astype('M8[us]')
+    fn = str(tmpdir.join('weather.grl'))
+
+    with codec.BlockWriter(fn, ['ambient_temp_C', 'safe'], block_size=1000) as writer:
+        writer.write(dates[:1500], {'ambient_temp_C': values[:1500], 'safe': np.ones(1500)})
+        writer.write(dates[1500:], {'ambient_temp_C': values[1500:]})
+
+    reader = codec.BlockReader(fn)
+    assert len(reader) == 3000
+    assert len(reader.blocks) == 3
+
+    data = reader.read()
+    assert np.array_equal(data['date'], dates)
+    assert np.array_equal(data['ambient_temp_C'], values, equal_nan=True)
+    assert np.isnan(data['safe'][-1])
+
+    start = dates[1200].astype(dt)
+    end = dates[1300].astype(dt)
+    assert len(reader.select_blocks(start=start, end=end)) == 1
+    assert len(reader.read(start=start, end=end, columns=['safe'])['date']) == 101
+
+    assert len(reader.select_blocks(where={'ambient_temp_C': (100, None)})) == 0
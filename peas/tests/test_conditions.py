@@ -0,0 +1,34 @@
+import numpy as np
+
+from peas.conditions import Condition
+from peas.conditions import add_codes
+from peas.conditions import to_code
+from peas.conditions import to_codes
+from peas.conditions import to_labels
+
+
+def test_labels():
+    assert Condition.VERY_CLOUDY.label == 'Very Cloudy'
+    assert Condition.RAIN.label == 'Rain'
+    assert to_code('Very Windy') == Condition.VERY_WINDY
+    assert to_code(b'Dry ') == Condition.DRY
+    assert to_code('Sunny') == Condition.UNKNOWN
+    assert to_code(None) == Condition.UNKNOWN
+
+
+def test_arrays():
+    labels = np.array(['Clear', 'Cloudy', 'Clear', 'Very Cloudy', ''])
+    codes = to_codes(labels)
+
+    assert codes.dtype == np.int8
+    assert list(codes) == [1, 2, 1, 3, 0]
+    assert list(to_labels(codes)) == ['Clear', 'Cloudy', 'Clear', 'Very Cloudy', 'Unknown']
+    assert list(to_codes([])) == []
+
+
+def test_add_codes():
+    record = add_codes({'sky_condition': 'Clear', 'rain_condition': 'Wet', 'safe': True})
+
+    assert record['sky_condition_code'] == Condition.CLEAR
+    assert record['rain_condition_code'] == Condition.WET
+    assert 'wind_condition_code' not in record
@@ -0,0 +1,46 @@
+import numpy as np
+
+from datetime import datetime as dt
+
+from peas.decimate import decimate
+from peas.decimate import minmax_indices
+from peas.decimate import time_smooth
+from peas.decimate import to_seconds
+
+
+def test_peaks_are_kept():
+    rng = np.random.RandomState(0)
+    x = np.arange(86400.)
+    y = rng.normal(10, 1, len(x))
+    y[12345] = 95.     # gust
+    y[54321] = -20.    # dip
+    y[100] = np.nan
+
+    dx, dy = decimate(x, y, 86400 / 1000.)
+
+    assert len(dx) <= 4 * 1001
+    assert 95. in dy
+    assert -20. in dy
+    assert np.nanmax(dy) == np.nanmax(y)
+    assert dx[0] == x[0] and dx[-1] == x[-1]
+    assert np.all(np.diff(dx) > 0)
+
+
+def test_short_series_untouched():
+    x = np.arange(10.)
+    assert list(minmax_indices(x, x, 2.)) == list(range(10))
+    assert list(minmax_indices(x[:0], x[:0], 5.)) == []
+
+
+def test_time_smooth():
+    # Regular samples, then a gap: the window follows time, not samples
+    x = np.array([0., 10., 20., 30., 1000., 1010.])
+    y = np.array([1., 2., 3., np.nan, 10., 20.])
+
+    smooth = time_smooth(x, y, 25.)
+
+    assert np.allclose(smooth, [1.5, 2., 2.5, 3., 15., 15.])
+
+
+def test_to_seconds():
+    assert to_seconds([dt(1970, 1, 1, 0, 1)])[0] == 60.
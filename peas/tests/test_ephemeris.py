@@ -0,0 +1,87 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+
+from peas import ephemeris
+from peas.ephemeris import EVENTS
+from peas.ephemeris import Ephemeris
+from peas.ephemeris import site_key
+
+LOCATION = {'latitude': 19.54, 'longitude': -155.58, 'elevation': 3400.0, 'timezone': 'US/Hawaii'}
+
+
+def fake_year(location, year):
+    """ Every event at a fixed hour of each day """
+    days = np.arange(np.datetime64('{}-01-01'.format(year)), np.datetime64('{}-01-01'.format(year + 1)))
+    table = {'date': days.astype('M8[us]')}
+    for hour, (name, _) in enumerate(EVENTS):
+        table[name] = days.astype('M8[us]') + np.timedelta64(2 * hour + 3, 'h')
+    table['ea'][10] = np.datetime64('NaT')
+
+    return table
+
+
+@pytest.fixture
+def ephem(tmpdir, monkeypatch):
+    calls = list()
+
+    def compute(location, year):
+        calls.append(year)
+        return fake_year(location, year)
+
+    monkeypatch.setattr(ephemeris, 'compute_year', compute)
+    ephem = Ephemeris(LOCATION, str(tmpdir.join('ephemeris')))
+    ephem.calls = calls
+    return ephem
+
+
+def test_site_key():
+    assert site_key(LOCATION) == site_key(dict(LOCATION))
+    assert site_key(LOCATION) != site_key(dict(LOCATION, latitude=19.55))
+
+
+def test_next_events(ephem):
+    events = ephem.events(dt(2017, 3, 14, 6, 30))
+
+    # sunset at 03:00 has passed, so it's the one of the next day
+    assert events['sunset'] == dt(2017, 3, 15, 3)
+    assert events['en'] == dt(2017, 3, 14, 7)
+    assert events['sunrise'] == dt(2017, 3, 14, 17)
+
+
+def test_missing_event(ephem):
+    assert ephem.events(dt(2017, 1, 10, 12))['ea'] is None
+    assert ephem.events(dt(2017, 1, 11))['ea'] == dt(2017, 1, 12, 9)
+
+
+def test_year_is_persisted(ephem):
+    ephem.events(dt(2017, 12, 31, 23))
+    assert ephem.calls == [2017, 2018]
+
+    again = Ephemeris(LOCATION, ephem.directory)
+    again.events(dt(2017, 6, 1))
+    assert ephem.calls == [2017, 2018]
+
+
+def test_concurrent_first_use(tmpdir, monkeypatch):
+    # Separate instances, as in the worker processes of `plot_weather.plot_range`
+    barrier = threading.Barrier(8)
+
+    def compute(location, year):
+        barrier.wait()
+        return fake_year(location, year)
+
+    monkeypatch.setattr(ephemeris, 'compute_year', compute)
+    directory = str(tmpdir.join('ephemeris'))
+    instances = [Ephemeris(LOCATION, directory) for _ in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda e: e.events(dt(2017, 3, 14, 6, 30)), instances))
+
+    assert all(events['sunset'] == dt(2017, 3, 15, 3) for events in results)
+    assert sorted(os.listdir(directory)) == ['ephemeris_{}_2017.npz'.format(site_key(LOCATION))]
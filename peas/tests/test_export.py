@@ -0,0 +1,101 @@
+import os
+import pytest
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.export import Exporter
+from peas.export import LocalBackend
+from peas.export import read_export
+
+
+class FakeCursor(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for key, direction in keys[::-1]:
+            self.docs = sorted(self.docs, key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeCollection(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query):
+        limits = query['date']
+        return FakeCursor([d for d in self.docs if limits['$gte'] <= d['date'] <= limits['$lte']])
+
+
+class FakeDB(object):
+
+    def __init__(self, **collections):
+        for name, docs in collections.items():
+            setattr(self, name, FakeCollection(docs))
+
+
+def make_docs(start, num, offset=0):
+    return [{'_id': '{:06d}'.format(offset + i), 'date': start + tdelta(seconds=i // 2),
+             'data': {'count': offset + i}} for i in range(num)]
+
+
+@pytest.fixture
+def db():
+    start = dt(2017, 3, 14)
+    return FakeDB(weather=make_docs(start, 25), environment=make_docs(start, 8))
+
+
+@pytest.fixture
+def backend(tmpdir):
+    return LocalBackend(str(tmpdir.join('bucket')))
+
+
+def exported(backend, collection):
+    directory = os.path.join(backend.root, collection)
+    return [doc['data']['count'] for fn in sorted(os.listdir(directory))
+            for doc in read_export(os.path.join(directory, fn))]
+
+
+def test_export(tmpdir, db, backend):
+    exporter = Exporter(db, backend, str(tmpdir.join('work')), chunk_size=10, processes=2)
+    results = exporter.export(['weather', 'environment'], end=dt(2017, 3, 15))
+
+    assert results['weather']['chunks'] == 3
+    assert results['weather']['documents'] == 25
+    assert exported(backend, 'weather') == list(range(25))
+    assert exported(backend, 'environment') == list(range(8))
+
+
+def test_incremental(tmpdir, db, backend):
+    work = str(tmpdir.join('work'))
+    Exporter(db, backend, work, chunk_size=10, processes=1).export(['weather'], end=dt(2017, 3, 15))
+
+    # New documents, including one at the same date as the last exported
+    last = db.weather.docs[-1]['date']
+    db.weather.docs += make_docs(last, 6, offset=25)
+
+    results = Exporter(db, backend, work, chunk_size=10, processes=1).export(['weather'], end=dt(2017, 3, 15))
+
+    assert results['weather']['documents'] == 6
+    assert exported(backend, 'weather') == list(range(31))
+
+
+def test_resume_skips_uploaded_chunks(tmpdir, db, backend):
+    work = str(tmpdir.join('work'))
+    exporter = Exporter(db, backend, work, chunk_size=10, processes=1)
+    exporter.export(['weather'], end=dt(2017, 3, 15))
+
+    # Lose the progress, as if the run died before saving it
+    os.remove(exporter.progress_fn)
+
+    results = Exporter(db, backend, work, chunk_size=10, processes=1).export(['weather'], end=dt(2017, 3, 15))
+
+    assert results['weather']['uploaded'] == 0
+    assert results['weather']['skipped'] == 3
+    assert exported(backend, 'weather') == list(range(25))
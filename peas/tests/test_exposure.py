@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from peas.exposure import ExposureController
+from peas.exposure import image_stats
+from peas.exposure import load_small
+from peas.exposure import read_sidecar
+from peas.exposure import write_sidecar
+
+
+def make_jpeg(tmpdir, level, name='image.jpeg', spread=40, size=(1600, 1200)):
+    Image = pytest.importorskip('PIL.Image')
+
+    # Left to right gradient centred on `level`
+    row = np.linspace(level - spread, level + spread, size[0])
+    pixels = np.clip(np.tile(row, (size[1], 1)), 0, 255).astype(np.uint8)
+    fn = str(tmpdir.join(name))
+    Image.fromarray(pixels).convert('RGB').save(fn, 'JPEG', quality=90)
+
+    return fn
+
+
+def test_load_small(tmpdir):
+    pixels = load_small(make_jpeg(tmpdir, 100))
+
+    # Draft mode scales by 8 at most
+    assert pixels.shape == (150, 200)
+    assert pixels.dtype == np.uint8
+
+
+def test_image_stats():
+    pixels = np.concatenate([np.zeros(10), np.full(80, 100), np.full(10, 255)]).astype(np.uint8)
+    stats = image_stats(pixels)
+
+    assert stats['p1'] == 0
+    assert stats['p50'] == 100
+    assert stats['p95'] == 255
+    assert stats['mean'] == pytest.approx((80 * 100 + 10 * 255) / 100)
+    assert stats['saturated'] == pytest.approx(0.1)
+    assert stats['dark'] == pytest.approx(0.1)
+    assert stats['pixels'] == 100
+
+    assert image_stats(np.zeros(0)) is None
+
+
+def test_image_stats_jpeg(tmpdir):
+    stats = image_stats(load_small(make_jpeg(tmpdir, 60)))
+
+    assert stats['p50'] == pytest.approx(60, abs=2)
+    assert stats['p5'] == pytest.approx(60 - 36, abs=2)
+    assert stats['p95'] == pytest.approx(60 + 36, abs=2)
+    assert stats['saturated'] == 0
+
+
+def test_sidecar(tmpdir):
+    fn = str(tmpdir.join('video0_20170314T000000.jpeg'))
+    out_file = write_sidecar(fn, {'stats': {'p50': 100}, 'gain': '50%'})
+
+    assert out_file == str(tmpdir.join('video0_20170314T000000.json'))
+    assert read_sidecar(fn) == {'stats': {'p50': 100}, 'gain': '50%'}
+
+
+def test_controller():
+    controller = ExposureController(brightness='50%', gain='95%', step=10)
+
+    # Within tolerance
+    assert controller.update({'p50': 115, 'saturated': 0.}) == {'brightness': 50, 'gain': 95}
+
+    # Too dark: gain to its limit then brightness
+    assert controller.update({'p50': 20, 'saturated': 0.}) == {'brightness': 55, 'gain': 100}
+
+    # Saturated with a good median is still too bright
+    settings = controller.update({'p50': 110, 'saturated': 0.2})
+    assert settings['gain'] < 100
+    assert settings['brightness'] == 55
+
+    assert controller.update(None) == settings
+
+
+def test_controller_converges():
+    controller = ExposureController(brightness=50, gain=10)
+
+    # A camera whose level follows gain and brightness
+    def capture(settings):
+        level = min(255, 20 + 2 * settings['gain'] + settings['brightness'] / 2.)
+        return {'p50': level, 'saturated': 0.}
+
+    settings = controller.settings
+    for _ in range(20):
+        settings = controller.update(capture(settings))
+
+    assert abs(capture(settings)['p50'] - controller.target) <= controller.tolerance
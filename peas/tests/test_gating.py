@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+from peas.gating import DROP
+from peas.gating import KEEP
+from peas.gating import REDUCE
+from peas.gating import FrameGate
+from peas.gating import difference
+from peas.gating import reduce_quality
+from peas.gating import signature
+
+
+@pytest.fixture
+def sky():
+    rng = np.random.RandomState(42)
+    return rng.randint(50, 150, (150, 200)).astype(np.uint8)
+
+
+def test_signature(sky):
+    sig = signature(sky)
+
+    assert sig.shape == (24, 32)
+    assert sig[0, 0] == pytest.approx(sky[:6, :6].mean())
+
+
+def test_difference(sky):
+    a = signature(sky)
+
+    assert difference(a, a) == 0
+    assert difference(a, None) == np.inf
+
+    # Brighter overall is not a change
+    brighter = signature(sky.astype(int) + 30)
+    assert difference(a, brighter) == pytest.approx(0, abs=1e-4)
+
+    # A bright object in a corner is
+    event = sky.copy()
+    event[:40, :40] = 255
+    assert difference(a, signature(event)) > 2
+
+
+def test_gate(sky):
+    gate = FrameGate(threshold=2.0, max_interval=600)
+
+    assert gate.check(sky, 0)[0] == KEEP
+    assert gate.check(sky, 60)[0] == DROP
+
+    event = sky.copy()
+    event[:40, :40] = 255
+    decision, change = gate.check(event, 120)
+    assert decision == KEEP
+    assert change > 2
+
+    # Compared with the last kept frame, not the last captured one
+    assert gate.check(event, 180)[0] == DROP
+    assert gate.check(event, 240)[0] == DROP
+
+    # Nothing kept for too long
+    assert gate.check(event, 720)[0] == KEEP
+
+    assert gate.counts == {KEEP: 3, REDUCE: 0, DROP: 3}
+
+
+def test_gate_reduce(sky):
+    gate = FrameGate(mode=REDUCE)
+    gate.check(sky, 0)
+
+    assert gate.check(sky, 60)[0] == REDUCE
+
+    with pytest.raises(AssertionError):
+        FrameGate(mode='skip')
+
+
+def test_reduce_quality(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+
+    rng = np.random.RandomState(42)
+    fn = str(tmpdir.join('image.jpeg'))
+    Image.fromarray(rng.randint(0, 255, (480, 640, 3)).astype(np.uint8)).save(fn, 'JPEG', quality=100)
+    size = os.path.getsize(fn)
+
+    reduce_quality(fn, 60)
+
+    assert os.path.getsize(fn) < size / 2
+    with Image.open(fn) as img:
+        assert img.size == (640, 480)
@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+from datetime import datetime as dt
+
+from peas import messaging
+
+
+@pytest.fixture
+def record():
+    return {
+        'data': {
+            'ambient_temp_C': 17.5,
+            'sky_condition': 'Clear',
+            'safe': True,
+            'date': dt(2017, 3, 14, 10, 23, 54, 120000),
+        }
+    }
+
+
+def test_json_frame(record):
+    channel, msg = messaging.decode_frame(messaging.encode_frame('weather', record, encoding='json'))
+
+    assert channel == 'weather'
+    assert msg['data']['date'] == '2017-03-14T10:23:54.120000'
+
+
+def test_msgpack_frame(record):
+    pytest.importorskip('msgpack')
+
+    frame = messaging.encode_frame('weather', record, encoding='msgpack')
+    assert frame.startswith(b'weather ' + messaging.MSGPACK_MARKER)
+
+    channel, msg = messaging.decode_frame(frame)
+    assert channel == 'weather'
+    assert msg == record
+
+
+def test_channel_encoding():
+    config = {'messaging': {'encoding': {'weather': 'msgpack'}}}
+
+    assert messaging.channel_encoding(config, 'weather') == 'msgpack'
+    assert messaging.channel_encoding(config, 'environment') == 'json'
+    assert messaging.channel_encoding({}, 'weather') == 'json'
+
+
+class FakePublisher(object):
+
+    def __init__(self):
+        self.sent = list()
+
+    def send_message(self, channel, msg):
+        self.sent.append((channel, msg))
+
+
+@pytest.fixture
+def publisher():
+    return FakePublisher()
+
+
+def make_service(publisher, ready=None, **kwargs):
+    """ A `PublisherService` whose socket is created once `ready` is set """
+    def connect(port):
+        if ready is not None:
+            ready.wait(5)
+        return publisher
+
+    return messaging.PublisherService(connect=connect, **kwargs)
+
+
+def test_publisher_flush_on_stop(publisher, record):
+    service = make_service(publisher)
+    for i in range(5):
+        assert service.send_message('weather', dict(record, i=i))
+    service.send_message('environment', record)
+    service.stop()
+
+    assert [msg['i'] for channel, msg in publisher.sent if channel == 'weather'] == list(range(5))
+    stats = service.get_stats()
+    assert stats['weather']['queued'] == stats['weather']['sent'] == 5
+    assert stats['environment']['sent'] == 1
+    assert not service.is_running
+
+
+def test_publisher_drops_when_full(publisher, record):
+    ready = threading.Event()
+    service = make_service(publisher, ready, max_queue=3)
+
+    results = [service.send_message('weather', record) for _ in range(5)]
+    ready.set()
+    service.stop()
+
+    assert results == [True] * 3 + [False] * 2
+    stats = service.get_stats()['weather']
+    assert (stats['queued'], stats['dropped'], stats['sent']) == (3, 2, 3)
+
+
+def test_publisher_drain_size(publisher, record):
+    ready = threading.Event()
+    service = make_service(publisher, ready, drain_size=2)
+
+    for _ in range(5):
+        service.send_message('weather', record)
+    ready.set()
+    service.stop()
+
+    # 2 + 2 + 1, then the stop marker
+    assert service.get_stats()['weather']['wakeups'] == 3
+    assert len(publisher.sent) == 5
+
+
+def test_publisher_copies_message(publisher, record):
+    ready = threading.Event()
+    service = make_service(publisher, ready)
+
+    service.send_message('weather', record)
+    record['data']['safe'] = False
+    ready.set()
+    service.stop()
+
+    assert publisher.sent[0][1]['data']['safe'] is True
+
+
+def test_publisher_connect_retry(publisher, record):
+    attempts = list()
+
+    def connect(port):
+        attempts.append(port)
+        if len(attempts) < 3:
+            raise IOError('address in use')
+        return publisher
+
+    service = messaging.PublisherService(port=6600, connect=connect)
+    service.retry_delay = 0.01
+
+    service.send_message('weather', record)
+    thread = service._thread
+    service.send_message('weather', record)
+    # Still the same thread, retrying
+    assert service._thread is thread
+    time.sleep(0.2)
+    service.stop()
+
+    assert attempts == [6600] * 3
+    assert service.connect_errors == 2
+    assert service.get_stats()['weather']['sent'] == 2
+
+
+def test_publisher_stop_without_socket(record):
+    def connect(port):
+        raise IOError('address in use')
+
+    service = messaging.PublisherService(connect=connect)
+    service.send_message('weather', record)
+    service.stop()
+
+    assert not service.is_running
+    assert service.get_stats()['weather']['dropped'] == 1
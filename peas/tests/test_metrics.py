@@ -0,0 +1,115 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from peas.metrics import Metrics
+from peas.metrics import MetricsServer
+from peas.metrics import has_reading
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics(window=100)
+    for i in range(100):
+        metrics.record('weather', i / 100.)
+    return metrics
+
+
+def parse(text):
+    """ Samples of the Prometheus text format, by name with labels """
+    samples = dict()
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_render(metrics):
+    metrics.add_gauge('peas_queue_depth', 'Items waiting.', lambda: [({'queue': 'publisher'}, 3)])
+    metrics.add_gauge('peas_broken', 'Fails to read.', lambda: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        metrics.measure('environment', lambda: 1 / 0)
+
+    text = metrics.render()
+    samples = parse(text)
+
+    assert '# TYPE peas_capture_duration_seconds summary' in text
+    assert samples['peas_captures_total{sensor="weather"}'] == 100
+    assert samples['peas_capture_errors_total{sensor="weather"}'] == 0
+    assert samples['peas_capture_errors_total{sensor="environment"}'] == 1
+    assert samples['peas_capture_duration_seconds{quantile="0.5",sensor="weather"}'] == pytest.approx(0.495)
+    assert samples['peas_capture_duration_seconds{quantile="0.99",sensor="weather"}'] == pytest.approx(0.98, abs=0.01)
+    assert samples['peas_capture_duration_seconds_sum{sensor="weather"}'] == pytest.approx(49.5)
+    assert samples['peas_queue_depth{queue="publisher"}'] == 3
+    # Never succeeded
+    assert 'peas_last_success_timestamp_seconds{sensor="environment"} NaN' in text
+    # A broken gauge doesn't break the others
+    assert 'peas_broken' not in text
+
+
+def test_health(metrics):
+    last = metrics.snapshot()['weather']['last_success']
+
+    assert metrics.health({'weather': 60}, now=last + 30) == (True, dict())
+
+    healthy, problems = metrics.health({'weather': 60, 'webcams': 60}, now=last + 90)
+    assert not healthy
+    assert sorted(problems) == ['weather', 'webcams']
+
+
+def test_server(metrics):
+    server = MetricsServer(metrics, port=0, max_age={'weather': 60, 'webcams': 0})
+    server.start()
+    url = 'http://{}:{}'.format(*server.address)
+
+    try:
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.status == 200
+            assert 'peas_captures_total{sensor="weather"} 100.0' in response.read().decode()
+
+        # No webcam capture yet
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + '/health')
+        assert e.value.code == 503
+        assert 'webcams' in e.value.read().decode()
+
+        server.max_age = {'weather': 60}
+        with urllib.request.urlopen(url + '/health') as response:
+            assert response.read() == b'ok\n'
+    finally:
+        server.stop()
+
+
+def test_empty_capture_fails_health():
+    metrics = Metrics()
+    # Running for a minute already
+    metrics.started -= 60
+    server = MetricsServer(metrics, port=0, max_age={'environment': 30})
+    server.start()
+
+    try:
+        # A stalled Arduino returns no readings without raising
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                metrics.measure('environment', dict, check=has_reading)
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen('http://{}:{}/health'.format(*server.address))
+        assert e.value.code == 503
+        assert 'No data from environment' in e.value.read().decode()
+    finally:
+        server.stop()
+
+    assert metrics.snapshot()['environment']['errors'] == 3
+    assert metrics.snapshot()['environment']['last_success'] is None
+
+
+def test_has_reading():
+    assert not has_reading('environment', {})
+    assert has_reading('environment', {'telemetry_board': {'humidity': 50.}})
+    # Every serial query failed, only the name and safety decision are left
+    assert not has_reading('weather', {'weather_sensor_name': 'AAG', 'safe': False})
+    assert has_reading('weather', {'weather_sensor_name': 'AAG', 'sky_temp_C': -20.})
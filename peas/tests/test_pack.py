@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+
+from peas.pack import FramePack
+from peas.pack import find_frame
+from peas.pack import frame_time
+from peas.pack import pack_file
+
+
+@pytest.fixture
+def day_dir(tmpdir):
+    directory = tmpdir.mkdir('20170314')
+    for minute in range(10):
+        fn = directory.join('video0_20170314T01{:02d}00.jpeg'.format(minute))
+        fn.write_binary('frame {}'.format(minute).encode() * (minute + 1))
+        directory.join('video0_20170314T01{:02d}00.json'.format(minute)).write(
+            json.dumps({'stats': {'p50': minute}, 'gain': '50%'}))
+
+    return str(directory)
+
+
+def images(directory):
+    return sorted(fn for fn in os.listdir(directory) if fn.endswith('.jpeg'))
+
+
+def test_frame_time():
+    assert frame_time('/data/20170314/video0_20170314T011500.jpeg') == np.datetime64('2017-03-14T01:15:00')
+
+
+def test_append_and_read(day_dir):
+    pack = FramePack(pack_file(day_dir, 'video0'))
+    frames = [os.path.join(day_dir, fn) for fn in images(day_dir)]
+
+    assert pack.append(frames[:4], remove=True) == 4
+    assert pack.append(frames[4:], remove=True) == 6
+    assert len(pack) == 10
+    assert images(day_dir) == []
+    assert not any(fn.startswith('video0_') for fn in os.listdir(day_dir))
+
+    assert pack.read(3) == b'frame 3' * 4
+    assert list(pack.iter_frames(8)) == [b'frame 8' * 9, b'frame 9' * 10]
+
+    stats = pack.read_stats()
+    assert [record['stats']['p50'] for record in stats] == list(range(10))
+    assert stats[2]['time'] == '2017-03-14T01:02:00'
+
+
+def test_frame_at(day_dir):
+    pack = FramePack(pack_file(day_dir, 'video0'))
+    pack.append([os.path.join(day_dir, fn) for fn in images(day_dir)])
+
+    time, data = pack.frame_at(dt(2017, 3, 14, 1, 5, 30))
+    assert time == np.datetime64('2017-03-14T01:05:00')
+    assert data == b'frame 5' * 6
+
+    assert pack.frame_at(dt(2017, 3, 14, 0, 59)) is None
+
+
+def test_append_after_crash(day_dir):
+    pack = FramePack(pack_file(day_dir, 'video0'))
+    frames = [os.path.join(day_dir, fn) for fn in images(day_dir)]
+    pack.append(frames[:5])
+
+    # Bytes written after the last index update
+    with open(pack.path, 'ab') as f:
+        f.write(b'partial frame')
+
+    # Already packed frames are skipped, the rest appended after the indexed end
+    assert pack.append(frames, remove=True) == 5
+    assert [data[:7] for data in pack.iter_frames()] == [b'frame ' + str(i).encode() for i in range(10)]
+    assert os.path.getsize(pack.path) == sum(len(b'frame 0') * (i + 1) for i in range(10))
+    assert images(day_dir) == []
+
+
+def test_no_duplicate_stats_after_crash(day_dir, monkeypatch):
+    pack = FramePack(pack_file(day_dir, 'video0'))
+    frames = [os.path.join(day_dir, fn) for fn in images(day_dir)]
+    pack.append(frames[:5])
+
+    # Crash before the index is replaced
+    def crash(src, dst):
+        raise OSError('crash')
+
+    with monkeypatch.context() as patch:
+        patch.setattr('peas.pack.os.replace', crash)
+        with pytest.raises(OSError):
+            pack.append(frames)
+
+    assert pack.append(frames) == 5
+    assert [record['stats']['p50'] for record in pack.read_stats()] == list(range(10))
+
+
+def test_concurrent_append(day_dir):
+    # The webcam rollover and scripts/pack_webcams.py packing the same day
+    frames = [os.path.join(day_dir, fn) for fn in images(day_dir)]
+    packs = [FramePack(pack_file(day_dir, 'video0')) for _ in range(4)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        added = list(pool.map(lambda pack: pack.append(frames, remove=True), packs))
+
+    assert sorted(added) == [0, 0, 0, 10]
+    pack = FramePack(pack_file(day_dir, 'video0'))
+    assert [data[:7] for data in pack.iter_frames()] == [b'frame ' + str(i).encode() for i in range(10)]
+    assert images(day_dir) == []
+
+
+def test_find_frame(tmpdir, day_dir):
+    frames = [os.path.join(day_dir, fn) for fn in images(day_dir)]
+    FramePack(pack_file(day_dir, 'video0')).append(frames[:5], remove=True)
+
+    # From the pack
+    time, data = find_frame(str(tmpdir), 'video0', dt(2017, 3, 14, 1, 2))
+    assert data == b'frame 2' * 3
+
+    # From an image not packed yet
+    time, data = find_frame(str(tmpdir), 'video0', dt(2017, 3, 14, 2))
+    assert time == np.datetime64('2017-03-14T01:09:00')
+
+    assert find_frame(str(tmpdir), 'video0', dt(2017, 3, 15, 2)) is None
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+from peas.preview import PreviewService
+from peas.preview import make_previews
+from peas.preview import replace_symlink
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def image(tmpdir):
+    fn = str(tmpdir.join('video0_20170314T000000.jpeg'))
+    Image.new('RGB', (1600, 1200), (10, 100, 200)).save(fn, 'JPEG')
+    return fn
+
+
+def test_make_previews(tmpdir, image):
+    previews = make_previews(image, str(tmpdir), 'video0')
+
+    assert sorted(previews) == ['medium', 'small', 'tn']
+    assert previews['tn'] == str(tmpdir.join('tn_video0.jpeg'))
+
+    for preview, size in [('tn', (240, 180)), ('small', (480, 360)), ('medium', (800, 600))]:
+        with Image.open(previews[preview]) as img:
+            assert img.size == size
+
+    assert not any(fn.endswith('.tmp') for fn in os.listdir(str(tmpdir)))
+
+
+def test_previews_replace_symlink(tmpdir, image):
+    # Previous versions linked the thumbnail to the full image
+    link = str(tmpdir.join('tn_video0.jpeg'))
+    os.symlink(image, link)
+
+    make_previews(image, str(tmpdir), 'video0', sizes=(('tn', (240, 180)),))
+
+    assert not os.path.islink(link)
+    with Image.open(image) as img:
+        assert img.size == (1600, 1200)
+
+
+def test_replace_symlink(tmpdir):
+    link = str(tmpdir.join('video0.jpeg'))
+    replace_symlink('first.jpeg', link)
+    replace_symlink('second.jpeg', link)
+
+    assert os.readlink(link) == 'second.jpeg'
+    assert os.listdir(str(tmpdir)) == ['video0.jpeg']
+
+
+def test_service(tmpdir, image):
+    service = PreviewService(sizes=(('tn', (240, 180)),))
+    service.submit(image, str(tmpdir), 'video0')
+    service.submit(str(tmpdir.join('missing.jpeg')), str(tmpdir), 'video1')
+    service.stop()
+
+    assert service.pending() == 0
+    assert os.path.exists(str(tmpdir.join('tn_video0.jpeg')))
+    stats = service.get_stats()
+    assert stats['made'] == 1
+    assert stats['errors'] == 1
+
+
+def test_service_keeps_newest(tmpdir, image, monkeypatch):
+    made = list()
+
+    def slow_previews(fn, directory, name, **kwargs):
+        time.sleep(0.1)
+        made.append(fn)
+
+    monkeypatch.setattr('peas.preview.make_previews', slow_previews)
+
+    service = PreviewService()
+    for i in range(5):
+        service.submit('{}.jpeg'.format(i), str(tmpdir), 'video0')
+    service.stop()
+
+    # The first may have started already, the rest are replaced by the newest
+    assert made[-1] == '4.jpeg'
+    assert len(made) <= 2
+    assert service.get_stats()['skipped'] >= 3
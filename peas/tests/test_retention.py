@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.retention import compact
+from peas.retention import query
+from peas.store import ColumnStore
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = ColumnStore(str(tmpdir.join('store')))
+
+    start = dt(2017, 1, 1)
+    for i in range(2 * 24 * 60):
+        date = start + tdelta(seconds=60 * i)
+        store.append('weather', {'date': date, 'wind_speed_KPH': float(i % 60), 'safe': i % 2 == 0})
+    store.append('weather', {'date': dt(2017, 3, 1), 'wind_speed_KPH': 99.})
+
+    return store
+
+
+def test_compact(store):
+    compacted = compact(store, 'weather', ages={'raw': 7, '1m': 30}, now=dt(2017, 3, 1, 12))
+
+    assert ('weather', '20170101') in compacted
+    assert ('weather_1m', '20170101') in compacted
+    assert store.days('weather') == ['20170301']
+    assert store.days('weather_1m') == []
+    assert store.days('weather_1h') == ['20170101', '20170102']
+
+    data = store.read('weather_1h')
+    assert len(data['date']) == 48
+    assert np.all(data['wind_speed_KPH_max'] == 59.)
+    assert np.all(data['wind_speed_KPH_min'] == 0.)
+    assert np.all(data['wind_speed_KPH_count'] == 60)
+    assert data['wind_speed_KPH_mean'][0] == pytest.approx(29.5)
+    assert data['safe_mean'][0] == pytest.approx(0.5)
+
+
+def test_query_picks_tier(store):
+    compact(store, 'weather', ages={'raw': 7, '1m': 30}, now=dt(2017, 1, 20))
+    assert store.days('weather_1m') == ['20170101', '20170102']
+
+    data = query(store, 'weather', dt(2017, 1, 1), dt(2017, 3, 2), resolution=60, columns=['wind_speed_KPH'])
+    assert len(data['date']) == 2 * 24 * 60 + 1
+    assert data['interval'][0] == 60
+    assert data['interval'][-1] == 0
+    assert data['wind_speed_KPH_max'][-1] == 99.
+
+    # No hourly tier yet, so the finer 1-minute tier is the coarsest acceptable one
+    data = query(store, 'weather', dt(2017, 1, 1), dt(2017, 1, 1, 23, 59), resolution=3600,
+                 columns=['wind_speed_KPH'])
+    assert len(data['date']) == 24 * 60
@@ -0,0 +1,50 @@
+import pytest
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.rollup import Rollup
+from peas.rollup import RollupAggregator
+
+
+def test_rollup_buckets():
+    rollup = Rollup(interval=60)
+    start = dt(2017, 3, 14, 12, 0, 30)
+
+    closed = list()
+    for i in range(90):
+        record = {'date': start + tdelta(seconds=i), 'humidity': float(i), 'current': {'fan': 2}, 'name': 'board',
+                  'safe': i % 2 == 0}
+        closed.extend(rollup.add(record))
+
+    assert len(closed) == 1
+    bucket = closed[0]
+    assert bucket['date'] == dt(2017, 3, 14, 12, 0)
+    assert bucket['humidity_count'] == 30
+    assert bucket['humidity_min'] == 0.
+    assert bucket['humidity_max'] == 29.
+    assert bucket['humidity_mean'] == pytest.approx(14.5)
+    assert bucket['humidity_last'] == 29.
+    assert bucket['current.fan_mean'] == 2
+    assert bucket['safe_mean'] == 0.5
+    assert 'name_mean' not in bucket
+
+    bucket = rollup.close()
+    assert bucket['date'] == dt(2017, 3, 14, 12, 1)
+    assert bucket['humidity_count'] == 60
+
+
+def test_aggregator_emits_per_interval():
+    emitted = list()
+    aggregator = RollupAggregator(lambda record_type, bucket: emitted.append(record_type))
+
+    start = dt(2017, 3, 14, 12, 59, 0)
+    for i in range(0, 180, 10):
+        aggregator.add('environment_telemetry_board', {'date': start + tdelta(seconds=i), 'amps': 1.})
+
+    assert emitted == ['environment_telemetry_board_1m',
+                       'environment_telemetry_board_1h',
+                       'environment_telemetry_board_1m']
+
+    aggregator.flush()
+    assert emitted[-2:] == ['environment_telemetry_board_1m', 'environment_telemetry_board_1h']
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from peas.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_no_drift(scheduler):
+    starts = list()
+
+    def job():
+        starts.append(time.monotonic())
+        time.sleep(0.03)
+
+    scheduler.add('weather', job, 0.1)
+    time.sleep(1.05)
+    scheduler.stop()
+
+    # Runs every 0.1 s even though each takes 0.03 s
+    assert len(starts) == 11
+    assert starts[10] - starts[0] == pytest.approx(1.0, abs=0.05)
+
+
+def test_slow_job_does_not_delay_others(scheduler):
+    runs = {'weather': 0, 'webcams': 0}
+
+    def job(name, duration):
+        runs[name] += 1
+        time.sleep(duration)
+
+    scheduler.add('webcams', lambda: job('webcams', 0.5), 0.1)
+    scheduler.add('weather', lambda: job('weather', 0.), 0.1)
+    time.sleep(0.55)
+
+    stats = scheduler.get_stats()
+    scheduler.stop()
+
+    assert runs['weather'] >= 5
+    assert runs['webcams'] <= 2
+    assert stats['weather']['overruns'] == 0
+    assert stats['webcams']['overruns'] >= 3
+
+
+def test_remove_and_stop(scheduler):
+    runs = list()
+    scheduler.add('environment', lambda: runs.append(1), 0.05)
+    time.sleep(0.12)
+
+    assert scheduler.remove('environment')
+    assert not scheduler.remove('environment')
+    assert scheduler.jobs == []
+
+    count = len(runs)
+    time.sleep(0.15)
+    assert len(runs) == count
+
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.2)
+        finished.set()
+
+    scheduler.add('webcams', slow, 10)
+    time.sleep(0.05)
+    scheduler.stop()
+
+    # The run in progress was waited for
+    assert finished.is_set()
+    assert not scheduler.is_running
+
+
+def test_interval_and_errors(scheduler):
+    interval = {'delay': 10.}
+    runs = list()
+
+    def job():
+        runs.append(1)
+        raise ValueError("No reading")
+
+    scheduler.add('weather', job, lambda: interval['delay'])
+    time.sleep(0.05)
+    assert len(runs) == 1
+
+    # The new delay applies once the pending run is done
+    interval['delay'] = 0.05
+    scheduler.add('weather', job, lambda: interval['delay'])
+    time.sleep(0.23)
+
+    stats = scheduler.get_stats()['weather']
+    assert stats['runs'] >= 4
+    assert stats['errors'] == stats['runs']
@@ -0,0 +1,183 @@
+import os
+import pytest
+
+from datetime import datetime as dt
+from datetime import timezone
+
+from peas.spool import Spool
+
+
+class DuplicateKeyError(Exception):
+
+    def __init__(self, count):
+        super(DuplicateKeyError, self).__init__('duplicate key')
+        self.details = {'writeErrors': [{'code': 11000}] * count}
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.docs = dict()
+        self.fail = False
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail:
+            raise IOError('mongo is down')
+
+        duplicates = 0
+        for doc in docs:
+            if doc['_id'] in self.docs:
+                duplicates += 1
+            else:
+                self.docs[doc['_id']] = doc
+
+        if duplicates:
+            raise DuplicateKeyError(duplicates)
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query['type']] = doc
+
+
+class FakeDB(object):
+
+    def __init__(self):
+        self.weather = FakeCollection()
+        self.environment = FakeCollection()
+        self.current = FakeCollection()
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def spool(tmpdir, db, monkeypatch):
+    spool = Spool(str(tmpdir.join('spool')), batch_size=3, connect=lambda: db)
+    # Replay by hand rather than from the background thread
+    monkeypatch.setattr(spool, 'start', lambda: None)
+    return spool
+
+
+def spool_weather(spool, num):
+    for i in range(num):
+        spool.append('weather', {'ambient_temp_C': float(i), 'date': dt(2017, 3, 14, 10, i)})
+    spool.rotate(force=True)
+
+    return spool.segments()[-1]
+
+
+def test_append_and_replay(tmpdir, db):
+    spool = Spool(str(tmpdir.join('spool')), connect=lambda: db)
+    for i in range(5):
+        spool.append('weather', {'ambient_temp_C': float(i), 'date': dt(2017, 3, 14, 10, i)})
+    spool.append('environment', {'telemetry_board': {'humidity': 50.}})
+    spool.stop()
+
+    assert len(db.weather.docs) == 5
+    assert len(db.environment.docs) == 1
+    assert db.current.docs['weather']['data']['ambient_temp_C'] == 4.
+    assert db.current.docs['weather']['data']['date'] == dt(2017, 3, 14, 10, 4)
+    assert spool.segments(include_active=True) == []
+
+
+def test_replay_resumes_after_failure(spool, db):
+    segment = spool_weather(spool, 7)
+
+    calls = []
+    insert_many = db.weather.insert_many
+
+    def fail_second_batch(docs, ordered=True):
+        calls.append(len(docs))
+        if len(calls) == 2:
+            raise IOError('mongo went away')
+        insert_many(docs, ordered=ordered)
+
+    db.weather.insert_many = fail_second_batch
+    with pytest.raises(IOError):
+        spool.replay()
+
+    assert len(db.weather.docs) == 3
+    assert spool._committed(segment) == 3
+
+    spool.replay()
+
+    assert calls == [3, 3, 3, 1]
+    assert len(db.weather.docs) == 7
+    assert not os.path.exists(segment)
+    assert not os.path.exists(segment + '.committed')
+
+
+def test_duplicates_are_ignored(spool, db):
+    segment = spool_weather(spool, 4)
+
+    # Inserted before a crash, but the marker was never written
+    name = os.path.basename(segment).split('.')[0]
+    for i in range(3):
+        db.weather.docs['{}-{}'.format(name, i)] = {}
+
+    spool.replay()
+
+    assert len(db.weather.docs) == 4
+    assert spool.stats['duplicates'] == 3
+    assert spool.stats['replayed'] == 4
+
+
+def test_outage_keeps_segments(spool, db):
+    db.weather.fail = True
+    spool_weather(spool, 1)
+
+    with pytest.raises(IOError):
+        spool.replay()
+
+    assert len(spool.segments()) == 1
+
+    db.weather.fail = False
+    spool.replay()
+
+    assert len(db.weather.docs) == 1
+    assert spool.segments() == []
+
+
+def test_segments_survive_restart(tmpdir, db):
+    directory = str(tmpdir.join('spool'))
+    spool = Spool(directory, connect=lambda: db)
+    spool.start = lambda: None
+    spool_weather(spool, 2)
+
+    spool = Spool(directory, connect=lambda: db)
+    spool.start = lambda: None
+    spool_weather(spool, 2)
+
+    assert len(spool.segments()) == 2
+    spool.replay()
+    assert len(db.weather.docs) == 4
+
+
+def test_restart_after_replay(tmpdir, db):
+    directory = str(tmpdir.join('spool'))
+    spool = Spool(directory, connect=lambda: db)
+    spool.start = lambda: None
+    spool_weather(spool, 2)
+    spool.replay()
+    assert spool.segments(include_active=True) == []
+
+    # Nothing left on disk, the new records must still get new `_id`s
+    spool = Spool(directory, connect=lambda: db)
+    spool.start = lambda: None
+    spool_weather(spool, 2)
+    spool.replay()
+
+    assert len(db.weather.docs) == 4
+    assert spool.stats['duplicates'] == 0
+
+
+def test_aware_datetime(spool, db):
+    date = dt(2017, 3, 14, 10, 0, 30, tzinfo=timezone.utc)
+    spool.append('weather', {'date': date, 'naive': dt(2017, 3, 14, 10)})
+    spool.rotate(force=True)
+    spool.replay()
+
+    doc = list(db.weather.docs.values())[0]
+    assert doc['data']['date'] == date
+    assert doc['data']['naive'] == dt(2017, 3, 14, 10)
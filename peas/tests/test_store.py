@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.store import ColumnStore
+from peas.store import flatten
+
+
+@pytest.fixture
+def store(tmpdir):
+    return ColumnStore(str(tmpdir.join('store')))
+
+
+def weather_record(date, temp=10.):
+    return {
+        'date': date,
+        'ambient_temp_C': temp,
+        'rain_sensor_temp_C': '{:.02f}'.format(temp + 2),
+        'safe': temp > 5,
+        'sky_condition': 'Clear',
+        'errors': {'error_1': '0'},
+    }
+
+
+def test_flatten():
+    assert flatten({'a': 1, 'b': {'c': 2}, 'd': [3, 4]}) == {'a': 1, 'b.c': 2, 'd.0': 3, 'd.1': 4}
+
+
+def test_append_and_read(store):
+    start = dt(2017, 3, 14, 23, 58)
+    for i in range(6):
+        store.append('weather', weather_record(start + tdelta(seconds=60 * i), temp=float(i)))
+
+    assert store.days('weather') == ['20170314', '20170315']
+
+    data = store.read('weather')
+    assert len(data['date']) == 6
+    assert data['ambient_temp_C'].dtype == np.float32
+    assert data['rain_sensor_temp_C'][3] == pytest.approx(5.)
+    assert data['sky_condition'][0] == b'Clear'
+
+    data = store.read('weather', start=start + tdelta(seconds=60), end=start + tdelta(seconds=180),
+                      columns=['safe'])
+    assert sorted(data.keys()) == ['date', 'safe']
+    assert list(data['safe']) == [False, False, False]
+
+
+def test_new_column_is_backfilled(store):
+    date = dt(2017, 3, 14, 12)
+    store.append('environment_telemetry_board', {'date': date, 'humidity': 50})
+    store.append('environment_telemetry_board', {'date': date, 'humidity': 51, 'current': {'fan': 3}})
+
+    data = store.read('environment_telemetry_board')
+    assert np.isnan(data['current.fan'][0])
+    assert data['current.fan'][1] == 3
+
+
+def test_reopen(store):
+    date = dt(2017, 3, 14, 12)
+    store.append('weather', weather_record(date))
+    store.close()
+
+    other = ColumnStore(store.root)
+    other.append('weather', weather_record(date + tdelta(seconds=30)))
+
+    assert len(other.read('weather')['date']) == 2
@@ -0,0 +1,158 @@
+import numpy as np
+import os
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.tables import DayCache
+from peas.tables import columns_from_documents
+from peas.tables import day_range
+from peas.tables import is_finished
+from peas.tables import load_columns
+from peas.tables import open_columns
+from peas.tables import projection
+from peas.tables import share_columns
+from peas.tables import split_days
+from peas.tables import table_from_columns
+
+
+def test_projection():
+    proj = projection((('ambient_temp_C', 'f4'), ('safe', bool)))
+    assert proj == {'_id': 0, 'date': 1, 'data.ambient_temp_C': 1, 'data.safe': 1}
+
+
+def test_columns_from_documents():
+    docs = [
+        {'date': dt(2017, 3, 14, 0, 0, 2), 'data': {'ambient_temp_C': 12.5, 'rain_sensor_temp_C': '18.25',
+                                                     'safe': True, 'sky_condition': 'Clear'}},
+        {'date': dt(2017, 3, 14, 0, 0, 1), 'data': {'ambient_temp_C': 'bad', 'safe': None,
+                                                     'sky_condition': 'Cloudy', 'sky_condition_code': 3}},
+        {'date': dt(2017, 3, 14, 0, 0, 3), 'data': {}},
+    ]
+
+    table = table_from_columns(columns_from_documents(docs))
+
+    assert len(table) == 3
+    assert table['date'].dtype == np.dtype('<M8[us]')
+    assert table['date'][0] == np.datetime64('2017-03-14T00:00:01')
+    assert np.isnan(table['ambient_temp_C'][0])
+    assert table['ambient_temp_C'][1] == 12.5
+    assert table['rain_sensor_temp_C'][1] == 18.25
+    assert list(table['safe']) == [False, True, False]
+    # From the code when there is one, otherwise the string
+    assert list(table['sky_condition_code']) == [3, 1, 0]
+
+
+class FakeCollection(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = 0
+
+    def find(self, query, projection=None):
+        self.queries += 1
+        limits = query['date']
+        return FakeCursor([d for d in self.docs if limits['$gt'] < d['date'] < limits['$lt']])
+
+
+class FakeCursor(list):
+
+    def sort(self, keys):
+        return FakeCursor(sorted(self, key=lambda d: d['date']))
+
+
+class FakeDB(object):
+
+    def __init__(self, docs):
+        self.weather = FakeCollection(docs)
+
+
+def make_day(day, num=10):
+    start = dt.strptime(day, '%Y%m%d')
+    return [{'date': start + tdelta(minutes=i), 'data': {'ambient_temp_C': float(i), 'safe': True}}
+            for i in range(num)]
+
+
+def test_day_cache(tmpdir):
+    db = FakeDB(make_day('20170314') + make_day('20170315'))
+    cache = DayCache(str(tmpdir.join('cache')))
+
+    table = cache.load_day(db, '20170314UT')
+    assert len(table) == 10
+    assert table['date'][0] == np.datetime64('2017-03-14T00:00')
+
+    again = cache.load_day(db, '20170314UT')
+    assert db.weather.queries == 1
+    assert list(again['ambient_temp_C']) == list(table['ambient_temp_C'])
+    assert list(again['safe']) == [True] * 10
+
+
+def test_day_cache_version(tmpdir):
+    db = FakeDB(make_day('20170314'))
+    directory = str(tmpdir.join('cache'))
+    DayCache(directory).load_day(db, '20170314')
+
+    # Different columns, the cached file no longer applies
+    other = DayCache(directory, columns=(('ambient_temp_C', 'f8'),))
+    assert other.get('20170314') is None
+
+
+def test_day_cache_eviction(tmpdir):
+    days = ['201703{:02d}'.format(d) for d in range(10, 14)]
+    db = FakeDB([doc for day in days for doc in make_day(day, 100)])
+    cache = DayCache(str(tmpdir.join('cache')))
+
+    for i, day in enumerate(days[:3]):
+        cache.load_day(db, day)
+        os.utime(cache._path(day), (1e9 + i, 1e9 + i))
+    cache.max_bytes = int(3.5 * os.path.getsize(cache._path(days[0])))
+
+    # Reading the oldest day makes it the most recently used
+    assert cache.get(days[0]) is not None
+    cache.load_day(db, days[3])
+
+    assert sorted(os.listdir(cache.directory)) == ['20170310.npz', '20170312.npz', '20170313.npz']
+
+
+def test_day_cache_settle(tmpdir):
+    db = FakeDB(make_day('20170314', 5))
+    cache = DayCache(str(tmpdir.join('cache')), settle=3600.)
+
+    assert len(cache.load_day(db, '20170314UT', now=dt(2017, 3, 15, 0, 30))) == 5
+    assert cache.get('20170314') is None
+
+    # Replayed from a spool after the day was over
+    db.weather.docs.append({'date': dt(2017, 3, 14, 23, 59), 'data': {'ambient_temp_C': 1., 'safe': True}})
+    assert len(cache.load_day(db, '20170314UT', now=dt(2017, 3, 15, 1))) == 6
+    assert len(cache.get('20170314')['date']) == 6
+
+
+def test_day_range():
+    db = FakeDB(make_day('20170314', 1) + make_day('20170315', 1))
+    # From 00:00:00 included to the next 00:00:00 excluded
+    table = table_from_columns(load_columns(db, *day_range('20170314UT')))
+    assert list(table['date']) == [np.datetime64('2017-03-14T00:00')]
+
+
+def test_is_finished():
+    assert is_finished('20170314UT', now=dt(2017, 3, 15))
+    assert not is_finished('20170314UT', now=dt(2017, 3, 14, 23, 59))
+    assert not is_finished('20170314UT', now=dt(2017, 3, 15), lag=60)
+
+
+def test_split_days():
+    dates = np.array(['2017-03-14T23:59', '2017-03-15T00:00', '2017-03-15T12:00', '2017-03-17T01:00'],
+                     dtype='M8[us]')
+
+    assert split_days(dates) == [('20170314', 0, 1), ('20170315', 1, 3), ('20170317', 3, 4)]
+    assert split_days(dates[:0]) == []
+
+
+def test_shared_columns(tmpdir):
+    arrays = columns_from_documents(make_day('20170314', 20))
+    paths = share_columns(arrays, str(tmpdir.join('shared')))
+
+    day = open_columns(paths, 5, 10)
+    assert isinstance(day['ambient_temp_C'], np.memmap)
+    assert list(day['ambient_temp_C']) == [5., 6., 7., 8., 9.]
+    assert len(table_from_columns(day)) == 5
@@ -0,0 +1,164 @@
+import os
+import shutil
+import time
+
+from glob import glob
+
+import pytest
+
+from peas.exposure import write_sidecar
+from peas.pack import FramePack
+from peas.pack import pack_file
+from peas.timelapse import TimelapseBuilder
+from peas.timelapse import TimelapseEncoder
+from peas.timelapse import count_frames
+from peas.timelapse import count_packets
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+
+
+@pytest.fixture
+def frames(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+
+    files = list()
+    for i in range(10):
+        fn = str(tmpdir.join('video0_20170314T{:06d}.jpeg'.format(i)))
+        Image.new('RGB', (64, 48), (i * 20, 100, 200)).save(fn, 'JPEG')
+        files.append(fn)
+
+    return files
+
+
+def test_encode(tmpdir, frames):
+    for fn in frames:
+        write_sidecar(fn, {'gain': '50%'})
+    out_file = str(tmpdir.join('20170314_video0.mp4'))
+    encoder = TimelapseEncoder(out_file, fps=5)
+    encoder.start(frames=frames[:4])
+
+    for fn in frames[4:]:
+        assert encoder.add_frame(fn)
+    assert encoder.is_running
+
+    assert encoder.finish()
+    assert count_frames(out_file) == 10
+    assert not os.path.exists(encoder.part_file)
+    assert not any(os.path.exists(fn) for fn in frames)
+    assert glob(str(tmpdir.join('*.json'))) == []
+
+
+def test_count_packets(tmpdir, frames):
+    out_file = str(tmpdir.join('20170314_video0.mp4'))
+    encoder = TimelapseEncoder(out_file, fps=5, remove_frames=False)
+    encoder.start(frames=frames)
+    assert encoder.finish()
+
+    assert count_packets(out_file) == 10
+
+    # Cut before the index, as by a crash while writing
+    broken = str(tmpdir.join('broken.mp4'))
+    with open(out_file, 'rb') as f, open(broken, 'wb') as out:
+        out.write(f.read(300))
+    assert count_packets(broken) is None
+
+
+def test_keep_frames_if_not_verified(tmpdir, frames, monkeypatch):
+    out_file = str(tmpdir.join('20170314_video0.mp4'))
+    encoder = TimelapseEncoder(out_file, fps=5)
+    encoder.start(frames=frames)
+
+    # Movie shorter than the frames written
+    monkeypatch.setattr('peas.timelapse.count_packets', lambda fn, ffmpeg=None: 9)
+
+    assert not encoder.finish()
+    assert not os.path.exists(out_file)
+    assert all(os.path.exists(fn) for fn in frames)
+
+
+def test_abort(tmpdir, frames):
+    out_file = str(tmpdir.join('20170314_video0.mp4'))
+    encoder = TimelapseEncoder(out_file)
+    encoder.start(frames=frames[:2])
+    encoder.abort()
+
+    assert not encoder.is_running
+    assert not os.path.exists(encoder.part_file)
+    assert all(os.path.exists(fn) for fn in frames)
+    assert not encoder.add_frame(frames[2])
+
+
+def test_no_frames(tmpdir):
+    encoder = TimelapseEncoder(str(tmpdir.join('empty.mp4')))
+    encoder.start()
+
+    assert not encoder.finish()
+    assert not os.path.exists(encoder.part_file)
+
+
+@pytest.fixture
+def webcam_dir(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+
+    for day in ['20170314', '20170315']:
+        day_dir = tmpdir.mkdir(day)
+        for port in ['video0', 'video1']:
+            for i in range(25):
+                fn = str(day_dir.join('{}_{}T{:06d}.jpeg'.format(port, day, i)))
+                Image.new('RGB', (64, 48), (i * 10, 100, 200)).save(fn, 'JPEG')
+
+    return str(tmpdir)
+
+
+def test_builder(webcam_dir):
+    builder = TimelapseBuilder(webcam_dir, fps=5, segment_frames=10, processes=2)
+
+    assert builder.days() == ['20170314', '20170315']
+
+    results = builder.build()
+    assert len(results) == 4
+    for out_file, result in results.items():
+        assert result['frames'] == 25
+        assert 'failed' not in result
+        assert count_frames(out_file) == 25
+        assert not os.path.exists(out_file.replace('.mp4', '.segments'))
+
+    out_file = os.path.join(webcam_dir, '20170315_video1.mp4')
+    assert out_file in results
+
+    # Only the day with a new image is rebuilt
+    frame = os.path.join(webcam_dir, '20170315', 'video1_20170315T000003.jpeg')
+    os.utime(frame, (time.time() + 10, time.time() + 10))
+
+    results = builder.build()
+    assert [fn for fn, result in results.items() if not result.get('skipped')] == [out_file]
+
+
+def test_builder_remove_frames(webcam_dir):
+    for fn in glob(os.path.join(webcam_dir, '*', '*.jpeg')):
+        write_sidecar(fn, {'gain': '50%'})
+
+    builder = TimelapseBuilder(webcam_dir, fps=5, segment_frames=10, processes=2, remove_frames=True)
+    builder.build(days=['20170314'])
+
+    assert os.listdir(os.path.join(webcam_dir, '20170314')) == []
+    assert len(os.listdir(os.path.join(webcam_dir, '20170315'))) == 100
+
+
+def test_builder_from_pack(webcam_dir):
+    # Part of a day packed, the rest still as images
+    day_dir = os.path.join(webcam_dir, '20170314')
+    images = sorted(glob(os.path.join(day_dir, 'video0_*.jpeg')))
+    FramePack(pack_file(day_dir, 'video0')).append(images[:20], remove=True)
+
+    builder = TimelapseBuilder(webcam_dir, fps=5, segment_frames=10, processes=2)
+    movies = builder.movies('20170314')
+    out_file = os.path.join(webcam_dir, '20170314_video0.mp4')
+
+    assert len(movies[out_file]) == 25
+    assert movies[out_file][0] == (pack_file(day_dir, 'video0'), 0)
+    assert movies[out_file][-1] == images[-1]
+
+    results = builder.build(days=['20170314'])
+    assert 'failed' not in results[out_file]
+    assert count_frames(out_file) == 25
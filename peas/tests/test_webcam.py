@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+
+from glob import glob
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pocs')
+
+from peas import webcam  # noqa
+from peas.pack import FramePack  # noqa
+from peas.webcam import Webcam  # noqa
+from peas.webcam import Webcams  # noqa
+from peas.webcam import capture_all  # noqa
+
+FAKE_FSWEBCAM = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    if [ "$1" = "--save" ]; then {} "$2"; fi
+    shift
+done
+sleep {}
+"""
+
+
+@pytest.fixture
+def webcam_dir(tmpdir, monkeypatch):
+    directory = str(tmpdir.mkdir('webcams'))
+    monkeypatch.setattr(webcam, 'load_config', lambda: {'directories': {'webcam': directory}})
+    return directory
+
+
+def make_webcam(tmpdir, name, sleep=0.5, timeout=None, save='touch', ffmpeg=None):
+    script = tmpdir.join('fswebcam_{}'.format(name))
+    script.write(FAKE_FSWEBCAM.format(save, sleep))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+
+    wc = Webcam({'name': name, 'port': '/dev/{}'.format(name), 'params': {'rotate': 270}}, timeout=timeout)
+    wc.cmd = str(script)
+    wc.ffmpeg = ffmpeg
+    return wc
+
+
+def test_command(webcam_dir, tmpdir):
+    wc = make_webcam(tmpdir, 'video0')
+    cmd = wc.command('out.jpeg')
+
+    assert cmd[:5] == [wc.cmd, '-d', '/dev/video0', '--title', 'video0']
+    assert '--rotate=270' in cmd
+    assert cmd[-2:] == ['--save', 'out.jpeg']
+    assert cmd[cmd.index('--timestamp') + 1] == '%Y-%m-%d %H:%M:%S'
+
+
+def test_capture(webcam_dir, tmpdir):
+    wc = make_webcam(tmpdir, 'video0', sleep=0)
+    result = wc.capture()
+
+    assert result['out_fn'] == '{}/video0.jpeg'.format(webcam_dir)
+    assert os.path.exists(os.readlink(result['out_fn']))
+
+    stats = wc.get_stats()
+    assert stats['captures'] == 1
+    assert stats['failures'] == 0
+    assert stats['last_duration'] == result['duration']
+
+
+def test_capture_all_concurrent(webcam_dir, tmpdir):
+    webcams = [make_webcam(tmpdir, 'video{}'.format(i), sleep=0.5) for i in range(3)]
+
+    start = time.monotonic()
+    results = capture_all(webcams)
+    elapsed = time.monotonic() - start
+
+    assert all(r['out_fn'] for r in results)
+    # Side by side, not one after the other
+    assert elapsed < 1.2
+
+
+def test_capture_timeout(webcam_dir, tmpdir):
+    wc = make_webcam(tmpdir, 'video0', sleep=10, timeout=0.2)
+
+    start = time.monotonic()
+    result = wc.capture()
+
+    assert time.monotonic() - start < 5
+    assert result['out_fn'] == ''
+    assert wc.get_stats()['timeouts'] == 1
+    assert not os.path.lexists('{}/video0.jpeg'.format(webcam_dir))
+
+
+def test_webcams_failure(webcam_dir, tmpdir):
+    webcams = Webcams([])
+    webcams.webcams = [make_webcam(tmpdir, 'video0', sleep=0), make_webcam(tmpdir, 'video1', sleep=10, timeout=0.2)]
+
+    # Raised once both are done, so the failure shows up in `peas.metrics`
+    with pytest.raises(RuntimeError, match='video1'):
+        webcams.capture()
+
+    stats = webcams.get_stats()
+    assert stats['video0']['captures'] == 1
+    assert stats['video1']['timeouts'] == 1
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+def test_timelapse_rollover(webcam_dir, tmpdir, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+
+    sample = str(tmpdir.join('sample.jpeg'))
+    Image.new('RGB', (64, 48), (10, 100, 200)).save(sample, 'JPEG')
+
+    wc = make_webcam(tmpdir, 'video0', sleep=0, save='cp {}'.format(sample), ffmpeg=shutil.which('ffmpeg'))
+
+    times = iter(['20170314T23580{}'.format(i) for i in range(3)] + ['20170315T000000'])
+    monkeypatch.setattr(webcam, 'current_time', lambda flatten=False: next(times))
+
+    for _ in range(4):
+        assert wc.capture()['out_fn']
+
+    wc.close()
+
+    # Yesterday's movie is done and its images packed, today's images are kept
+    assert os.path.exists('{}/20170314_video0.mp4'.format(webcam_dir))
+    assert sorted(os.listdir('{}/20170314'.format(webcam_dir))) == [
+        'video0.index.npy', 'video0.pack', 'video0.stats.jsonl']
+    assert len(FramePack('{}/20170314/video0.pack'.format(webcam_dir))) == 3
+    assert len(glob('{}/20170315/*.jpeg'.format(webcam_dir))) == 1
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+def test_timelapse_rollover_no_pack(webcam_dir, tmpdir, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+
+    sample = str(tmpdir.join('sample.jpeg'))
+    Image.new('RGB', (64, 48), (10, 100, 200)).save(sample, 'JPEG')
+
+    wc = make_webcam(tmpdir, 'video0', sleep=0, save='cp {}'.format(sample), ffmpeg=shutil.which('ffmpeg'))
+    wc.pack_frames = False
+
+    times = iter(['20170314T23580{}'.format(i) for i in range(3)] + ['20170315T000000'])
+    monkeypatch.setattr(webcam, 'current_time', lambda flatten=False: next(times))
+
+    for _ in range(4):
+        assert wc.capture()['out_fn']
+
+    wc.close()
+
+    # The images of the movie are removed with their stats
+    assert os.path.exists('{}/20170314_video0.mp4'.format(webcam_dir))
+    assert os.listdir('{}/20170314'.format(webcam_dir)) == []
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+def test_timelapse_rollover_in_background(webcam_dir, tmpdir, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+
+    sample = str(tmpdir.join('sample.jpeg'))
+    Image.new('RGB', (64, 48), (10, 100, 200)).save(sample, 'JPEG')
+
+    wc = make_webcam(tmpdir, 'video0', sleep=0, save='cp {}'.format(sample), ffmpeg=shutil.which('ffmpeg'))
+    wc.pack_frames = False
+
+    times = iter(['20170314T235800', '20170315T000000'])
+    monkeypatch.setattr(webcam, 'current_time', lambda flatten=False: next(times))
+
+    # Yesterday's movie is still being finished when today's first image is taken
+    release = threading.Event()
+    finish = webcam.TimelapseEncoder.finish
+    monkeypatch.setattr(webcam.TimelapseEncoder, 'finish', lambda self: release.wait(10) and finish(self))
+
+    for _ in range(2):
+        assert wc.capture()['out_fn']
+
+    assert not os.path.exists('{}/20170314_video0.mp4'.format(webcam_dir))
+    assert len(glob('{}/20170315/*.jpeg'.format(webcam_dir))) == 1
+
+    release.set()
+    wc.close()
+
+    assert os.path.exists('{}/20170314_video0.mp4'.format(webcam_dir))
+
+
+def test_exposure(webcam_dir, tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+
+    # Dark image, gain goes up for the next capture
+    sample = str(tmpdir.join('sample.jpeg'))
+    Image.new('RGB', (640, 480), (20, 20, 20)).save(sample, 'JPEG')
+
+    wc = make_webcam(tmpdir, 'video0', sleep=0, save='cp {}'.format(sample))
+    result = wc.capture()
+
+    assert result['stats']['p50'] == pytest.approx(20, abs=1)
+    assert wc.gain == '60%'
+    assert wc.command('out.jpeg').count('gain=60%') == 1
+
+    sidecar = glob('{}/*/video0_*.json'.format(webcam_dir))
+    assert len(sidecar) == 1
+    with open(sidecar[0]) as f:
+        assert json.load(f)['gain'] == '50%'
+
+
+def test_gating(webcam_dir, tmpdir, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+
+    config = webcam.load_config()
+    config['webcam_gating'] = {'enabled': True, 'threshold': 2.0}
+    config['webcam_exposure'] = {'auto': False}
+    monkeypatch.setattr(webcam, 'load_config', lambda: config)
+
+    sample = str(tmpdir.join('sample.jpeg'))
+    pixels = np.tile(np.linspace(0, 255, 640), (480, 1)).astype(np.uint8)
+    Image.fromarray(pixels).convert('RGB').save(sample, 'JPEG')
+
+    wc = make_webcam(tmpdir, 'video0', sleep=0, save='cp {}'.format(sample))
+
+    times = iter(['20170314T0100{:02d}'.format(i) for i in range(3)])
+    monkeypatch.setattr(webcam, 'current_time', lambda flatten=False: next(times))
+
+    results = [wc.capture() for _ in range(3)]
+
+    assert [r['gate'] for r in results] == ['keep', 'drop', 'drop']
+    assert len(glob('{}/20170314/video0_*.jpeg'.format(webcam_dir))) == 1
+    assert os.readlink(results[-1]['out_fn']).endswith('video0_20170314T010000.jpeg')
+
+    stats = wc.get_stats()
+    assert stats['gate_keep'] == 1
+    assert stats['gate_drop'] == 2
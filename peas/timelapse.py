@@ -0,0 +1,450 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+from .exposure import sidecar_file
+from .pack import FramePack
+from .pack import frame_time
+
+
+def count_frames(fn, ffmpeg=None):
+    """ Number of video frames in `fn`, None if it can't be read
+
+    Every frame is decoded (to the null muxer), so a truncated or corrupt
+    movie doesn't give the full count.
+    """
+    if ffmpeg is None:
+        ffmpeg = shutil.which('ffmpeg')
+
+    cmd = [ffmpeg, '-nostdin', '-i', fn, '-map', '0:v:0', '-f', 'null', '-']
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=300)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    if proc.returncode != 0:
+        return None
+
+    frames = re.findall(r'frame=\s*(\d+)', proc.stderr.decode(errors='replace'))
+    return int(frames[-1]) if frames else None
+
+
+def count_packets(fn, ffmpeg=None):
+    """ Number of video packets in `fn`, None if it can't be read
+
+    The packets are only listed (stream copy to `framecrc`), nothing is
+    decoded, so this is cheap even for a long movie. Use `count_frames` to
+    also check that every frame decodes.
+    """
+    if ffmpeg is None:
+        ffmpeg = shutil.which('ffmpeg')
+
+    cmd = [ffmpeg, '-nostdin', '-loglevel', 'error', '-i', fn, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=300)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    if proc.returncode != 0:
+        return None
+
+    return sum(1 for line in proc.stdout.splitlines() if line.strip() and not line.startswith(b'#'))
+
+
+class TimelapseEncoder(object):
+
+    """ Timelapse movie encoded one frame at a time
+
+    A single ffmpeg process reads the JPEGs from a pipe (`image2pipe`) as
+    they are captured, so at the end of the day only the last frames are
+    left to encode and `finish` returns almost at once. The movie is written
+    to `<out_file>.part.mp4` and only renamed to `out_file`, and the frames
+    (with their `<image>.json` stats) removed, once ffmpeg exited cleanly
+    and the movie has a packet for each frame written.
+
+    Args:
+        out_file (str):         Final movie.
+        fps (int):              Frame rate of the movie, default 12.
+        remove_frames (bool):   Delete the frames once the movie is verified.
+        ffmpeg (str):           ffmpeg executable, default from `PATH`.
+        threads (int):          Encoder threads, default chosen by ffmpeg.
+    """
+
+    def __init__(self, out_file, fps=12, remove_frames=True, ffmpeg=None, threads=None, logger=None):
+        if logger is None:
+            logger = logging.getLogger('peas-timelapse')
+        self.logger = logger
+
+        if ffmpeg is None:
+            ffmpeg = shutil.which('ffmpeg')
+        self.ffmpeg = ffmpeg
+
+        self.out_file = out_file
+        self.part_file = '{}.part.mp4'.format(os.path.splitext(out_file)[0])
+        self.fps = fps
+        self.remove_frames = remove_frames
+        self.threads = threads
+
+        self.frames = list()
+        self.failed = False
+
+        self._proc = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    @property
+    def command(self):
+        threads = ['-threads', str(self.threads)] if self.threads else list()
+        return [self.ffmpeg, '-nostdin', '-y', '-loglevel', 'error',
+                '-f', 'image2pipe', '-framerate', str(self.fps), '-c:v', 'mjpeg', '-i', '-',
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p'] + threads + ['-f', 'mp4', self.part_file]
+
+    def start(self, frames=None):
+        """ Start ffmpeg, first feeding it `frames` (e.g. left from a restart) """
+        with self._lock:
+            self.logger.debug("Timelapse command: {}".format(self.command))
+            self._proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        for fn in frames or list():
+            self.add_frame(fn)
+
+    def add_frame(self, fn):
+        """ Pipe the JPEG `fn` to the encoder
+
+        Returns:
+            bool: True if the frame was written.
+        """
+        try:
+            with open(fn, 'rb') as f:
+                data = f.read()
+        except OSError as err:
+            self.logger.warning("Can't read timelapse frame {}: {}".format(fn, err))
+            return False
+
+        return self.add_data(data, fn=fn)
+
+    def add_data(self, data, fn=None):
+        """ Pipe the bytes of a JPEG to the encoder
+
+        Args:
+            data (bytes):   The JPEG.
+            fn (str):       Its file, removed with the others by `finish` if
+                `remove_frames`.
+
+        Returns:
+            bool: True if the frame was written.
+        """
+        with self._lock:
+            if self._proc is None or self.failed:
+                return False
+
+            try:
+                self._proc.stdin.write(data)
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError) as err:
+                # Keep the frames, `finish` won't verify and they stay on disk
+                self.failed = True
+                self.logger.warning("Timelapse encoder for {} stopped: {}".format(self.out_file, err))
+                return False
+
+            self.frames.append(fn)
+            return True
+
+    def finish(self, timeout=60):
+        """ Close the pipe, wait for ffmpeg and verify the movie
+
+        Returns:
+            bool: True if `out_file` holds all the frames (which are then
+                removed if `remove_frames`).
+        """
+        with self._lock:
+            proc, self._proc = self._proc, None
+            if proc is None:
+                return False
+
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.logger.warning("Timelapse encoder for {} killed after {} seconds".format(
+                    self.out_file, timeout))
+                proc.kill()
+                proc.wait()
+
+            errors = proc.stderr.read().decode(errors='replace').strip()
+            proc.stderr.close()
+
+            if len(self.frames) == 0:
+                self._remove(self.part_file)
+                return False
+
+            if proc.returncode != 0 or self.failed:
+                self.logger.warning("Timelapse encoding failed for {} ({}): {}".format(
+                    self.out_file, proc.returncode, errors))
+                return False
+
+            # ffmpeg exited cleanly with every frame piped, no need to decode them again
+            frames = count_packets(self.part_file, ffmpeg=self.ffmpeg)
+            if frames != len(self.frames):
+                self.logger.warning("Timelapse {} has {} frames, expected {}, keeping the images".format(
+                    self.part_file, frames, len(self.frames)))
+                return False
+
+            os.replace(self.part_file, self.out_file)
+            self.logger.debug("Timelapse {} written with {} frames".format(self.out_file, frames))
+
+            if self.remove_frames:
+                for fn in self.frames:
+                    if fn is not None:
+                        self._remove(fn)
+                        self._remove(sidecar_file(fn))
+
+            return True
+
+    def abort(self):
+        """ Kill ffmpeg and drop the partial movie, keeping the frames """
+        with self._lock:
+            proc, self._proc = self._proc, None
+            if proc is not None:
+                proc.kill()
+                proc.wait()
+                proc.stdin.close()
+                proc.stderr.close()
+
+            self._remove(self.part_file)
+
+    def _remove(self, fn):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            self.logger.warning("Can't remove {}: {}".format(fn, err))
+
+
+def _encode_segment(frames, out_file, fps, ffmpeg, threads):
+    """ Encode `frames` to `out_file` in a worker process, keeping the frames
+
+    Frames are image files or `(pack, i)` for frame `i` of a `FramePack`.
+    """
+    encoder = TimelapseEncoder(out_file, fps=fps, remove_frames=False, ffmpeg=ffmpeg, threads=threads)
+    encoder.start()
+
+    packs = dict()
+    for frame in frames:
+        if isinstance(frame, str):
+            encoder.add_frame(frame)
+        else:
+            path, i = frame
+            if path not in packs:
+                packs[path] = FramePack(path)
+            encoder.add_data(packs[path].read(i))
+
+    return encoder.finish(timeout=None)
+
+
+def concat(segments, out_file, ffmpeg=None):
+    """ Join movies encoded with the same settings, without re-encoding
+
+    Returns:
+        bool: True if ffmpeg succeeded.
+    """
+    if ffmpeg is None:
+        ffmpeg = shutil.which('ffmpeg')
+
+    list_file = '{}.txt'.format(os.path.splitext(out_file)[0])
+    with open(list_file, 'w') as f:
+        for fn in segments:
+            f.write("file '{}'\n".format(os.path.abspath(fn).replace("'", "'\\''")))
+
+    cmd = [ffmpeg, '-nostdin', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file,
+           '-c', 'copy', '-f', 'mp4', out_file]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    finally:
+        os.remove(list_file)
+
+
+class TimelapseBuilder(object):
+
+    """ Rebuild timelapse movies of archived days
+
+    Each day of images (`<webcam_dir>/<YYYYMMDD>/<port>_<time>.jpeg`, or
+    packed in `<port>.pack`, see `peas.pack.FramePack`) is split into
+    segments of `segment_frames` images, which are encoded in a pool of
+    processes (one encoder thread each when there are several) and then
+    joined with the concat demuxer, without re-encoding, into
+    `<webcam_dir>/<YYYYMMDD>_<port>.mp4` (the name used by
+    `peas.webcam.Webcam`). Segments of all the days share the pool, so a
+    single day is as parallel as many.
+
+    Movies newer than all of their images (and packs) are skipped.
+
+    Args:
+        webcam_dir (str):       Webcam directory.
+        fps (int):              Frame rate of the movies, default 12.
+        segment_frames (int):   Images per segment.
+        processes (int):        Encoding processes, default one per CPU.
+        remove_frames (bool):   Delete the image files (and their stats) of a movie once it is
+            verified, packs are kept.
+        ffmpeg (str):           ffmpeg executable, default from `PATH`.
+    """
+
+    def __init__(self, webcam_dir, fps=12, segment_frames=300, processes=None, remove_frames=False, ffmpeg=None,
+                 logger=None):
+        if logger is None:
+            logger = logging.getLogger('peas-timelapse')
+        self.logger = logger
+
+        if ffmpeg is None:
+            ffmpeg = shutil.which('ffmpeg')
+        self.ffmpeg = ffmpeg
+
+        self.webcam_dir = webcam_dir
+        self.fps = fps
+        self.segment_frames = segment_frames
+        self.processes = processes or os.cpu_count() or 1
+        self.remove_frames = remove_frames
+
+    def days(self):
+        """ Day directories (`YYYYMMDD`) in the webcam directory """
+        return sorted(name for name in os.listdir(self.webcam_dir)
+                      if re.match(r'^\d{8}$', name) and os.path.isdir(os.path.join(self.webcam_dir, name)))
+
+    def movies(self, day):
+        """ Frames of `day` grouped by the movie they go in
+
+        Packed frames are streamed from their pack, images not packed yet
+        are read from their files.
+
+        Returns:
+            dict: Movie file name to its frames in time order, image files
+                or `(pack, i)` for frame `i` of a pack.
+        """
+        frames = dict()
+        for path in sorted(glob(os.path.join(self.webcam_dir, day, '*.pack'))):
+            port = os.path.splitext(os.path.basename(path))[0]
+            for i, time in enumerate(FramePack(path).times):
+                frames.setdefault(port, dict())[time] = (path, i)
+
+        for fn in sorted(glob(os.path.join(self.webcam_dir, day, '*_*.jpeg'))):
+            port = os.path.basename(fn).rsplit('_', 1)[0]
+            frames.setdefault(port, dict()).setdefault(frame_time(fn), fn)
+
+        movies = dict()
+        for port, by_time in frames.items():
+            out_file = os.path.join(self.webcam_dir, '{}_{}.mp4'.format(day, port))
+            movies[out_file] = [by_time[time] for time in sorted(by_time)]
+
+        return movies
+
+    @staticmethod
+    def is_up_to_date(out_file, frames):
+        """ True if `out_file` exists and is newer than all of `frames` """
+        try:
+            built = os.stat(out_file).st_mtime
+        except FileNotFoundError:
+            return False
+
+        sources = set(fn if isinstance(fn, str) else fn[0] for fn in frames)
+        return all(os.stat(fn).st_mtime <= built for fn in sources)
+
+    def build(self, days=None, force=False):
+        """ Build the movies of `days` (default all)
+
+        Args:
+            days (list):    Day directory names, `YYYYMMDD`.
+            force (bool):   Rebuild movies that are up to date.
+
+        Returns:
+            dict: Movie file name to its number of `frames` and `skipped`,
+                or `seconds` (from the start of the build until the movie
+                was done) and `failed` if it wasn't made.
+        """
+        if days is None:
+            days = self.days()
+
+        results = dict()
+        jobs = list()
+        for day in days:
+            for out_file, frames in sorted(self.movies(day).items()):
+                if not force and self.is_up_to_date(out_file, frames):
+                    results[out_file] = {'frames': len(frames), 'skipped': True}
+                    continue
+
+                jobs.append((out_file, frames))
+
+        if len(jobs) == 0:
+            return results
+
+        # Parallel segments rather than parallel threads within x264
+        threads = 1 if self.processes > 1 else None
+
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            # Queue every segment first so the pool is never idle between movies
+            submitted = list()
+            for out_file, frames in jobs:
+                segment_dir = '{}.segments'.format(os.path.splitext(out_file)[0])
+                os.makedirs(segment_dir, exist_ok=True)
+
+                segments = list()
+                for i, first in enumerate(range(0, len(frames), self.segment_frames)):
+                    segment = os.path.join(segment_dir, 'segment_{:04d}.mp4'.format(i))
+                    future = pool.submit(_encode_segment, frames[first:first + self.segment_frames], segment,
+                                         self.fps, self.ffmpeg, threads)
+                    segments.append((segment, future))
+
+                submitted.append((out_file, frames, segment_dir, segments))
+
+            for out_file, frames, segment_dir, segments in submitted:
+                results[out_file] = self._join(out_file, frames, segment_dir, segments)
+                results[out_file].setdefault('seconds', time.time() - start)
+
+        return results
+
+    def _join(self, out_file, frames, segment_dir, segments):
+        try:
+            if not all(future.result() for _, future in segments):
+                self.logger.warning("Segment encoding failed for {}".format(out_file))
+                return {'frames': len(frames), 'failed': True}
+
+            # The segments were checked by the workers, the joined movie is
+            # checked the same way
+            part_file = '{}.part.mp4'.format(os.path.splitext(out_file)[0])
+            if not concat([segment for segment, _ in segments], part_file, ffmpeg=self.ffmpeg) or \
+                    count_packets(part_file, ffmpeg=self.ffmpeg) != len(frames):
+                self.logger.warning("Joining the segments of {} failed".format(out_file))
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+                return {'frames': len(frames), 'failed': True}
+
+            os.replace(part_file, out_file)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+        if self.remove_frames:
+            for fn in frames:
+                if isinstance(fn, str):
+                    os.remove(fn)
+                    try:
+                        os.remove(sidecar_file(fn))
+                    except FileNotFoundError:
+                        pass
+
+        return {'frames': len(frames)}
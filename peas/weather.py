@@ -12,15 +12,13 @@ from dateutil.parser import parse as date_parser
 
 import astropy.units as u
 
-from pocs.utils.messaging import PanMessaging
-
 from . import load_config
+from .conditions import add_codes
+from .messaging import channel_encoding
+from .messaging import get_publisher
 from .PID import PID
-
-
-def get_mongodb():
-    from pocs.utils.database import PanMongo
-    return PanMongo()
+from .spool import get_spool
+from .store import get_store
 
 
 def movingaverage(interval, window_size):
@@ -111,9 +109,10 @@ class AAGCloudSensor(object):
 
         self.safety_delay = self.cfg.get('safety_delay', 15.)
 
-        self.db = None
+        # Mongo writes go through the local spool, see `peas.spool`
+        self.spool = None
         if use_mongo:
-            self.db = get_mongodb()
+            self.spool = get_spool(self.config)
 
         self.messaging = None
 
@@ -252,15 +251,7 @@ class AAGCloudSensor(object):
 
     def get_reading(self):
         """ Calls commands to be performed each time through the loop """
-        weather_data = dict()
-
-        if self.db is None:
-            self.db = get_mongodb()
-        else:
-            weather_data = self.update_weather()
-            self.calculate_and_set_PWM()
-
-        return weather_data
+        return self.capture(use_mongo=True)
 
     def send(self, send, delay=0.100):
 
@@ -605,12 +596,19 @@ class AAGCloudSensor(object):
 
     def send_message(self, msg, channel='weather'):
         if self.messaging is None:
-            self.messaging = PanMessaging.create_publisher(6510)
+            self.messaging = get_publisher(self.config)
+
+        self.messaging.send_message(channel, msg, encoding=channel_encoding(self.config, channel))
 
-        self.messaging.send_message(channel, msg)
+    def capture(self, use_mongo=False, send_message=False, use_store=False, **kwargs):
+        """ Query the CloudWatcher
 
-    def capture(self, use_mongo=False, send_message=False, **kwargs):
-        """ Query the CloudWatcher """
+        Args:
+            use_mongo (bool):       Insert the reading into mongo.
+            send_message (bool):    Publish the reading on the 'weather' channel.
+            use_store (bool):       Append the reading to the local column store
+                (see `peas.store`).
+        """
 
         self.logger.debug("Updating weather")
 
@@ -648,6 +646,9 @@ class AAGCloudSensor(object):
         data['gust_condition'] = self.safe_dict['Gust']
         data['rain_condition'] = self.safe_dict['Rain']
 
+        # Integer codes of the conditions, see `peas.conditions`
+        add_codes(data)
+
         # Store current weather
         data['date'] = dt.utcnow()
         self.weather_entries.append(data)
@@ -662,7 +663,12 @@ class AAGCloudSensor(object):
             self.send_message({'data': data}, channel='weather')
 
         if use_mongo:
-            self.db.insert_current('weather', data)
+            if self.spool is None:
+                self.spool = get_spool(self.config)
+            self.spool.append('weather', data)
+
+        if use_store:
+            get_store(self.config).append('weather', data)
 
         return data
 
@@ -1,8 +1,10 @@
+import asyncio
 import os
 import os.path
 import shutil
 import subprocess
-import sys
+import threading
+import time
 
 from glob import glob
 
@@ -10,6 +12,21 @@ from pocs.utils import current_time
 from pocs.utils.logger import get_root_logger
 
 from . import load_config
+from .exposure import ExposureController
+from .exposure import image_stats
+from .exposure import load_small
+from .exposure import sidecar_file
+from .exposure import write_sidecar
+from .gating import DROP
+from .gating import KEEP
+from .gating import REDUCE
+from .gating import FrameGate
+from .gating import reduce_quality
+from .pack import FramePack
+from .pack import pack_file
+from .preview import get_preview_service
+from .preview import replace_symlink
+from .timelapse import TimelapseEncoder
 
 
 class Webcam(object):
@@ -29,8 +46,13 @@ class Webcam(object):
             in skycam.c
 
     Note:
-            TODO: The images then have their flux measured and the gain and brightness
-            adjusted accordingly. Images analysis is stored in the (mongo) database
+            The images then have their levels measured (see `peas.exposure`), stored
+            next to the image as `<image>.json`, and the gain and brightness adjusted
+            accordingly unless `webcam_exposure.auto` is off in the config.
+
+    Note:
+            With `webcam_gating.enabled` in the config, images hardly different from
+            the last one kept are dropped or stored at a lower quality (see `peas.gating`).
 
     Args:
             webcam (dict):      Config options for the camera, required.
@@ -39,14 +61,20 @@ class Webcam(object):
             brightness (str):   Initial camera brightness. Default "50%"
             gain (str):         Initial camera gain. Default "50%"
             delay (int):        Time to wait between captures. Default 60 (seconds)
+            timeout (float):    Seconds before a capture is killed, default the
+                `timeout` of the webcam config or 120.
     """
 
-    def __init__(self, webcam_config, frames=255, resolution="1600x1200", brightness="50%", gain="50%"):
+    def __init__(self, webcam_config, frames=255, resolution="1600x1200", brightness="50%", gain="50%",
+                 timeout=None):
 
         self.config = load_config()
         self.logger = get_root_logger()
 
         self._today_dir = None
+        self._encoder = None
+        self._packer = None
+        self._finisher = None
 
         self.webcam_dir = self.config['directories'].get('webcam', '/var/panoptes/webcams/')
         assert os.path.exists(self.webcam_dir), self.logger.warning(
@@ -67,21 +95,111 @@ class Webcam(object):
         # Command for taking pics
         self.cmd = shutil.which('fswebcam')
 
+        # Timelapse of each day, encoded as the images come in
+        self.timelapse_fps = self.webcam_config.get('timelapse_fps', 12)
+        self.ffmpeg = shutil.which('ffmpeg')
+        if self.ffmpeg is None:
+            self.logger.warning("ffmpeg not found, no timelapse for {}".format(self.name))
+
+        # Pack the images of each day into one file at the end of the day
+        # (see `peas.pack.FramePack`) rather than deleting them
+        self.pack_frames = self.webcam_config.get('pack_frames', True)
+
         # Defaults
         self._timestamp = "%Y-%m-%d %H:%M:%S"
-        self._thumbnail_resolution = '240x120'
 
-        # Create the string for the params
-        self.base_params = "-F {} -r {} --set brightness={} --set gain={} --jpeg 100 --timestamp \"{}\" ".format(
-            frames, resolution, brightness, gain, self._timestamp)
+        # Thumbnail and other previews of the latest image, made off the capture path
+        self.previews = get_preview_service(self.config)
+
+        self.frames = frames
+        self.resolution = resolution
+        self.brightness = brightness
+        self.gain = gain
+
+        # Gain and brightness of the next capture from the levels of the last one
+        exposure_config = dict(self.config.get('webcam_exposure', dict()) or dict())
+        self.exposure = None
+        if exposure_config.pop('auto', True):
+            self.exposure = ExposureController(brightness=brightness, gain=gain, **exposure_config)
+
+        # Skip storing images that hardly changed
+        gating_config = dict(self.config.get('webcam_gating', dict()) or dict())
+        self.gate = None
+        if gating_config.pop('enabled', False):
+            self.gate = FrameGate(**gating_config)
+
+        if timeout is None:
+            timeout = self.webcam_config.get('timeout', 120)
+        self.timeout = timeout
+
+        self.stats = {
+            'captures': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'last_duration': None,
+            'max_duration': 0.,
+            'total_duration': 0.,
+        }
+        self._stats_lock = threading.Lock()
 
         self.logger.info("{} created".format(self.name))
 
+    @property
+    def base_params(self):
+        """ fswebcam arguments common to all captures """
+        return ['-F', str(self.frames), '-r', self.resolution,
+                '--set', 'brightness={}'.format(self.brightness),
+                '--set', 'gain={}'.format(self.gain),
+                '--jpeg', '100', '--timestamp', self._timestamp]
+
+    def command(self, out_file):
+        """ fswebcam argv saving the image to `out_file` """
+        webcam = self.webcam_config
+
+        options = list()
+        for opt, val in webcam.get('params', dict()).items():
+            options.append("--{}={}".format(opt, val))
+
+        return [self.cmd, '-d', webcam.get('port'), '--title', webcam.get('name')] + self.base_params + options + \
+            ['--save', out_file]
+
+    def get_stats(self):
+        """ Copy of the capture counts and durations (seconds)
+
+        With gating, also the number of images kept, reduced and dropped
+        (`gate_keep`, `gate_reduce`, `gate_drop`).
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+            if self.gate is not None:
+                stats.update({'gate_{}'.format(decision): count for decision, count in self.gate.counts.items()})
+
+            return stats
+
+    def _record(self, duration, returncode=None, timed_out=False):
+        with self._stats_lock:
+            self.stats['captures'] += 1
+            if timed_out:
+                self.stats['timeouts'] += 1
+            elif returncode != 0:
+                self.stats['failures'] += 1
+
+            self.stats['last_duration'] = duration
+            self.stats['max_duration'] = max(self.stats['max_duration'], duration)
+            self.stats['total_duration'] += duration
+
     def capture(self):
+        """ Capture an image from a webcam, see `capture_async` """
+        return run_async(self.capture_async())
+
+    async def capture_async(self):
         """ Capture an image from a webcam
 
         Given a webcam, this attempts to capture an image using the subprocess
-        command. Also creates a thumbnail of the image
+        command. The thumbnail and other previews of the image are then made
+        by `peas.preview.PreviewService` in the background. fswebcam runs as an
+        asyncio subprocess so several cameras can be captured at once (see
+        `capture_all`); it is killed if it takes longer than `timeout`.
 
         Args:
             webcam (dict): Entry for the webcam. Example::
@@ -94,6 +212,10 @@ class Webcam(object):
                 }
 
             The values for the `params` key will be passed directly to fswebcam
+
+        Returns:
+            dict: `out_fn`, the latest image link (empty if the capture
+                failed), and the capture `duration` in seconds.
         """
         webcam = self.webcam_config
 
@@ -102,6 +224,7 @@ class Webcam(object):
         self.logger.debug("Capturing image for {}...".format(webcam.get('name')))
 
         camera_name = self.port_name
+        loop = asyncio.get_event_loop()
 
         # Create the directory for storing images
         timestamp = current_time(flatten=True)
@@ -111,18 +234,18 @@ class Webcam(object):
         try:
 
             if today_path != self._today_dir:
-                # If yesterday is not None, archive it
-                if self._today_dir is not None:
-                    self.logger.debug("Making timelapse for webcam")
-                    self.create_timelapse(
-                        self._today_dir, out_file="{}/{}_{}.mp4".format(self.webcam_dir, today_dir, self.port_name),
-                        remove_after=True)
-
                 # If today doesn't exist, make it
                 if not os.path.exists(today_path):
                     self.logger.debug("Making directory for day's webcam")
                     os.makedirs(today_path, exist_ok=True)
-                    self._today_dir = today_path
+
+                yesterday_path, self._today_dir = self._today_dir, today_path
+
+                # Finish yesterday's timelapse and start today's
+                await loop.run_in_executor(None, self._start_timelapse, today_path)
+
+                if yesterday_path is not None and self.pack_frames:
+                    self._pack_in_background(yesterday_path)
 
         except OSError as err:
             self.logger.warning("Cannot create new dir: {} \t {}".format(today_path, err))
@@ -130,67 +253,175 @@ class Webcam(object):
         # Output file names
         out_file = '{}/{}_{}.jpeg'.format(today_path, camera_name, timestamp)
 
-        # We also create a thumbnail and always link it to the same image
-        # name so that it is always current.
-        thumbnail_file = '{}/tn_{}.jpeg'.format(self.webcam_dir, camera_name)
-
-        options = self.base_params
-        if 'params' in webcam:
-            for opt, val in webcam.get('params').items():
-                options += "--{}={}".format(opt, val)
-
-        # Assemble all the parameters
-        params = " -d {} --title \"{}\" {} --save {} --scale {} {}".format(
-            webcam.get('port'),
-            webcam.get('name'),
-            options,
-            out_file,
-            self._thumbnail_resolution,
-            thumbnail_file
-        )
+        cmd = self.command(out_file)
 
         static_out_file = ''
+        levels = None
+        decision = None
+        returncode = None
+        timed_out = False
 
-        # Actually call the command.
-        # NOTE: This is a blocking call (within this process). See `start_capturing`
+        start = time.monotonic()
         try:
-            self.logger.debug("Webcam subproccess command: {} {}".format(self.cmd, params))
-
-            with open(os.devnull, 'w') as devnull:
-                retcode = subprocess.call(self.cmd + params, shell=True, stdout=devnull, stderr=devnull)
-
-            if retcode < 0:
-                self.logger.warning(
-                    "Image captured terminated for {}. Return code: {} \t Error: {}".format(
-                        webcam.get('name'),
-                        retcode,
-                        sys.stderr
-                    )
-                )
-            else:
+            self.logger.debug("Webcam subproccess command: {}".format(cmd))
+
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            try:
+                returncode = await asyncio.wait_for(proc.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                proc.kill()
+                await proc.wait()
+                self.logger.warning("Image capture for {} killed after {} seconds".format(
+                    webcam.get('name'), self.timeout))
+
+            if returncode is not None and returncode != 0:
+                self.logger.warning("Image captured terminated for {}. Return code: {}".format(
+                    webcam.get('name'), returncode))
+            elif returncode == 0:
                 self.logger.debug("Image captured for {}".format(webcam.get('name')))
 
-                # Static files (always points to most recent)
+                levels, decision = await loop.run_in_executor(None, self.analyse, out_file)
+
+                # Static file (always points to most recent kept)
                 static_out_file = '{}/{}.jpeg'.format(self.webcam_dir, camera_name)
-                static_tn_out_file = '{}/tn_{}.jpeg'.format(self.webcam_dir, camera_name)
 
-                # Symlink the latest image and thumbnail
-                if os.path.lexists(static_out_file):
-                    os.remove(static_out_file)
-                os.symlink(out_file, static_out_file)
+                if decision != DROP:
+                    replace_symlink(out_file, static_out_file)
 
-                if os.path.lexists(static_tn_out_file):
-                    os.remove(static_tn_out_file)
-                os.symlink(out_file, static_tn_out_file)
+                    # Previews are written to `<preview>_<camera>.jpeg`, e.g. `tn_video0.jpeg`
+                    self.previews.submit(out_file, self.webcam_dir, camera_name)
 
-                return retcode
+                    if self._encoder is not None:
+                        await loop.run_in_executor(None, self._encoder.add_frame, out_file)
         except OSError as e:
-            self.logger.warning("Execution failed:".format(e, file=sys.stderr))
+            self.logger.warning("Execution failed: {}".format(e))
+
+        duration = time.monotonic() - start
+        self._record(duration, returncode=returncode, timed_out=timed_out)
+
+        return {'out_fn': static_out_file, 'duration': duration, 'stats': levels, 'gate': decision}
+
+    def analyse(self, out_file):
+        """ Measure the levels of a capture and set the exposure of the next one
+
+        With gating the image is then dropped (removed), stored at a lower
+        quality or kept as is. The stats, the settings used and the gating
+        decision are written to `<image>.json`.
+
+        Returns:
+            tuple: The stats (see `peas.exposure.image_stats`, None if the
+                image can't be read) and the gating decision.
+        """
+        try:
+            pixels = load_small(out_file)
+            stats = image_stats(pixels)
+        except Exception as e:
+            self.logger.warning("Can't measure {}: {}".format(out_file, e))
+            return None, KEEP
+
+        record = {'stats': stats, 'brightness': self.brightness, 'gain': self.gain}
+
+        decision = KEEP
+        if self.gate is not None:
+            decision, change = self.gate.check(pixels, time.time())
+            record['gate'] = decision
+            record['difference'] = None if change == float('inf') else change
+
+        if self.exposure is not None:
+            settings = self.exposure.update(stats)
+            self.brightness = '{}%'.format(settings['brightness'])
+            self.gain = '{}%'.format(settings['gain'])
+
+        try:
+            if decision == DROP:
+                os.remove(out_file)
+            else:
+                if decision == REDUCE:
+                    reduce_quality(out_file, self.gate.quality)
+                write_sidecar(out_file, record)
+        except Exception as e:
+            self.logger.warning("Can't store {}: {}".format(out_file, e))
+
+        return stats, decision
+
+    def close(self):
+        """ Stop the timelapse encoder and wait for any finishing or packing
+
+        The partial movie is dropped but the images are kept, so the
+        timelapse is rebuilt from them when capturing starts again that day.
+        A previous day's movie still being finished is waited for.
+        """
+        if self._encoder is not None:
+            self._encoder.abort()
+            self._encoder = None
+
+        if self._finisher is not None:
+            self._finisher.join()
+            self._finisher = None
 
-        return {'out_fn': static_out_file}
+        if self._packer is not None:
+            self._packer.join()
+            self._packer = None
+
+    def pack(self, directory):
+        """ Move the images of the day `directory` into its `FramePack` """
+        pack = FramePack(pack_file(directory, self.port_name))
+        try:
+            added = pack.append(self._frames(directory), remove=True)
+        except (OSError, ValueError) as err:
+            self.logger.warning("Can't pack {}: {}".format(directory, err))
+            return 0
+
+        self.logger.debug("Packed {} images into {}".format(added, pack.path))
+        return added
+
+    def _pack_in_background(self, directory):
+        # Reading and writing a day of images takes a while, keep capturing meanwhile
+        if self._packer is not None:
+            self._packer.join()
+
+        self._packer = threading.Thread(target=self.pack, args=(directory,),
+                                        name='peas-pack-{}'.format(self.port_name), daemon=True)
+        self._packer.start()
+
+    def _finish_in_background(self, encoder):
+        # Waiting for ffmpeg and checking the movie would delay the first capture of the day
+        if self._finisher is not None:
+            self._finisher.join()
+
+        self._finisher = threading.Thread(target=encoder.finish,
+                                          name='peas-timelapse-{}'.format(self.port_name), daemon=True)
+        self._finisher.start()
+
+    def _frames(self, directory):
+        return sorted(glob('{}/{}_*.jpeg'.format(directory, self.port_name)))
+
+    def _start_timelapse(self, directory):
+        """ Finish the running timelapse and start one for the day `directory` """
+        if self._encoder is not None:
+            self.logger.debug("Finishing timelapse for webcam")
+            self._finish_in_background(self._encoder)
+            self._encoder = None
+
+        if self.ffmpeg is None:
+            return
+
+        out_file = '{}/{}_{}.mp4'.format(self.webcam_dir, os.path.basename(directory), self.port_name)
+        self._encoder = TimelapseEncoder(out_file, fps=self.timelapse_fps, remove_frames=not self.pack_frames,
+                                         ffmpeg=self.ffmpeg, logger=self.logger)
+
+        # Images already there, e.g. after a restart
+        self._encoder.start(frames=self._frames(directory))
 
     def create_timelapse(self, directory, fps=12, out_file=None, remove_after=False):
-        """ Create a timelapse movie for the given directory """
+        """ Create a timelapse movie for the given directory in one go
+
+        Captures use `TimelapseEncoder` instead, this is for rebuilding a day
+        from its images.
+        """
         assert os.path.exists(directory), self.logger.warning("Directory does not exist: {}".format(directory))
         ffmpeg_cmd = shutil.which('ffmpeg')
 
@@ -199,7 +430,8 @@ class Webcam(object):
             out_file = '{}/{}.mp4'.format(directory, out_file)
 
         cmd = [ffmpeg_cmd, '-f', 'image2', '-r', str(fps), '-pattern_type', 'glob',
-               '-i', '{}{}*.jpeg'.format(directory, self.port_name), '-c:v', 'libx264', '-pix_fmt', 'yuv420p', out_file]
+               '-i', '{}/{}_*.jpeg'.format(directory, self.port_name), '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+               out_file]
 
         self.logger.debug("Timelapse command: {}".format(cmd))
         try:
@@ -209,5 +441,80 @@ class Webcam(object):
 
         if remove_after:
             self.logger.debug("Removing all images files")
-            for f in glob('{}{}*.jpeg'.format(directory, self.port_name)):
+            for f in self._frames(directory):
                 os.remove(f)
+                if os.path.exists(sidecar_file(f)):
+                    os.remove(sidecar_file(f))
+
+
+def run_async(coroutine):
+    """ Run `coroutine` to completion in a new event loop
+
+    The capture thread has no event loop of its own, so one is made for each
+    call and closed afterwards.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def capture_all(webcams):
+    """ Capture all of `webcams` at once
+
+    The fswebcam processes run side by side, so this takes as long as the
+    slowest camera rather than the sum of all of them.
+
+    Returns:
+        list: Result of `Webcam.capture_async` for each webcam, or the
+            exception it raised.
+    """
+    async def _gather():
+        return await asyncio.gather(*[wc.capture_async() for wc in webcams], return_exceptions=True)
+
+    if len(webcams) == 0:
+        return list()
+
+    return run_async(_gather())
+
+
+class Webcams(object):
+
+    """ The webcams of the config that are plugged in, captured together
+
+    Args:
+        config (list): The `webcams` section of the config, one dict per camera.
+    """
+
+    def __init__(self, config):
+        self.webcams = list()
+        self.config = config
+
+        for webcam in self.config:
+            # Create the webcam
+            if os.path.exists(webcam.get('port')):
+                self.webcams.append(Webcam(webcam))
+
+    def capture(self, **kwargs):
+        """ All cameras at once, see `capture_all`
+
+        Raises:
+            RuntimeError: If any camera failed, once all of them are done.
+        """
+        results = capture_all(self.webcams)
+
+        failed = [wc.name for wc, result in zip(self.webcams, results)
+                  if isinstance(result, Exception) or not result['out_fn']]
+        if failed:
+            raise RuntimeError("Capture failed for {}".format(', '.join(failed)))
+
+        return results
+
+    def get_stats(self):
+        """ `Webcam.get_stats` of each camera, by name """
+        return {wc.name: wc.get_stats() for wc in self.webcams}
+
+    def close(self):
+        for wc in self.webcams:
+            wc.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+
+from peas.codec import BlockReader
+from peas.codec import BlockWriter
+from peas.export import read_export
+from peas.store import flatten
+
+
+def synthetic_weather(days=7, cadence=30):
+    """ Weather-like records at `cadence` seconds, used when no export is given """
+    rng = np.random.RandomState(42)
+    num = int(days * 86400 / cadence)
+    start = dt(2017, 3, 1)
+
+    ambient = 15 + np.cumsum(rng.normal(0, 0.02, num))
+    sky = ambient - 30 + np.cumsum(rng.normal(0, 0.05, num))
+    wind = np.abs(np.cumsum(rng.normal(0, 0.3, num))) % 40
+
+    docs = list()
+    for i in range(num):
+        docs.append({'date': start + tdelta(seconds=i * cadence + rng.randint(0, 400) / 1000.), 'data': {
+            'ambient_temp_C': round(float(ambient[i]), 2),
+            'sky_temp_C': round(float(sky[i]), 2),
+            'rain_frequency': float(2600 - (rng.rand() < 0.01) * 200),
+            'wind_speed_KPH': round(float(wind[i]), 1),
+            'rain_sensor_temp_C': '{:.02f}'.format(ambient[i] + 5),
+            'pwm_value': 14.66,
+            'safe': bool(sky[i] - ambient[i] < -25),
+            'sky_condition': 'Clear' if sky[i] - ambient[i] < -25 else 'Cloudy',
+            'wind_condition': 'Calm' if wind[i] < 10 else 'Windy',
+            'gust_condition': 'Calm' if wind[i] < 10 else 'Gusty',
+            'rain_condition': 'Dry',
+        }})
+
+    return docs
+
+
+def to_columns(docs):
+    rows = [flatten(doc.get('data', doc)) for doc in docs]
+    dates = np.array([doc['date'] for doc in docs], dtype='M8[us]')
+
+    names = sorted(set(name for row in rows for name, value in row.items()
+                       if isinstance(value, (int, float)) and name != 'date'))
+    columns = {name: np.array([row.get(name, np.nan) for row in rows], dtype='<f8') for name in names}
+
+    order = np.argsort(dates, kind='mergesort')
+    return dates[order], {name: values[order] for name, values in columns.items()}
+
+
+def timed(func, number=3):
+    start = time.time()
+    for _ in range(number):
+        result = func()
+    return (time.time() - start) / number, result
+
+
+def main(files=None, block_size=1024, **kwargs):
+    if files:
+        docs = [doc for fn in files for doc in read_export(fn)]
+    else:
+        docs = synthetic_weather()
+
+    dates, columns = to_columns(docs)
+    print('{} records, {} numeric columns'.format(len(dates), len(columns)))
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_codec_') as tmp_dir:
+        json_fn = os.path.join(tmp_dir, 'export.json.gz')
+        codec_fn = os.path.join(tmp_dir, 'export.grl')
+
+        with gzip.open(json_fn, 'wt') as f:
+            for doc in docs:
+                f.write(json.dumps(doc, default=str) + '\n')
+
+        encode_time, _ = timed(lambda: _write(codec_fn, dates, columns, block_size), 1)
+
+        def read_json():
+            with gzip.open(json_fn, 'rt') as f:
+                return [json.loads(line) for line in f]
+
+        reader = BlockReader(codec_fn)
+        json_time, _ = timed(read_json)
+        codec_time, _ = timed(reader.read)
+
+        hour_start = dates[len(dates) // 2].astype(object)
+        hour_end = hour_start + tdelta(hours=1)
+        range_time, data = timed(lambda: reader.read(start=hour_start, end=hour_end, columns=sorted(columns)[:1]))
+
+        raw_bytes = dates.nbytes + sum(values.nbytes for values in columns.values())
+
+        print('  {:28s} {:>12s} {:>12s}'.format('', 'bytes', 'read (ms)'))
+        print('  {:28s} {:12d} {:>12s}'.format('raw float64 columns', raw_bytes, '-'))
+        print('  {:28s} {:12d} {:12.1f}'.format('gzip json lines', os.path.getsize(json_fn), 1e3 * json_time))
+        print('  {:28s} {:12d} {:12.1f}'.format('gorilla blocks', os.path.getsize(codec_fn), 1e3 * codec_time))
+        print('  {:28s} {:>12s} {:12.1f}  ({} rows, {} of {} blocks)'.format(
+            'gorilla 1 hour, 1 column', '-', 1e3 * range_time, len(data['date']),
+            len(reader.select_blocks(start=hour_start, end=hour_end)), len(reader.blocks)))
+        print('  encode: {:.1f} ms'.format(1e3 * encode_time))
+
+
+def _write(fn, dates, columns, block_size):
+    with BlockWriter(fn, sorted(columns), block_size=block_size) as writer:
+        writer.write(dates, columns)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the block codec with gzip json exports.")
+    parser.add_argument('files', nargs='*', help="Mongo export files (json or json.gz), default synthetic weather")
+    parser.add_argument('--block-size', default=1024, type=int, dest='block_size', help="Rows per block")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import time
+
+import pandas as pd
+
+from astropy.table import Table
+
+from benchmark_codec import synthetic_weather
+
+from peas.export import read_export
+from peas.tables import WEATHER_COLUMNS
+from peas.tables import columns_from_documents
+from peas.tables import table_from_columns
+
+
+def rowwise_table(docs):
+    """ The previous `WeatherPlotter.get_table_data`, one `add_row` per document """
+    col_names = [name for name, _ in WEATHER_COLUMNS] + ['date']
+    col_dtypes = [dtype for _, dtype in WEATHER_COLUMNS] + ['O']
+
+    table = Table(names=col_names, dtype=col_dtypes)
+    for entry in docs:
+        pd.to_datetime(pd.Series(entry['date']))
+        data = {'date': pd.to_datetime(entry['date'])}
+        for key, val in entry['data'].items():
+            if key in col_names and key != 'date':
+                data[key] = val
+        table.add_row(data)
+
+    table.sort('date')
+    return table
+
+
+def columnar_table(docs):
+    return table_from_columns(columns_from_documents(docs))
+
+
+def timed(func, docs):
+    start = time.time()
+    table = func(docs)
+    return time.time() - start, table
+
+
+def main(files=None, days=(1, 7), skip_rowwise=False, **kwargs):
+    if files:
+        samples = [('export', [doc for fn in files for doc in read_export(fn)])]
+    else:
+        samples = [('{} day'.format(num), synthetic_weather(days=num, cadence=30)) for num in days]
+
+    print('  {:10s} {:>8s} {:>14s} {:>14s} {:>8s}'.format('', 'rows', 'add_row (s)', 'columnar (s)', 'speedup'))
+    for label, docs in samples:
+        columnar_time, table = timed(columnar_table, docs)
+        assert len(table) == len(docs)
+
+        if skip_rowwise:
+            print('  {:10s} {:8d} {:>14s} {:14.3f} {:>8s}'.format(label, len(docs), '-', columnar_time, '-'))
+            continue
+
+        rowwise_time, _ = timed(rowwise_table, docs)
+        print('  {:10s} {:8d} {:14.3f} {:14.3f} {:7.0f}x'.format(
+            label, len(docs), rowwise_time, columnar_time, rowwise_time / columnar_time))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare row-wise and columnar weather table loading.")
+    parser.add_argument('files', nargs='*', help="Mongo export files (json or json.gz), default synthetic weather")
+    parser.add_argument('--skip-rowwise', action='store_true', dest='skip_rowwise',
+                        help="Only time the columnar loader")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import timeit
+
+from datetime import datetime as dt
+
+from peas import messaging
+from peas.export import read_export
+
+# Representative records as produced by `AAGCloudSensor.capture` and
+# `ArduinoSerialMonitor.capture`, used when no export file is given.
+SAMPLE_WEATHER = {
+    'weather_sensor_name': 'CloudWatcher',
+    'weather_sensor_firmware_version': '5.89',
+    'weather_sensor_serial_number': '1234',
+    'sky_temp_C': -24.83,
+    'ambient_temp_C': 17.72,
+    'internal_voltage_V': 5.14,
+    'ldr_resistance_Ohm': 2541.3,
+    'rain_sensor_temp_C': '22.61',
+    'rain_frequency': 2596.0,
+    'pwm_value': 14.66,
+    'errors': {'error_1': '0', 'error_2': '0', 'error_3': '0', 'error_4': '0'},
+    'wind_speed_KPH': 12.1,
+    'safe': True,
+    'sky_condition': 'Clear',
+    'wind_condition': 'Calm',
+    'gust_condition': 'Calm',
+    'rain_condition': 'Dry',
+    'date': dt(2017, 3, 14, 10, 23, 54, 120000),
+}
+
+SAMPLE_ENVIRONMENT = {
+    'telemetry_board': {
+        'name': 'telemetry_board',
+        'count': 33412,
+        'temp_00': 21.5,
+        'humidity': 51.3,
+        'temperature': [21.37, 21.12, 20.87],
+        'current': {'main': 389, 'fan': 122, 'mount': 0, 'cameras': 1021},
+        'power': {'computer': 1, 'fan': 1, 'mount': 1, 'cameras': 1, 'weather': 1},
+        'date': dt(2017, 3, 14, 10, 23, 55, 10000),
+    },
+    'camera_board': {
+        'name': 'camera_board',
+        'count': 33401,
+        'humidity': 48.9,
+        'temp_00': 22.1,
+        'temperature': [22.06],
+        'accelerometer': {'x': -0.0123, 'y': 0.9874, 'z': 0.0412, 'o': 6},
+        'date': dt(2017, 3, 14, 10, 23, 55, 204000),
+    },
+}
+
+
+def load_records(fn, limit=1000):
+    """ Load the `data` of each document from a mongo export file """
+    return [{'data': doc.get('data', doc)} for doc in read_export(fn, limit=limit)]
+
+
+def benchmark(name, records, number=20):
+    print('{} ({} records)'.format(name, len(records)))
+    print('  {:18s} {:>12s} {:>12s} {:>10s}'.format('encoding', 'encode (us)', 'decode (us)', 'bytes'))
+
+    for label, encoding, float32 in [('json', 'json', False),
+                                     ('msgpack', 'msgpack', False),
+                                     ('msgpack float32', 'msgpack', True)]:
+        bodies = [messaging.encode(r, encoding=encoding, float32=float32) for r in records]
+
+        encode_time = timeit.timeit(
+            lambda: [messaging.encode(r, encoding=encoding, float32=float32) for r in records], number=number)
+        decode_time = timeit.timeit(lambda: [messaging.decode(b) for b in bodies], number=number)
+
+        per_msg = float(number * len(records))
+        print('  {:18s} {:12.1f} {:12.1f} {:10.1f}'.format(
+            label,
+            1e6 * encode_time / per_msg,
+            1e6 * decode_time / per_msg,
+            sum(len(b) for b in bodies) / float(len(bodies))
+        ))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare message encodings for sensor records.")
+    parser.add_argument('--weather-file', default=None, help="Mongo export (json or json.gz) of weather")
+    parser.add_argument('--environment-file', default=None, help="Mongo export (json or json.gz) of environment")
+    parser.add_argument('--limit', default=1000, type=int, help="Max records to read from each file")
+    parser.add_argument('--number', default=20, type=int, help="Number of timing repeats")
+    args = parser.parse_args()
+
+    if args.weather_file:
+        weather = load_records(args.weather_file, limit=args.limit)
+    else:
+        weather = [{'data': SAMPLE_WEATHER}] * 100
+
+    if args.environment_file:
+        environment = load_records(args.environment_file, limit=args.limit)
+    else:
+        environment = [{'data': SAMPLE_ENVIRONMENT}] * 100
+
+    benchmark('weather', weather, number=args.number)
+    benchmark('environment', environment, number=args.number)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+from datetime import datetime as dt
+from dateutil.parser import parse as date_parser
+
+from peas import load_config
+from peas.timelapse import TimelapseBuilder
+
+
+def main(start_date=None, end_date=None, webcam_dir=None, fps=12, segment_frames=300, processes=None,
+         remove_frames=False, force=False, **kwargs):
+    """ Rebuild the timelapse movies of archived days, see `peas.timelapse.TimelapseBuilder` """
+    if webcam_dir is None:
+        webcam_dir = load_config()['directories'].get('webcam', '/var/panoptes/webcams')
+
+    builder = TimelapseBuilder(webcam_dir, fps=fps, segment_frames=segment_frames, processes=processes,
+                               remove_frames=remove_frames)
+
+    days = builder.days()
+    if start_date is not None:
+        days = [day for day in days if day >= '{:%Y%m%d}'.format(date_parser(start_date))]
+    if end_date is not None:
+        days = [day for day in days if day <= '{:%Y%m%d}'.format(date_parser(end_date))]
+    else:
+        # Today's movie is still being encoded by the webcams
+        days = [day for day in days if day < '{:%Y%m%d}'.format(dt.utcnow())]
+
+    print("Building timelapses for {} days with {} processes".format(len(days), builder.processes))
+
+    start = time.time()
+    results = builder.build(days=days, force=force)
+    elapsed = time.time() - start
+
+    built = 0
+    for out_file, result in sorted(results.items()):
+        if result.get('skipped', False):
+            status = 'up to date'
+        elif result.get('failed', False):
+            status = 'FAILED'
+        else:
+            status = 'done after {:.1f}s'.format(result['seconds'])
+            built += result['frames']
+
+        print("  {:<40s} {:>6d} frames  {}".format(os.path.basename(out_file), result['frames'], status))
+
+    if built > 0:
+        print("{} frames encoded in {:.1f}s ({:.1f} frames/s)".format(built, elapsed, built / elapsed))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild webcam timelapse movies of archived days.")
+    parser.add_argument("-s", "--start-date", type=str, dest="start_date", default=None,
+                        help="[yyyy-mm-dd] First day, default the oldest")
+    parser.add_argument("-e", "--end-date", type=str, dest="end_date", default=None,
+                        help="[yyyy-mm-dd] Last day, default yesterday (UT)")
+    parser.add_argument("--webcam-dir", type=str, dest="webcam_dir", default=None,
+                        help="Webcam directory, default from the config")
+    parser.add_argument("--fps", type=int, default=12, help="Movie frame rate")
+    parser.add_argument("--segment-frames", type=int, dest="segment_frames", default=300,
+                        help="Images per segment encoded by one process")
+    parser.add_argument("--processes", type=int, default=None, help="Encoding processes, default one per CPU")
+    parser.add_argument("--remove-frames", action="store_true", dest="remove_frames", default=False,
+                        help="Delete the images once their movie is verified")
+    parser.add_argument("--force", action="store_true", default=False,
+                        help="Rebuild movies that are newer than their images")
+    args = parser.parse_args()
+
+    main(**vars(args))
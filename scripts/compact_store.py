@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+from astropy.utils import console
+
+from peas import load_config
+from peas.retention import compact
+from peas.retention import retention_ages
+from peas.retention import TIERS
+from peas.store import get_store
+
+
+def main(record_types=None, directory=None, dry_run=False, **kwargs):
+    config = load_config()
+    store = get_store(config, root=directory)
+    ages = retention_ages(config)
+
+    if not record_types:
+        suffixes = [suffix for suffix, _ in TIERS if suffix]
+        record_types = [r for r in store.record_types() if not any(r.endswith(s) for s in suffixes)]
+
+    for record_type in record_types:
+        if dry_run:
+            console.color_print("Would compact {} (raw > {} days, 1m > {} days)".format(
+                record_type, ages['raw'], ages['1m']), 'yellow')
+            continue
+
+        compacted = compact(store, record_type, ages=ages)
+        console.color_print("{:40s}".format(record_type), 'green',
+                            "{} partitions compacted".format(len(compacted)), 'blue')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact old sensor data in the local store into coarser tiers.")
+    parser.add_argument('record_types', nargs='*', help="Record types to compact, default all, e.g. weather")
+    parser.add_argument('--directory', default=None, help="Store directory, defaults to the store config")
+    parser.add_argument('--dry-run', action='store_true', default=False, dest='dry_run',
+                        help="Only list what would be compacted")
+    args = parser.parse_args()
+
+    main(**vars(args))
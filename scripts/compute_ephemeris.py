@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import time
+
+from datetime import datetime as dt
+
+from peas import load_config
+from peas.ephemeris import get_ephemeris
+
+
+def main(years=None, directory=None, **kwargs):
+    config = load_config()
+    if years is None:
+        years = [dt.utcnow().year, dt.utcnow().year + 1]
+
+    location = config.get('location', None)
+    if location is None:
+        from pocs.utils.config import load_config as pocs_config
+        location = pocs_config()['location']
+
+    ephemeris = get_ephemeris(config, location=location, directory=directory)
+    print('Site {} ({})'.format(ephemeris.site, ephemeris.directory))
+
+    for year in years:
+        start = time.time()
+        ephemeris.year(year)
+        print('  {}: {:.1f} s'.format(year, time.time() - start))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompute the sun and twilight table for the configured site.")
+    parser.add_argument('years', nargs='*', type=int, default=None, help="Years, default this year and next")
+    parser.add_argument('--directory', default=None, help="Table directory, default <directories.data>/ephemeris")
+    args = parser.parse_args()
+
+    main(years=args.years or None, directory=args.directory)
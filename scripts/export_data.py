@@ -1,28 +1,66 @@
 #!/usr/bin/env python3
 
+import os
 import warnings
+
 from astropy.utils import console
+from datetime import datetime as dt
+from datetime import timedelta as tdelta
+from dateutil.parser import parse as date_parser
 
 from pocs.utils.database import PanMongo
-from pocs.utils.google.storage import PanStorage
 
+from peas.export import Exporter
+from peas.export import LocalBackend
+from peas.export import StorageBackend
+
+
+def main(unit_id=None, upload=True, bucket='unit_sensors', database='panoptes', collections=None,
+         yesterday=True, start_date=None, end_date=None, directory=None, destination=None,
+         chunk_size=10000, processes=None, **kwargs):
+    """ Export new documents since the last run, see `peas.export.Exporter`
 
-def main(unit_id=None, upload=True, bucket='unit_sensors', **kwargs):
+    Progress is kept in `directory` so an interrupted export resumes where it
+    stopped. `start_date` only applies to collections that have never been
+    exported; `end_date` (or the end of yesterday) bounds the export.
+    """
     assert unit_id is not None, warnings.warn("Must supply PANOPTES unit id, e.g. PAN001")
 
+    if directory is None:
+        directory = os.path.join(os.getenv('PANDIR', '/var/panoptes'), 'data', 'export')
+
+    end = None
+    if end_date is not None:
+        end = date_parser(end_date) + tdelta(days=1)
+    elif yesterday and start_date is None:
+        end = dt.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if end is not None:
+        end -= tdelta(microseconds=1)
+
     console.color_print('Connecting to mongo')
-    db = PanMongo()
+    db = PanMongo(db=database)
 
-    console.color_print('Exporting data')
-    archived_files = db.export(**kwargs)
+    if destination is not None:
+        backend = LocalBackend(destination)
+    elif upload:
+        backend = StorageBackend(unit_id, bucket=bucket)
+    else:
+        backend = LocalBackend(os.path.join(directory, 'archive'))
+
+    exporter = Exporter(db, backend, directory, chunk_size=chunk_size, processes=processes)
 
-    if upload:
-        storage = PanStorage(unit_id=unit_id, bucket=bucket)
-        console.color_print("Uploading files:")
+    if start_date is not None:
+        for collection in collections:
+            if collection not in exporter.progress:
+                exporter.progress[collection] = {'date': date_parser(start_date).isoformat()}
+
+    console.color_print('Exporting data')
+    results = exporter.export(collections, end=end)
 
-        for f in archived_files:
-            r_fn = storage.upload(f)
-            console.color_print("\t{:40s}".format(f), 'green', "\t->\t", 'red', r_fn, 'blue')
+    for collection, counts in sorted(results.items()):
+        console.color_print("\t{:20s}".format(collection), 'green',
+                            "{documents} documents, {uploaded} chunks uploaded, {skipped} skipped".format(**counts),
+                            'blue')
 
 
 if __name__ == '__main__':
@@ -47,6 +85,12 @@ if __name__ == '__main__':
                         action="store_true", dest="gzip", default=True)
     parser.add_argument("-u", "--upload", action="store_true", dest="upload",
                         default=True, help="Upload to Google bucket.")
+    parser.add_argument('--directory', default=None,
+                        help="Working directory for chunks and progress, defaults to $PANDIR/data/export")
+    parser.add_argument('--destination', default=None,
+                        help="Copy chunks to this local directory instead of uploading")
+    parser.add_argument('--chunk-size', type=int, default=10000, dest='chunk_size', help="Documents per chunk")
+    parser.add_argument('--processes', type=int, default=None, help="Compression processes, default one per CPU")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose", default=False, help="Be verbose.")
 
     args = parser.parse_args()
@@ -2,6 +2,8 @@
 
 from pocs.utils.messaging import PanMessaging
 
+from peas.messaging import receive
+
 
 def main(sensor=None, watch_key=None, channel=None, port=6511, format=False, **kwargs):
     sub = PanMessaging.create_subscriber(port)
@@ -10,8 +12,8 @@ def main(sensor=None, watch_key=None, channel=None, port=6511, format=False, **k
     while True:
         data = None
         try:
-            msg_channel, msg_data = sub.receive_message()
-        except KeyError:
+            msg_channel, msg_data = receive(sub)
+        except (KeyError, ValueError):
             continue
         else:
             if msg_channel != channel:
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import os
+
+from datetime import datetime as dt
+from dateutil.parser import parse as date_parser
+from glob import glob
+
+from peas import load_config
+from peas.pack import FramePack
+from peas.pack import find_frame
+from peas.pack import pack_file
+
+
+def pack_days(webcam_dir, start_date=None, end_date=None, keep=False):
+    """ Pack the images of past days, see `peas.pack.FramePack` """
+    days = sorted(name for name in os.listdir(webcam_dir)
+                  if len(name) == 8 and name.isdigit() and os.path.isdir(os.path.join(webcam_dir, name)))
+
+    if start_date is not None:
+        days = [day for day in days if day >= '{:%Y%m%d}'.format(date_parser(start_date))]
+    if end_date is not None:
+        days = [day for day in days if day <= '{:%Y%m%d}'.format(date_parser(end_date))]
+    else:
+        # Today's images are still being captured
+        days = [day for day in days if day < '{:%Y%m%d}'.format(dt.utcnow())]
+
+    for day in days:
+        directory = os.path.join(webcam_dir, day)
+
+        ports = sorted(set(os.path.basename(fn).rsplit('_', 1)[0]
+                           for fn in glob(os.path.join(directory, '*_*.jpeg'))))
+        for port in ports:
+            pack = FramePack(pack_file(directory, port))
+            images = sorted(glob(os.path.join(directory, '{}_*.jpeg'.format(port))))
+            added = pack.append(images, remove=not keep)
+
+            print("  {} {:<10s} {:>6d} images packed, {} in pack ({:.1f} MB)".format(
+                day, port, added, len(pack), os.path.getsize(pack.path) / 1e6))
+
+
+def main(webcam_dir=None, get=None, port=None, output=None, **kwargs):
+    if webcam_dir is None:
+        webcam_dir = load_config()['directories'].get('webcam', '/var/panoptes/webcams')
+
+    if get is None:
+        pack_days(webcam_dir, **kwargs)
+        return
+
+    assert port is not None, "--port is needed with --get"
+
+    found = find_frame(webcam_dir, port, date_parser(get))
+    if found is None:
+        print("No image of {} at or before {}".format(port, get))
+        return
+
+    time, data = found
+    if output is None:
+        output = '{}_{:%Y%m%dT%H%M%S}.jpeg'.format(port, time.astype(object))
+
+    with open(output, 'wb') as f:
+        f.write(data)
+
+    print("Image of {} from {} written to {}".format(port, time, output))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack webcam images of past days, or get one back.")
+    parser.add_argument("--webcam-dir", type=str, dest="webcam_dir", default=None,
+                        help="Webcam directory, default from the config")
+    parser.add_argument("-s", "--start-date", type=str, dest="start_date", default=None,
+                        help="[yyyy-mm-dd] First day to pack, default the oldest")
+    parser.add_argument("-e", "--end-date", type=str, dest="end_date", default=None,
+                        help="[yyyy-mm-dd] Last day to pack, default yesterday (UT)")
+    parser.add_argument("--keep", action="store_true", default=False,
+                        help="Keep the images once packed")
+    parser.add_argument("--get", type=str, default=None,
+                        help="[yyyy-mm-ddThh:mm:ss] Write the last image at or before this time (UT)")
+    parser.add_argument("--port", type=str, default=None, help="Camera of --get, e.g. video0")
+    parser.add_argument("-o", "--output", type=str, default=None, help="File for --get")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -4,19 +4,39 @@ import numpy as np
 import os
 import pandas as pd
 import sys
+import tempfile
+import time
 import warnings
 import yaml
 
 from plotly import plotly
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime as dt
 from datetime import timedelta as tdelta
+from dateutil.parser import parse as date_parser
 
 from astropy.table import Table
-from astropy.time import Time
-
-from astroplan import Observer
-from astropy.coordinates import EarthLocation
+from astropy.table import vstack
+
+from peas.conditions import CONDITION_FIELDS
+from peas.conditions import Condition
+from peas.conditions import code_field
+from peas.conditions import label as condition_label
+from peas.conditions import to_codes
+from peas.decimate import minmax_indices
+from peas.decimate import time_smooth
+from peas.decimate import to_seconds
+from peas.ephemeris import get_ephemeris
+from peas.tables import day_range
+from peas.tables import get_day_cache
+from peas.tables import is_finished
+from peas.tables import load_columns
+from peas.tables import load_weather
+from peas.tables import open_columns
+from peas.tables import share_columns
+from peas.tables import split_days
+from peas.tables import table_from_columns
 
 import matplotlib as mpl
 mpl.use('Agg')
@@ -54,25 +74,22 @@ class WeatherPlotter(object):
 
     """ Plot weather information for a given time span """
 
-    def __init__(self, date_string=None, data_file=None, *args, **kwargs):
+    def __init__(self, date_string=None, data_file=None, use_cache=True, table=None, *args, **kwargs):
         super(WeatherPlotter, self).__init__()
         self.args = args
         self.kwargs = kwargs
 
         config = load_config()
+        self.config = config
         self.cfg = config['weather']['plot']
-        location_cfg = config.get('location', None)
+        self.location_cfg = config.get('location', None)
+        self.db = None
 
         self.thresholds = config['weather'].get('aag_cloud', None)
 
         if not date_string:
             self.today = True
-            self.date = dt.utcnow()
-            self.date_string = self.date.strftime('%Y%m%dUT')
-            self.start = self.date - tdelta(1, 0)
-            self.end = self.date
-            self.lhstart = self.date - tdelta(0, 60 * 60)
-            self.lhend = self.date + tdelta(0, 5 * 60)
+            self._set_today(dt.utcnow())
 
         else:
             self.today = False
@@ -83,11 +100,16 @@ class WeatherPlotter(object):
             self.end = dt(self.date.year, self.date.month, self.date.day, 23, 59, 59, 0)
         print('Creating weather plotter for {}'.format(self.date_string))
 
-        self.twilights = self.get_twilights(location_cfg)
+        self.use_cache = use_cache and not self.today and is_finished(self.date_string)
+
+        self.twilights = self.get_twilights(self.location_cfg)
 
-        self.table = self.get_table_data(data_file)
+        if table is None:
+            self.table = self.get_table_data(data_file)
+        else:
+            self.table = table
 
-        if self.table is None:
+        if self.table is None or len(self.table) == 0:
             warnings.warn("No data")
             sys.exit(0)
 
@@ -102,6 +124,23 @@ class WeatherPlotter(object):
         else:
             self.current_values = None
 
+    def _set_today(self, now):
+        """ Time range of the "today" plot, the 24 hours before `now` """
+        self.date = now
+        self.date_string = self.date.strftime('%Y%m%dUT')
+        self.start = self.date - tdelta(1, 0)
+        self.end = self.date
+        self.lhstart = self.date - tdelta(0, 60 * 60)
+        self.lhend = self.date + tdelta(0, 5 * 60)
+
+    def _title(self):
+        if self.today:
+            time_title = self.date
+        else:
+            time_title = self.end
+
+        return 'Weather for {} at {}'.format(self.date_string, time_title.strftime('%H:%M:%S UT'))
+
     def make_plot(self, output_file=None):
         # -------------------------------------------------------------------------
         # Plot a day's weather
@@ -118,6 +157,13 @@ class WeatherPlotter(object):
         self.hours_fmt = DateFormatter('%H')
         self.mins = MinuteLocator(range(0, 60, 15))
         self.mins_fmt = DateFormatter('%H:%M')
+
+        # Artists updated by `refresh`
+        self.tracked_lines = list()
+        self.dynamic_artists = list()
+        self.day_axes = list()
+        self.hour_axes = list()
+
         self.plot_positions = [([0.000, 0.835, 0.700, 0.170], [0.720, 0.835, 0.280, 0.170]),
                                ([0.000, 0.635, 0.700, 0.170], [0.720, 0.635, 0.280, 0.170]),
                                ([0.000, 0.450, 0.700, 0.170], [0.720, 0.450, 0.280, 0.170]),
@@ -133,130 +179,266 @@ class WeatherPlotter(object):
         self.plot_pwm_vs_time()
         self.save_plot(plot_filename=output_file)
 
+    def refresh(self, now=None):
+        """ Bring the "today" plot up to date without redrawing it
+
+        Only the records newer than the last one seen are fetched. Records
+        that fall out of the 24 hour window are dropped, the tracked lines
+        get their new data with `set_data`, the artists that depend on the
+        whole series (condition fills, annotations, twilights) are drawn
+        again and the axes limits are moved.
+
+        Returns:
+            int: Number of new records.
+        """
+        assert self.today and self.db is not None, "Can only refresh the today plot from mongo"
+
+        if now is None:
+            now = dt.utcnow()
+
+        last = self.time[-1].to_pydatetime()
+        self._set_today(now)
+
+        new = load_weather(self.db, last, now + tdelta(0, 60))
+        if len(new) > 0:
+            self.table = vstack([self.table, new])
+        self.table = self.table[self.table['date'] > np.datetime64(self.start)]
+        if len(self.table) == 0:
+            return 0
+
+        self.time = pd.to_datetime(self.table['date'])
+        self.current_values = self.table[-1]
+        self.twilights = self.get_twilights(self.location_cfg)
+
+        for line, data in self.tracked_lines:
+            self._set_line_data(line, *data())
+
+        for item in self.dynamic_artists:
+            draw, artists = item
+            for artist in artists:
+                artist.remove()
+            item[1] = draw()
+
+        for axes in self.day_axes:
+            axes.set_xlim(self.start, self.end)
+        for axes in self.hour_axes:
+            axes.set_xlim(self.lhstart, self.lhend)
+
+        self.title.set_text(self._title())
+
+        return len(new)
+
+    def run(self, output_file=None, interval=60):
+        """ Keep the "today" plot up to date, saving it every `interval` seconds """
+        assert self.today and self.db is not None, "Can only refresh the today plot from mongo"
+
+        self.make_plot(output_file)
+
+        while True:
+            next_save = time.monotonic() + interval
+            time.sleep(max(0, next_save - time.monotonic()))
+
+            start = time.monotonic()
+            try:
+                num_new = self.refresh()
+                refresh_time = time.monotonic() - start
+                self.save_plot(plot_filename=output_file)
+            except AssertionError:
+                raise
+            except Exception as e:
+                warnings.warn("Problem refreshing plot: {}".format(e))
+                continue
+
+            print('  {} new entries, refresh {:.0f} ms, total {:.0f} ms'.format(
+                  num_new, 1e3 * refresh_time, 1e3 * (time.monotonic() - start)))
+
     def get_table_data(self, data_file):
         """ Get the table data
 
-        If a `data_file` (csv) is passed, read from that, otherwise use mongo
+        If a `data_file` (csv) is passed, read from that, otherwise use mongo.
+        Mongo data is loaded column by column, see `peas.tables.load_weather`;
+        finished days go through the on-disk `peas.tables.DayCache`.
 
         """
         table = None
 
-        col_names = ('ambient_temp_C', 'sky_temp_C', 'sky_condition',
-                     'wind_speed_KPH', 'wind_condition',
-                     'gust_condition', 'rain_frequency',
-                     'rain_condition', 'safe', 'pwm_value',
-                     'rain_sensor_temp_C', 'date')
-
-        col_dtypes = ('f4', 'f4', 'U15',
-                      'f4', 'U15',
-                      'U15', 'f4',
-                      'U15', bool, 'f4',
-                      'f4', 'O')
-
         if data_file is not None:
             table = Table.from_pandas(pd.read_csv(data_file, parse_dates=True))
+            for field in CONDITION_FIELDS:
+                if field in table.colnames and code_field(field) not in table.colnames:
+                    table[code_field(field)] = to_codes(table[field].astype(str))
         else:
             # -------------------------------------------------------------------------
-            # Grab data from Mongo
+            # Grab data from the day cache or Mongo
             # -------------------------------------------------------------------------
-            import pymongo
             from pocs.utils.database import PanMongo
 
-            print('  Retrieving data from Mongo database')
-            db = PanMongo()
-            entries = [x for x in db.weather.find(
-                {'date': {'$gt': self.start, '$lt': self.end}}).sort([
-                    ('date', pymongo.ASCENDING)])]
-
-            table = Table(names=col_names, dtype=col_dtypes)
-
-            for entry in entries:
-                pd.to_datetime(pd.Series(entry['date']))
-                data = {'date': pd.to_datetime(entry['date'])}
-                for key, val in entry['data'].items():
-                    if key in col_names:
-                        if key != 'date':
-                            data[key] = val
-
-                table.add_row(data)
+            self.db = PanMongo()
+            if self.use_cache:
+                # Past days never change, keep them on disk
+                table = get_day_cache(self.config).load_day(self.db, self.date_string)
+            else:
+                print('  Retrieving data from Mongo database')
+                if self.today:
+                    table = load_weather(self.db, self.start, self.end)
+                else:
+                    # The same range as the cached days
+                    table = load_weather(self.db, *day_range(self.date_string))
 
         table.sort('date')
         return table
 
     def get_twilights(self, config=None):
-        """ Determine sunrise and sunset times """
+        """ Determine sunrise and sunset times
+
+        Times are looked up in the site's ephemeris table, see
+        `peas.ephemeris.Ephemeris`.
+        """
         print('  Determining sunrise, sunset, and twilight times')
 
         if config is None:
             from pocs.utils.config import load_config as pocs_config
             config = pocs_config()['location']
 
-        location = EarthLocation(
-            lat=config['latitude'],
-            lon=config['longitude'],
-            height=config['elevation'],
-        )
-        obs = Observer(location=location, name='PANOPTES',
-                       timezone=config['timezone'])
-
-        sunset = obs.sun_set_time(Time(self.start), which='next').datetime
-        sunrise = obs.sun_rise_time(Time(self.start), which='next').datetime
+        events = get_ephemeris(self.config, location=config).events(self.start)
 
         # Calculate and order twilights and set plotting alpha for each
         twilights = [(self.start, 'start', 0.0),
-                     (sunset, 'sunset', 0.0),
-                     (obs.twilight_evening_civil(Time(self.start),
-                                                 which='next').datetime, 'ec', 0.1),
-                     (obs.twilight_evening_nautical(Time(self.start),
-                                                    which='next').datetime, 'en', 0.2),
-                     (obs.twilight_evening_astronomical(Time(self.start),
-                                                        which='next').datetime, 'ea', 0.3),
-                     (obs.twilight_morning_astronomical(Time(self.start),
-                                                        which='next').datetime, 'ma', 0.5),
-                     (obs.twilight_morning_nautical(Time(self.start),
-                                                    which='next').datetime, 'mn', 0.3),
-                     (obs.twilight_morning_civil(Time(self.start),
-                                                 which='next').datetime, 'mc', 0.2),
-                     (sunrise, 'sunrise', 0.1),
+                     (events['sunset'], 'sunset', 0.0),
+                     (events['ec'], 'ec', 0.1),
+                     (events['en'], 'en', 0.2),
+                     (events['ea'], 'ea', 0.3),
+                     (events['ma'], 'ma', 0.5),
+                     (events['mn'], 'mn', 0.3),
+                     (events['mc'], 'mc', 0.2),
+                     (events['sunrise'], 'sunrise', 0.1),
                      ]
 
+        # Events that don't happen (e.g. no astronomical twilight in summer)
+        twilights = [t for t in twilights if t[0] is not None]
+
         twilights.sort(key=lambda x: x[0])
         final = {'sunset': 0.1, 'ec': 0.2, 'en': 0.3, 'ea': 0.5, 'ma': 0.3, 'mn': 0.2, 'mc': 0.1, 'sunrise': 0.0}
         twilights.append((self.end, 'end', final[twilights[-1][1]]))
 
         return twilights
 
+    def _bucket_seconds(self, axes):
+        """ Time covered by one pixel of `axes` """
+        if axes in self.hour_axes:
+            span = (self.lhend - self.lhstart).total_seconds()
+        else:
+            span = (self.end - self.start).total_seconds()
+        width = axes.get_position().width * self.fig.get_figwidth() * self.dpi
+
+        return span / max(width, 1.)
+
+    def _decimate_index(self, axes, x, y):
+        """ Rows of `x`, `y` to draw on `axes`, see `peas.decimate.minmax_indices` """
+        return minmax_indices(to_seconds(x), y, self._bucket_seconds(axes))
+
+    def _track(self, lines, data):
+        """ Keep `lines` (from `plot_date`) to be updated by `refresh`
+
+        `data` returns the current `(x, y)` of the lines. Long series are
+        reduced to the min and max of each pixel of the axes.
+        """
+        for line in lines:
+            self.tracked_lines.append((line, data))
+            self._set_line_data(line, *data())
+
+    def _set_line_data(self, line, x, y):
+        index = self._decimate_index(line.axes, x, y)
+        line.set_data(np.asarray(x)[index], np.asarray(y)[index])
+
+    def _dynamic(self, draw):
+        """ Draw artists with `draw`, removed and drawn again by `refresh` """
+        self.dynamic_artists.append([draw, draw()])
+
+    def _condition_fills(self, axes, base, values, condition, colors):
+        """ Fill below `values` where the `condition` column has each value
+
+        Args:
+            axes:               Axes to draw on.
+            base (float):       Bottom of the fill.
+            values (callable):  Returns the y values.
+            condition (str):    Condition code column, e.g. 'sky_condition_code'.
+            colors (list):      `(Condition, color)` pairs.
+        """
+        def draw():
+            y = np.asarray(values())
+            index = self._decimate_index(axes, self.time, y)
+            codes = np.asarray(self.table[condition])[index]
+            return [axes.fill_between(self.time[index], base, y[index], where=(codes == value),
+                                      color=color, alpha=0.5)
+                    for value, color in colors]
+
+        self._dynamic(draw)
+
+    def _annotate(self, axes, text, xy, xytext):
+        """ Annotation drawn from the current values, skipped if they are missing
+
+        Args:
+            axes:               Axes to draw on.
+            text (callable):    Returns the annotation text.
+            xy (callable):      Returns the annotated point.
+            xytext (callable):  Returns the text position.
+        """
+        def draw():
+            try:
+                return [axes.annotate(text(), xy=xy(), xytext=xytext(), size=16)]
+            except Exception:
+                return []
+
+        self._dynamic(draw)
+
+    def _now_line(self, axes, limits):
+        self._track(axes.plot_date([self.date, self.date], limits, 'g-', alpha=0.4),
+                    lambda: ([self.date, self.date], limits))
+
+    def _threshold_line(self, axes, name):
+        st = (self.thresholds or dict()).get(name, None)
+        if st:
+            self._track(axes.plot_date([self.start, self.end], [st, st], 'r-',
+                                       markersize=2, markeredgewidth=0, alpha=0.3,
+                                       drawstyle="default"),
+                        lambda: ([self.start, self.end], [st, st]))
+
+    def _current(self, name):
+        return self.current_values[name]
+
+    def _current_time(self):
+        return self.time[-1].to_pydatetime()
+
+    def _temp_diff(self):
+        return np.array(self.table['sky_temp_C']) - np.array(self.table['ambient_temp_C'])
+
+    def _rst_delta(self):
+        return np.array(self.table['rain_sensor_temp_C']) - np.array(self.table['ambient_temp_C'])
+
+    def _safe_value(self):
+        return np.array(self.table['safe'], dtype=int)
+
     def plot_ambient_vs_time(self):
         """ Ambient Temperature vs Time """
         print('Plot Ambient Temperature vs. Time')
 
         t_axes = plt.axes(self.plot_positions[0][0])
-        if self.today:
-            time_title = self.date
-        else:
-            time_title = self.end
-
-        plt.title('Weather for {} at {}'.format(self.date_string,
-                                                time_title.strftime('%H:%M:%S UT')))
+        self.day_axes.append(t_axes)
+        self.title = plt.title(self._title())
 
-        amb_temp = self.table['ambient_temp_C']
+        amb_temp = lambda: self.table['ambient_temp_C']
 
-        plt.plot_date(self.time, amb_temp, 'ko',
-                      markersize=2, markeredgewidth=0, drawstyle="default")
+        self._track(plt.plot_date(self.time, amb_temp(), 'ko',
+                                  markersize=2, markeredgewidth=0, drawstyle="default"),
+                    lambda: (self.time, amb_temp()))
 
-        try:
-            max_temp = max(amb_temp)
-            min_temp = min(amb_temp)
-            label_time = self.end - tdelta(0, 6 * 60 * 60)
-            label_temp = label_pos(self.cfg['amb_temp_limits'])
-            plt.annotate('Low: {:4.1f} $^\circ$C, High: {:4.1f} $^\circ$C'.format(
-                min_temp, max_temp),
-                xy=(label_time, max_temp),
-                xytext=(label_time, label_temp),
-                size=16,
-            )
-        except:
-            pass
+        label_temp = label_pos(self.cfg['amb_temp_limits'])
+        self._annotate(t_axes,
+                       lambda: 'Low: {:4.1f} $^\circ$C, High: {:4.1f} $^\circ$C'.format(
+                           np.nanmin(amb_temp()), np.nanmax(amb_temp())),
+                       lambda: (self.end - tdelta(0, 6 * 60 * 60), np.nanmax(amb_temp())),
+                       lambda: (self.end - tdelta(0, 6 * 60 * 60), label_temp))
 
         plt.ylabel("Ambient Temp. (C)")
         plt.grid(which='major', color='k')
@@ -266,31 +448,26 @@ class WeatherPlotter(object):
         t_axes.xaxis.set_major_locator(self.hours)
         t_axes.xaxis.set_major_formatter(self.hours_fmt)
 
-        for i, twi in enumerate(self.twilights):
-            if i > 0:
-                plt.axvspan(self.twilights[i - 1][0], self.twilights[i][0],
-                            ymin=0, ymax=1, color='blue', alpha=twi[2])
+        def twilight_spans():
+            return [t_axes.axvspan(self.twilights[i - 1][0], self.twilights[i][0],
+                                   ymin=0, ymax=1, color='blue', alpha=twi[2])
+                    for i, twi in enumerate(self.twilights) if i > 0]
+
+        self._dynamic(twilight_spans)
 
         if self.today:
             tlh_axes = plt.axes(self.plot_positions[0][1])
+            self.hour_axes.append(tlh_axes)
             plt.title('Last Hour')
-            plt.plot_date(self.time, amb_temp, 'ko',
-                          markersize=4, markeredgewidth=0,
-                          drawstyle="default")
-            plt.plot_date([self.date, self.date], self.cfg['amb_temp_limits'],
-                          'g-', alpha=0.4)
-            try:
-                current_amb_temp = self.current_values['data']['ambient_temp_C']
-                current_time = self.current_values['date']
-                label_time = current_time - tdelta(0, 58 * 60)
-                label_temp = label_pos(self.cfg['amb_temp_limits'])
-                tlh_axes.annotate('Currently: {:.1f} $^\circ$C'.format(current_amb_temp),
-                                  xy=(current_time, current_amb_temp),
-                                  xytext=(label_time, label_temp),
-                                  size=16,
-                                  )
-            except:
-                pass
+            self._track(plt.plot_date(self.time, amb_temp(), 'ko',
+                                      markersize=4, markeredgewidth=0,
+                                      drawstyle="default"),
+                        lambda: (self.time, amb_temp()))
+            self._now_line(tlh_axes, self.cfg['amb_temp_limits'])
+            self._annotate(tlh_axes,
+                           lambda: 'Currently: {:.1f} $^\circ$C'.format(self._current('ambient_temp_C')),
+                           lambda: (self._current_time(), self._current('ambient_temp_C')),
+                           lambda: (self._current_time() - tdelta(0, 58 * 60), label_temp))
 
             plt.grid(which='major', color='k')
             plt.yticks(range(-100, 100, 10))
@@ -304,32 +481,16 @@ class WeatherPlotter(object):
         """ Cloudiness vs Time """
         print('Plot Temperature Difference vs. Time')
         td_axes = plt.axes(self.plot_positions[1][0])
+        self.day_axes.append(td_axes)
 
-        sky_temp_C = self.table['sky_temp_C']
-        ambient_temp_C = self.table['ambient_temp_C']
-        sky_condition = self.table['sky_condition']
-
-        temp_diff = np.array(sky_temp_C) - np.array(ambient_temp_C)
+        sky_colors = [(Condition.CLEAR, 'green'), (Condition.CLOUDY, 'yellow'), (Condition.VERY_CLOUDY, 'red')]
 
-        plt.plot_date(self.time, temp_diff, 'ko-', label='Cloudiness',
-                      markersize=2, markeredgewidth=0,
-                      drawstyle="default")
-
-        wclear = [(x.strip() == 'Clear') for x in sky_condition.data]
-        plt.fill_between(self.time, -60, temp_diff, where=wclear, color='green', alpha=0.5)
-
-        wcloudy = [(x.strip() == 'Cloudy') for x in sky_condition.data]
-        plt.fill_between(self.time, -60, temp_diff, where=wcloudy, color='yellow', alpha=0.5)
-
-        wvcloudy = [(x.strip() == 'Very Cloudy') for x in sky_condition.data]
-        plt.fill_between(self.time, -60, temp_diff, where=wvcloudy, color='red', alpha=0.5)
-
-        if self.thresholds:
-            st = self.thresholds.get('threshold_very_cloudy', None)
-            if st:
-                plt.plot_date([self.start, self.end], [st, st], 'r-',
-                              markersize=2, markeredgewidth=0, alpha=0.3,
-                              drawstyle="default")
+        self._track(plt.plot_date(self.time, self._temp_diff(), 'ko-', label='Cloudiness',
+                                  markersize=2, markeredgewidth=0,
+                                  drawstyle="default"),
+                    lambda: (self.time, self._temp_diff()))
+        self._condition_fills(td_axes, -60, self._temp_diff, 'sky_condition_code', sky_colors)
+        self._threshold_line(td_axes, 'threshold_very_cloudy')
 
         plt.ylabel("Cloudiness")
         plt.grid(which='major', color='k')
@@ -342,37 +503,20 @@ class WeatherPlotter(object):
 
         if self.today:
             tdlh_axes = plt.axes(self.plot_positions[1][1])
-            tdlh_axes.plot_date(self.time, temp_diff, 'ko-',
-                                label='Cloudiness', markersize=4,
-                                markeredgewidth=0, drawstyle="default")
-            plt.fill_between(self.time, -60, temp_diff, where=wclear,
-                             color='green', alpha=0.5)
-            plt.fill_between(self.time, -60, temp_diff, where=wcloudy,
-                             color='yellow', alpha=0.5)
-            plt.fill_between(self.time, -60, temp_diff, where=wvcloudy,
-                             color='red', alpha=0.5)
-            plt.plot_date([self.date, self.date], self.cfg['cloudiness_limits'],
-                          'g-', alpha=0.4)
-
-            if self.thresholds:
-                st = self.thresholds.get('threshold_very_cloudy', None)
-                if st:
-                    plt.plot_date([self.start, self.end], [st, st], 'r-',
-                                  markersize=2, markeredgewidth=0, alpha=0.3,
-                                  drawstyle="default")
-
-            try:
-                current_cloudiness = self.current_values['data']['sky_condition']
-                current_time = self.current_values['date']
-                label_time = current_time - tdelta(0, 58 * 60)
-                label_temp = label_pos(self.cfg['cloudiness_limits'])
-                tdlh_axes.annotate('Currently: {:s}'.format(current_cloudiness),
-                                   xy=(current_time, label_temp),
-                                   xytext=(label_time, label_temp),
-                                   size=16,
-                                   )
-            except:
-                pass
+            self.hour_axes.append(tdlh_axes)
+            self._track(tdlh_axes.plot_date(self.time, self._temp_diff(), 'ko-',
+                                            label='Cloudiness', markersize=4,
+                                            markeredgewidth=0, drawstyle="default"),
+                        lambda: (self.time, self._temp_diff()))
+            self._condition_fills(tdlh_axes, -60, self._temp_diff, 'sky_condition_code', sky_colors)
+            self._now_line(tdlh_axes, self.cfg['cloudiness_limits'])
+            self._threshold_line(tdlh_axes, 'threshold_very_cloudy')
+
+            label_temp = label_pos(self.cfg['cloudiness_limits'])
+            self._annotate(tdlh_axes,
+                           lambda: 'Currently: {:s}'.format(condition_label(self._current('sky_condition_code'))),
+                           lambda: (self._current_time(), label_temp),
+                           lambda: (self._current_time() - tdelta(0, 58 * 60), label_temp))
 
             plt.grid(which='major', color='k')
             plt.yticks(range(-100, 100, 10))
@@ -387,54 +531,35 @@ class WeatherPlotter(object):
         """ Windspeed vs Time """
         print('Plot Wind Speed vs. Time')
         w_axes = plt.axes(self.plot_positions[2][0])
-
-        wind_speed = self.table['wind_speed_KPH']
-        wind_mavg = moving_average(wind_speed, 9)
-        matime, wind_mavg = moving_averagexy(self.time, wind_speed, 9)
-        wind_condition = self.table['wind_condition']
-
-        w_axes.plot_date(self.time, wind_speed, 'ko', alpha=0.5,
-                         markersize=2, markeredgewidth=0,
-                         drawstyle="default")
-        w_axes.plot_date(matime, wind_mavg, 'b-',
-                         label='Wind Speed',
-                         markersize=3, markeredgewidth=0,
-                         linewidth=3, alpha=0.5,
-                         drawstyle="default")
-        w_axes.plot_date([self.start, self.end], [0, 0], 'k-', ms=1)
-        wcalm = [(x.strip() == 'Calm') for x in wind_condition.data]
-        w_axes.fill_between(self.time, -5, wind_speed, where=wcalm,
-                            color='green', alpha=0.5)
-        wwindy = [(x.strip() == 'Windy') for x in wind_condition.data]
-        w_axes.fill_between(self.time, -5, wind_speed, where=wwindy,
-                            color='yellow', alpha=0.5)
-        wvwindy = [(x.strip() == 'Very Windy') for x in wind_condition.data]
-        w_axes.fill_between(self.time, -5, wind_speed, where=wvwindy,
-                            color='red', alpha=0.5)
-
-        if self.thresholds:
-            st = self.thresholds.get('threshold_very_windy', None)
-            if st:
-                plt.plot_date([self.start, self.end], [st, st], 'r-',
-                              markersize=2, markeredgewidth=0, alpha=0.3,
-                              drawstyle="default")
-            st = self.thresholds.get('threshold_very_gusty', None)
-            if st:
-                plt.plot_date([self.start, self.end], [st, st], 'r-',
-                              markersize=2, markeredgewidth=0, alpha=0.3,
-                              drawstyle="default")
-
-        try:
-            max_wind = max(wind_speed)
-            label_time = self.end - tdelta(0, 5 * 60 * 60)
-            label_wind = label_pos(self.cfg['wind_limits'])
-            w_axes.annotate('Max Gust: {:.1f} (km/h)'.format(max_wind),
-                            xy=(label_time, label_wind),
-                            xytext=(label_time, label_wind),
-                            size=16,
-                            )
-        except:
-            pass
+        self.day_axes.append(w_axes)
+
+        wind_speed = lambda: self.table['wind_speed_KPH']
+        wind_mavg = lambda: (self.time, time_smooth(to_seconds(self.time), wind_speed(),
+                                                    self.cfg.get('wind_smoothing', 300)))
+        wind_colors = [(Condition.CALM, 'green'), (Condition.WINDY, 'yellow'), (Condition.VERY_WINDY, 'red')]
+
+        self._track(w_axes.plot_date(self.time, wind_speed(), 'ko', alpha=0.5,
+                                     markersize=2, markeredgewidth=0,
+                                     drawstyle="default"),
+                    lambda: (self.time, wind_speed()))
+        matime, mavg = wind_mavg()
+        self._track(w_axes.plot_date(matime, mavg, 'b-',
+                                     label='Wind Speed',
+                                     markersize=3, markeredgewidth=0,
+                                     linewidth=3, alpha=0.5,
+                                     drawstyle="default"),
+                    wind_mavg)
+        self._track(w_axes.plot_date([self.start, self.end], [0, 0], 'k-', ms=1),
+                    lambda: ([self.start, self.end], [0, 0]))
+        self._condition_fills(w_axes, -5, wind_speed, 'wind_condition_code', wind_colors)
+        self._threshold_line(w_axes, 'threshold_very_windy')
+        self._threshold_line(w_axes, 'threshold_very_gusty')
+
+        label_wind = label_pos(self.cfg['wind_limits'])
+        self._annotate(w_axes,
+                       lambda: 'Max Gust: {:.1f} (km/h)'.format(np.nanmax(wind_speed())),
+                       lambda: (self.end - tdelta(0, 5 * 60 * 60), label_wind),
+                       lambda: (self.end - tdelta(0, 5 * 60 * 60), label_wind))
         plt.ylabel("Wind (km/h)")
         plt.grid(which='major', color='k')
 #         plt.yticks(range(0, 200, 10))
@@ -450,48 +575,28 @@ class WeatherPlotter(object):
 
         if self.today:
             wlh_axes = plt.axes(self.plot_positions[2][1])
-            wlh_axes.plot_date(self.time, wind_speed, 'ko', alpha=0.7,
-                               markersize=4, markeredgewidth=0,
-                               drawstyle="default")
-            wlh_axes.plot_date(matime, wind_mavg, 'b-',
-                               label='Wind Speed',
-                               markersize=2, markeredgewidth=0,
-                               linewidth=3, alpha=0.5,
-                               drawstyle="default")
-            wlh_axes.plot_date([self.start, self.end], [0, 0], 'k-', ms=1)
-            wlh_axes.fill_between(self.time, -5, wind_speed, where=wcalm,
-                                  color='green', alpha=0.5)
-            wlh_axes.fill_between(self.time, -5, wind_speed, where=wwindy,
-                                  color='yellow', alpha=0.5)
-            wlh_axes.fill_between(self.time, -5, wind_speed, where=wvwindy,
-                                  color='red', alpha=0.5)
-            plt.plot_date([self.date, self.date], self.cfg['wind_limits'],
-                          'g-', alpha=0.4)
-
-            if self.thresholds:
-                st = self.thresholds.get('threshold_very_windy', None)
-                if st:
-                    plt.plot_date([self.start, self.end], [st, st], 'r-',
-                                  markersize=2, markeredgewidth=0, alpha=0.3,
-                                  drawstyle="default")
-                st = self.thresholds.get('threshold_very_gusty', None)
-                if st:
-                    plt.plot_date([self.start, self.end], [st, st], 'r-',
-                                  markersize=2, markeredgewidth=0, alpha=0.3,
-                                  drawstyle="default")
-
-            try:
-                current_wind = self.current_values['data']['wind_speed_KPH']
-                current_time = self.current_values['date']
-                label_time = current_time - tdelta(0, 58 * 60)
-                label_wind = label_pos(self.cfg['wind_limits'])
-                wlh_axes.annotate('Currently: {:.0f} km/h'.format(current_wind),
-                                  xy=(current_time, current_wind),
-                                  xytext=(label_time, label_wind),
-                                  size=16,
-                                  )
-            except:
-                pass
+            self.hour_axes.append(wlh_axes)
+            self._track(wlh_axes.plot_date(self.time, wind_speed(), 'ko', alpha=0.7,
+                                           markersize=4, markeredgewidth=0,
+                                           drawstyle="default"),
+                        lambda: (self.time, wind_speed()))
+            self._track(wlh_axes.plot_date(matime, mavg, 'b-',
+                                           label='Wind Speed',
+                                           markersize=2, markeredgewidth=0,
+                                           linewidth=3, alpha=0.5,
+                                           drawstyle="default"),
+                        wind_mavg)
+            self._track(wlh_axes.plot_date([self.start, self.end], [0, 0], 'k-', ms=1),
+                        lambda: ([self.start, self.end], [0, 0]))
+            self._condition_fills(wlh_axes, -5, wind_speed, 'wind_condition_code', wind_colors)
+            self._now_line(wlh_axes, self.cfg['wind_limits'])
+            self._threshold_line(wlh_axes, 'threshold_very_windy')
+            self._threshold_line(wlh_axes, 'threshold_very_gusty')
+
+            self._annotate(wlh_axes,
+                           lambda: 'Currently: {:.0f} km/h'.format(self._current('wind_speed_KPH')),
+                           lambda: (self._current_time(), self._current('wind_speed_KPH')),
+                           lambda: (self._current_time() - tdelta(0, 58 * 60), label_wind))
             plt.grid(which='major', color='k')
 #             plt.yticks(range(0, 200, 10))
             plt.xlim(self.lhstart, self.lhend)
@@ -509,30 +614,17 @@ class WeatherPlotter(object):
 
         print('Plot Rain Frequency vs. Time')
         rf_axes = plt.axes(self.plot_positions[3][0])
+        self.day_axes.append(rf_axes)
 
-        rf_value = self.table['rain_frequency']
-        rain_condition = self.table['rain_condition']
-
-        rf_axes.plot_date(self.time, rf_value, 'ko-', label='Rain',
-                          markersize=2, markeredgewidth=0,
-                          drawstyle="default")
-
-        wdry = [(x.strip() == 'Dry') for x in rain_condition.data]
-        rf_axes.fill_between(self.time, 0, rf_value, where=wdry,
-                             color='green', alpha=0.5)
-        wwet = [(x.strip() == 'Wet') for x in rain_condition.data]
-        rf_axes.fill_between(self.time, 0, rf_value, where=wwet,
-                             color='orange', alpha=0.5)
-        wrain = [(x.strip() == 'Rain') for x in rain_condition.data]
-        rf_axes.fill_between(self.time, 0, rf_value, where=wrain,
-                             color='red', alpha=0.5)
-
-        if self.thresholds:
-            st = self.thresholds.get('threshold_wet', None)
-            if st:
-                plt.plot_date([self.start, self.end], [st, st], 'r-',
-                              markersize=2, markeredgewidth=0, alpha=0.3,
-                              drawstyle="default")
+        rf_value = lambda: self.table['rain_frequency']
+        rain_colors = [(Condition.DRY, 'green'), (Condition.WET, 'orange'), (Condition.RAIN, 'red')]
+
+        self._track(rf_axes.plot_date(self.time, rf_value(), 'ko-', label='Rain',
+                                      markersize=2, markeredgewidth=0,
+                                      drawstyle="default"),
+                    lambda: (self.time, rf_value()))
+        self._condition_fills(rf_axes, 0, rf_value, 'rain_condition_code', rain_colors)
+        self._threshold_line(rf_axes, 'threshold_wet')
 
         plt.ylabel("Rain Sensor")
         plt.grid(which='major', color='k')
@@ -544,34 +636,20 @@ class WeatherPlotter(object):
 
         if self.today:
             rflh_axes = plt.axes(self.plot_positions[3][1])
-            rflh_axes.plot_date(self.time, rf_value, 'ko-', label='Rain',
-                                markersize=4, markeredgewidth=0,
-                                drawstyle="default")
-            rflh_axes.fill_between(self.time, 0, rf_value, where=wdry,
-                                   color='green', alpha=0.5)
-            rflh_axes.fill_between(self.time, 0, rf_value, where=wwet,
-                                   color='orange', alpha=0.5)
-            rflh_axes.fill_between(self.time, 0, rf_value, where=wrain,
-                                   color='red', alpha=0.5)
-            plt.plot_date([self.date, self.date], self.cfg['rain_limits'],
-                          'g-', alpha=0.4)
-            if st:
-                plt.plot_date([self.start, self.end], [st, st], 'r-',
-                              markersize=2, markeredgewidth=0, alpha=0.3,
-                              drawstyle="default")
-
-            try:
-                current_rain = self.current_values['data']['rain_condition']
-                current_time = self.current_values['date']
-                label_time = current_time - tdelta(0, 58 * 60)
-                label_y = label_pos(self.cfg['rain_limits'])
-                rflh_axes.annotate('Currently: {:s}'.format(current_rain),
-                                   xy=(current_time, label_y),
-                                   xytext=(label_time, label_y),
-                                   size=16,
-                                   )
-            except:
-                pass
+            self.hour_axes.append(rflh_axes)
+            self._track(rflh_axes.plot_date(self.time, rf_value(), 'ko-', label='Rain',
+                                            markersize=4, markeredgewidth=0,
+                                            drawstyle="default"),
+                        lambda: (self.time, rf_value()))
+            self._condition_fills(rflh_axes, 0, rf_value, 'rain_condition_code', rain_colors)
+            self._now_line(rflh_axes, self.cfg['rain_limits'])
+            self._threshold_line(rflh_axes, 'threshold_wet')
+
+            label_y = label_pos(self.cfg['rain_limits'])
+            self._annotate(rflh_axes,
+                           lambda: 'Currently: {:s}'.format(condition_label(self._current('rain_condition_code'))),
+                           lambda: (self._current_time(), label_y),
+                           lambda: (self._current_time() - tdelta(0, 58 * 60), label_y))
             plt.grid(which='major', color='k')
             plt.ylim(self.cfg['rain_limits'])
             plt.xlim(self.lhstart, self.lhend)
@@ -585,18 +663,24 @@ class WeatherPlotter(object):
 
         print('Plot Safe/Unsafe vs. Time')
         safe_axes = plt.axes(self.plot_positions[4][0])
-
-        safe_value = [int(x) for x in self.table['safe']]
-
-        safe_axes.plot_date(self.time, safe_value, 'ko',
-                            markersize=2, markeredgewidth=0,
-                            drawstyle="default")
-        safe_axes.fill_between(self.time, -1, safe_value,
-                               where=(self.table['safe'].data),
-                               color='green', alpha=0.5)
-        safe_axes.fill_between(self.time, -1, safe_value,
-                               where=(~self.table['safe'].data),
-                               color='red', alpha=0.5)
+        self.day_axes.append(safe_axes)
+
+        def safe_fills(axes):
+            def draw():
+                safe_value = self._safe_value()
+                index = self._decimate_index(axes, self.time, safe_value)
+                safe = safe_value[index] > 0
+                return [axes.fill_between(self.time[index], -1, safe_value[index], where=safe,
+                                          color='green', alpha=0.5),
+                        axes.fill_between(self.time[index], -1, safe_value[index], where=~safe,
+                                          color='red', alpha=0.5)]
+            self._dynamic(draw)
+
+        self._track(safe_axes.plot_date(self.time, self._safe_value(), 'ko',
+                                        markersize=2, markeredgewidth=0,
+                                        drawstyle="default"),
+                    lambda: (self.time, self._safe_value()))
+        safe_fills(safe_axes)
         plt.ylabel("Safe")
         plt.xlim(self.start, self.end)
         plt.ylim(-0.1, 1.1)
@@ -609,30 +693,20 @@ class WeatherPlotter(object):
 
         if self.today:
             safelh_axes = plt.axes(self.plot_positions[4][1])
-            safelh_axes.plot_date(self.time, safe_value, 'ko-',
-                                  markersize=4, markeredgewidth=0,
-                                  drawstyle="default")
-            safelh_axes.fill_between(self.time, -1, safe_value,
-                                     where=(self.table['safe'].data),
-                                     color='green', alpha=0.5)
-            safelh_axes.fill_between(self.time, -1, safe_value,
-                                     where=(~self.table['safe'].data),
-                                     color='red', alpha=0.5)
-            plt.plot_date([self.date, self.date], [-0.1, 1.1],
-                          'g-', alpha=0.4)
-            try:
-                safe = self.current_values['data']['safe']
-                current_safe = {True: 'Safe', False: 'Unsafe'}[safe]
-                current_time = self.current_values['date']
-                label_time = current_time - tdelta(0, 58 * 60)
-                label_y = 0.35
-                safelh_axes.annotate('Currently: {:s}'.format(current_safe),
-                                     xy=(current_time, label_y),
-                                     xytext=(label_time, label_y),
-                                     size=16,
-                                     )
-            except:
-                pass
+            self.hour_axes.append(safelh_axes)
+            self._track(safelh_axes.plot_date(self.time, self._safe_value(), 'ko-',
+                                              markersize=4, markeredgewidth=0,
+                                              drawstyle="default"),
+                        lambda: (self.time, self._safe_value()))
+            safe_fills(safelh_axes)
+            self._now_line(safelh_axes, [-0.1, 1.1])
+
+            label_y = 0.35
+            self._annotate(safelh_axes,
+                           lambda: 'Currently: {:s}'.format({True: 'Safe', False: 'Unsafe'}[
+                               bool(self._current('safe'))]),
+                           lambda: (self._current_time(), label_y),
+                           lambda: (self._current_time() - tdelta(0, 58 * 60), label_y))
             plt.ylim(-0.1, 1.1)
             plt.yticks([0, 1])
             plt.grid(which='major', color='k')
@@ -655,22 +729,25 @@ class WeatherPlotter(object):
         rst_axes = pwm_axes.twinx()
         plt.ylim(-1, 21)
         plt.xlim(self.start, self.end)
+        self.day_axes.extend([pwm_axes, rst_axes])
 
-        pwm_value = self.table['pwm_value']
-        rst_delta = self.table['rain_sensor_temp_C'] - self.table['ambient_temp_C']
+        pwm_value = lambda: self.table['pwm_value']
 
-        rst_axes.plot_date(self.time, rst_delta, 'ro-', alpha=0.5,
-                           label='RST Delta (C)',
-                           markersize=2, markeredgewidth=0,
-                           drawstyle="default")
+        self._track(rst_axes.plot_date(self.time, self._rst_delta(), 'ro-', alpha=0.5,
+                                       label='RST Delta (C)',
+                                       markersize=2, markeredgewidth=0,
+                                       drawstyle="default"),
+                    lambda: (self.time, self._rst_delta()))
 
         # Add line with same style as above in order to get in to the legend
-        pwm_axes.plot_date([self.start, self.end], [-10, -10], 'ro-',
-                           markersize=2, markeredgewidth=0,
-                           label='RST Delta (C)')
-        pwm_axes.plot_date(self.time, pwm_value, 'bo-', label='Heater',
-                           markersize=2, markeredgewidth=0,
-                           drawstyle="default")
+        self._track(pwm_axes.plot_date([self.start, self.end], [-10, -10], 'ro-',
+                                       markersize=2, markeredgewidth=0,
+                                       label='RST Delta (C)'),
+                    lambda: ([self.start, self.end], [-10, -10]))
+        self._track(pwm_axes.plot_date(self.time, pwm_value(), 'bo-', label='Heater',
+                                       markersize=2, markeredgewidth=0,
+                                       drawstyle="default"),
+                    lambda: (self.time, pwm_value()))
         pwm_axes.xaxis.set_major_locator(self.hours)
         pwm_axes.xaxis.set_major_formatter(self.hours_fmt)
         pwm_axes.legend(loc='best')
@@ -684,17 +761,19 @@ class WeatherPlotter(object):
             rstlh_axes = pwmlh_axes.twinx()
             plt.ylim(-1, 21)
             plt.xlim(self.lhstart, self.lhend)
-            rstlh_axes.plot_date(self.time, rst_delta, 'ro-', alpha=0.5,
-                                 label='RST Delta (C)',
-                                 markersize=4, markeredgewidth=0,
-                                 drawstyle="default")
-            rstlh_axes.plot_date([self.date, self.date], [-1, 21],
-                                 'g-', alpha=0.4)
+            self.hour_axes.extend([pwmlh_axes, rstlh_axes])
+            self._track(rstlh_axes.plot_date(self.time, self._rst_delta(), 'ro-', alpha=0.5,
+                                             label='RST Delta (C)',
+                                             markersize=4, markeredgewidth=0,
+                                             drawstyle="default"),
+                        lambda: (self.time, self._rst_delta()))
+            self._now_line(rstlh_axes, [-1, 21])
             rstlh_axes.xaxis.set_ticklabels([])
             rstlh_axes.yaxis.set_ticklabels([])
-            pwmlh_axes.plot_date(self.time, pwm_value, 'bo', label='Heater',
-                                 markersize=4, markeredgewidth=0,
-                                 drawstyle="default")
+            self._track(pwmlh_axes.plot_date(self.time, pwm_value(), 'bo', label='Heater',
+                                             markersize=4, markeredgewidth=0,
+                                             drawstyle="default"),
+                        lambda: (self.time, pwm_value()))
             pwmlh_axes.xaxis.set_major_locator(self.mins)
             pwmlh_axes.xaxis.set_major_formatter(self.mins_fmt)
             pwmlh_axes.yaxis.set_ticklabels([])
@@ -714,25 +793,68 @@ class WeatherPlotter(object):
         self.fig.savefig(plot_filename, dpi=self.dpi, bbox_inches='tight', pad_inches=0.10)
 
 
-def moving_average(interval, window_size):
-    """ A simple moving average function """
-    if window_size > len(interval):
-        window_size = len(interval)
-    window = np.ones(int(window_size)) / float(window_size)
-    return np.convolve(interval, window, 'same')
+def _plot_day(date_string, paths, first, last, plot_file):
+    """ Plot one day of a `plot_range` batch, run in a worker process """
+    table = table_from_columns(open_columns(paths, first, last))
+
+    wp = WeatherPlotter(date_string=date_string, table=table)
+    wp.make_plot(plot_file)
+    plt.close(wp.fig)
+
+    return date_string, len(table)
+
+
+def plot_range(start_date, end_date, plot_dir=None, processes=None):
+    """ Plot every UT day from `start_date` to `end_date` (inclusive)
 
+    The whole range is loaded with one query and split by day. The columns
+    are written once to memory-mapped files that the worker processes slice,
+    so no day's data is pickled to the workers.
 
-def moving_averagexy(x, y, window_size):
-    if window_size > len(y):
-        window_size = len(y)
-    if window_size % 2 == 0:
-        window_size += 1
-    nxtrim = int((window_size - 1) / 2)
-    window = np.ones(int(window_size)) / float(window_size)
-    yma = np.convolve(y, window, 'valid')
-    xma = x[2 * nxtrim:]
-    assert len(xma) == len(yma)
-    return xma, yma
+    Args:
+        start_date (str):   First day, `YYYYMMDD` or `YYYY-MM-DD`.
+        end_date (str):     Last day.
+        plot_dir (str):     Where to save `<YYYYMMDD>UT.png`, default
+            `$PANDIR/weather_plots`.
+        processes (int):    Worker processes, default one per CPU.
+
+    Returns:
+        list: `(date_string, entries)` of the days plotted.
+    """
+    from pocs.utils.config import load_config as pocs_config
+    from pocs.utils.database import PanMongo
+
+    start = date_parser(start_date)
+    end = date_parser(end_date) + tdelta(days=1)
+
+    # Compute any missing ephemeris year here, once, rather than in every worker
+    get_ephemeris(load_config(), location=pocs_config()['location']).rows(start, end)
+
+    print('Loading weather from {} to {}'.format(start.date(), (end - tdelta(days=1)).date()))
+    arrays = load_columns(PanMongo(), start - tdelta(microseconds=1), end)
+    order = np.argsort(arrays['date'], kind='mergesort')
+    arrays = {name: values[order] for name, values in arrays.items()}
+    days = split_days(arrays['date'])
+    print('  Retrieved {} entries for {} days'.format(len(arrays['date']), len(days)))
+
+    plotted = list()
+    with tempfile.TemporaryDirectory(prefix='plot_weather_') as tmp_dir:
+        paths = share_columns(arrays, tmp_dir)
+        del arrays
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = list()
+            for day, first, last in days:
+                date_string = '{}UT'.format(day)
+                plot_file = None
+                if plot_dir is not None:
+                    plot_file = os.path.join(plot_dir, '{}.png'.format(date_string))
+                futures.append(pool.submit(_plot_day, date_string, paths, first, last, plot_file))
+
+            for future in futures:
+                plotted.append(future.result())
+
+    return plotted
 
 
 if __name__ == '__main__':
@@ -745,11 +867,35 @@ if __name__ == '__main__':
                         help="Filename for data file")
     parser.add_argument("-o", "--plot_file", type=str, dest="plot_file", default=None,
                         help="Filename for generated plot")
+    parser.add_argument("--start-date", type=str, dest="start_date", default=None,
+                        help="[yyyy-mm-dd] Plot every day from here to --end-date in one batch")
+    parser.add_argument("--end-date", type=str, dest="end_date", default=None,
+                        help="[yyyy-mm-dd] Last day of the batch, defaults to --start-date")
+    parser.add_argument("--plot-dir", type=str, dest="plot_dir", default=None,
+                        help="Directory for batch plots, defaults to $PANDIR/weather_plots")
+    parser.add_argument("--processes", type=int, default=None, help="Batch worker processes, default one per CPU")
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache", default=True,
+                        help="Always query mongo, even for finished days")
+    parser.add_argument("--daemon", action="store_true", default=False,
+                        help="Keep running and refresh the today plot every --interval seconds")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between refreshes in daemon mode")
     parser.add_argument('--plotly-user', help="Username for plotly publishing")
     parser.add_argument('--plotly-api-key', help="API for plotly publishing")
     args = parser.parse_args()
 
-    wp = WeatherPlotter(date_string=args.date, data_file=args.data_file)
+    if args.daemon and (args.date is not None or args.data_file is not None):
+        parser.error("--daemon refreshes the today plot from mongo, it can't be used with --date or --file")
+
+    if args.start_date is not None:
+        plot_range(args.start_date, args.end_date or args.start_date,
+                   plot_dir=args.plot_dir, processes=args.processes)
+        sys.exit(0)
+
+    wp = WeatherPlotter(date_string=args.date, data_file=args.data_file, use_cache=args.use_cache)
+
+    if args.daemon:
+        wp.run(args.plot_file, interval=args.interval)
+
     wp.make_plot(args.plot_file)
 
     if args.plotly_user and args.plotly_api_key:
@@ -144,6 +144,8 @@ if __name__ == '__main__':
     parser.add_argument('--plotly-stream', action='store_true', default=False, help="Stream to plotly")
     parser.add_argument('--store-mongo', action='store_true', default=True, help="Save to mongo")
     parser.add_argument('--send-message', action='store_true', default=True, help="Send message")
+    parser.add_argument('--store', action='store_true', default=False, dest='use_store',
+                        help="Append to the local column store")
     args = parser.parse_args()
 
     # Weather object
@@ -154,7 +156,7 @@ if __name__ == '__main__':
         streams = get_plot(filename=args.filename)
 
     while True:
-        data = aag.capture(use_mongo=args.store_mongo, send_message=args.send_message)
+        data = aag.capture(use_mongo=args.store_mongo, send_message=args.send_message, use_store=args.use_store)
 
         # Save to file
         if args.filename is not None:
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+import numpy as np
+
+from datetime import timedelta as tdelta
+from dateutil.parser import parse as date_parser
+
+import matplotlib as mpl
+mpl.use('Agg')
+from matplotlib import pyplot as plt
+
+from peas import load_config
+from peas import climatology
+from peas.ephemeris import get_ephemeris
+from peas.export import read_export
+from peas.tables import columns_from_documents
+from peas.tables import load_columns
+
+
+def load_weather(start, end, files=None):
+    """ Report columns from mongo (one range query) or export files """
+    if files:
+        docs = [doc for fn in files for doc in read_export(fn)]
+        arrays = columns_from_documents(docs, climatology.REPORT_COLUMNS)
+        keep = (arrays['date'] >= np.datetime64(start)) & (arrays['date'] < np.datetime64(end))
+        arrays = {name: values[keep] for name, values in arrays.items()}
+    else:
+        from pocs.utils.database import PanMongo
+        arrays = load_columns(PanMongo(), start, end, climatology.REPORT_COLUMNS)
+
+    order = np.argsort(arrays['date'], kind='mergesort')
+    return {name: values[order] for name, values in arrays.items()}
+
+
+def plot_heatmap(table, title, fn, cmap='viridis'):
+    fig, ax = plt.subplots(figsize=(12, 5))
+    # One row per entry of the index, which need not be contiguous
+    image = ax.imshow(table.values, aspect='auto', origin='lower', vmin=0, vmax=1, cmap=cmap,
+                      extent=(table.columns[0] - 0.5, table.columns[-1] + 0.5, -0.5, len(table.index) - 0.5))
+    ax.set_yticks(range(len(table.index)))
+    ax.set_yticklabels(table.index)
+    ax.set_xlabel('Hour (UT)')
+    ax.set_ylabel('Month')
+    ax.set_title(title)
+    fig.colorbar(image, ax=ax)
+    fig.savefig(fn, bbox_inches='tight')
+    plt.close(fig)
+
+
+def plot_nights(nights, fn):
+    fig, axes = plt.subplots(2, 1, figsize=(14, 7), sharex=True)
+    axes[0].bar(nights['start'], nights['safe_fraction'], width=1., color='green')
+    axes[0].set_ylabel('Safe fraction')
+    axes[0].set_ylim(0, 1)
+    axes[1].plot(nights['start'], nights['wind_mean'], 'b-', label='Mean')
+    axes[1].plot(nights['start'], nights['wind_max'], 'r.', label='Max')
+    axes[1].set_ylabel('Wind (km/h)')
+    axes[1].legend(loc='best')
+    fig.savefig(fn, bbox_inches='tight')
+    plt.close(fig)
+
+
+def plot_wind(wind, fn):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for column, style in [('50%', 'b-o'), ('90%', 'g-o'), ('99%', 'r-o'), ('max', 'k:')]:
+        ax.plot(wind.index, wind[column], style, label=column)
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Night wind speed (km/h)')
+    ax.set_xticks(range(1, 13))
+    ax.legend(loc='best')
+    fig.savefig(fn, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main(start_date=None, end_date=None, files=None, output_dir='.', ephemeris_dir=None, **kwargs):
+    config = load_config()
+
+    start = date_parser(start_date)
+    end = date_parser(end_date) + tdelta(days=1)
+    os.makedirs(output_dir, exist_ok=True)
+
+    location = config.get('location', None)
+    if location is None:
+        from pocs.utils.config import load_config as pocs_config
+        location = pocs_config()['location']
+
+    timer = time.time()
+    arrays = load_weather(start, end, files=files)
+    print('Loaded {} records in {:.1f} s'.format(len(arrays['date']), time.time() - timer))
+
+    timer = time.time()
+    # One extra day so the last night has its morning twilight
+    ephemeris = get_ephemeris(config, location=location, directory=ephemeris_dir)
+    starts, ends = climatology.night_intervals(ephemeris.rows(start - tdelta(days=1), end + tdelta(days=1)))
+
+    frame = climatology.to_frame(arrays, starts, ends)
+    nights = climatology.night_summary(frame, starts, ends)
+    clear = climatology.hourly_fractions(frame, 'clear')
+    wet = climatology.hourly_fractions(frame, 'wet')
+    wind = climatology.wind_by_month(frame)
+    print('Aggregated {} nights in {:.1f} s'.format(len(nights), time.time() - timer))
+
+    tag = '{:%Y%m%d}_{:%Y%m%d}'.format(start, end - tdelta(days=1))
+    nights.to_csv(os.path.join(output_dir, 'nights_{}.csv'.format(tag)))
+    clear.to_csv(os.path.join(output_dir, 'clear_by_hour_{}.csv'.format(tag)))
+    wet.to_csv(os.path.join(output_dir, 'wet_by_hour_{}.csv'.format(tag)))
+    wind.to_csv(os.path.join(output_dir, 'wind_by_month_{}.csv'.format(tag)))
+
+    if len(nights) > 0:
+        plot_nights(nights, os.path.join(output_dir, 'nights_{}.png'.format(tag)))
+        plot_heatmap(clear, 'Clear fraction', os.path.join(output_dir, 'clear_by_hour_{}.png'.format(tag)))
+        plot_heatmap(wet, 'Wet or rain fraction', os.path.join(output_dir, 'wet_by_hour_{}.png'.format(tag)),
+                     cmap='Blues')
+        plot_wind(wind, os.path.join(output_dir, 'wind_by_month_{}.png'.format(tag)))
+
+    print('  {} nights, median safe fraction {:.2f}, written to {}'.format(
+          len(nights), nights['safe_fraction'].median(), output_dir))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Site climatology from the weather archive.")
+    parser.add_argument('files', nargs='*', help="Mongo export files (json or json.gz), default query mongo")
+    parser.add_argument("-s", "--start-date", type=str, dest="start_date", required=True,
+                        help="[yyyy-mm-dd] First UT day")
+    parser.add_argument("-e", "--end-date", type=str, dest="end_date", required=True,
+                        help="[yyyy-mm-dd] Last UT day")
+    parser.add_argument("-o", "--output-dir", type=str, dest="output_dir", default='.',
+                        help="Directory for the tables and figures")
+    parser.add_argument("--ephemeris-dir", type=str, dest="ephemeris_dir", default=None,
+                        help="Ephemeris table directory, default <directories.data>/ephemeris")
+    args = parser.parse_args()
+
+    main(**vars(args))